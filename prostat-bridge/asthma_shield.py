@@ -24,14 +24,24 @@ Usage:
 """
 
 import asyncio
+import json
 import logging
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+import aiohttp
 from blueair_api import get_blueair_account
 from aiohomekit.controller import Controller
 from aiohomekit.exceptions import AccessoryNotFoundError
-import serial
-import serial.tools.list_ports
+from hap_map import load_characteristic_map
+from jobs import JobScheduler
+from json_store import save_json, state_path
+from relay_transport import RelayTransport, find_relay_port
+from relay_scheduler import RelayScheduler
+from sampler import AdaptiveSampler, Watch
+from startup import Startup
+from state import CATEGORIES, SystemState, recorded_fields
+from tsdb import TimeSeriesStore
 
 # Configure logging
 logging.basicConfig(
@@ -52,12 +62,51 @@ PM25_THRESHOLD_MEDIUM = 5  # µg/m³ - Medium filtration if occupied
 HUMIDITY_HIGH = 55  # % - Turn on dehumidifier
 HUMIDITY_LOW = 45  # % - Turn off dehumidifier
 
+# Dehumidifier compressor protection
+RELAY_MIN_ON = 300  # seconds - minimum runtime once started
+RELAY_MIN_OFF = 180  # seconds - minimum rest before restarting
+
 # Circulation Kick
 CIRCULATION_KICK_INTERVAL = 60  # minutes - Run every hour
 CIRCULATION_KICK_PM25_THRESHOLD = 2  # µg/m³ - Only if air is clean
-
-# Polling Interval
-MAIN_LOOP_INTERVAL = 60  # seconds
+CIRCULATION_KICK_DURATION = 300  # seconds - How long the fan runs
+
+# Sensor reads: sources not answering within this are skipped for the cycle
+CYCLE_READ_DEADLINE = 10  # seconds
+
+# Polling Interval (adaptive, see sampler.py)
+MAIN_LOOP_INTERVAL = 60  # seconds - base interval
+MIN_LOOP_INTERVAL = 10  # seconds - near a threshold or heading for one
+MAX_LOOP_INTERVAL = 300  # seconds - readings flat (e.g. overnight)
+
+# Sampler status (interval, wake reasons) exported for dashboards
+STATUS_FILE = state_path('shield-status.json')
+STATUS_WRITE_INTERVAL = 60  # seconds
+
+# Optional: follow the bridge's change stream (server.py /api/stream) and run
+# the control cycle as soon as occupancy or readings posted to
+# /api/system-state change. Occupancy and outdoor temperature are taken over.
+BRIDGE_URL = os.getenv('BRIDGE_URL')  # e.g. http://localhost:8080
+BRIDGE_FIELDS = ('occupancy', 'outdoor_temp')
+BRIDGE_WAKE_FIELDS = ('occupancy', 'outdoor_temp', 'indoor_humidity', 'indoor_temp', 'pm25', 'tvoc')
+
+# History: one row per control cycle in an on-disk store (see tsdb.py),
+# separate from the bridge's (server.py) store
+HISTORY_STORE_DIR = os.getenv('SHIELD_HISTORY_DIR', state_path('shield-history'))
+HISTORY_FLUSH_INTERVAL = 300  # seconds - batch writes to spare the SD card
+HISTORY_RETENTION_DAYS = 400
+
+# HomeKit Events
+HAP_EVENTS_ENABLED = os.getenv('HAP_EVENTS', '1') != '0'  # Push instead of poll
+EVENT_DEBOUNCE = 2  # seconds - let a burst of events settle before reacting
+EVENT_MIRROR_MAX_AGE = 600  # seconds - re-read a value this old (lost subscription)
+
+# Startup: systems initialize concurrently, each attempt within its deadline
+# (seconds), and retry in the background. The first cycle waits at most
+# STARTUP_GRACE for them; a system ready later wakes the loop.
+INIT_DEADLINES = {'ecobee': 15, 'blueair': 20, 'relay': 5}
+INIT_RETRY_INTERVAL = 30  # seconds - doubles per failed attempt, up to 10 minutes
+STARTUP_GRACE = 5  # seconds
 
 # ============================================================================
 # Global State
@@ -67,6 +116,28 @@ MAIN_LOOP_INTERVAL = 60  # seconds
 ecobee_controller = None
 ecobee_pairing = None
 ecobee_device_id = None
+ecobee_subscribed = False
+ecobee_chars = {}  # name -> (aid, iid), resolved by type UUID
+ecobee_live = {}  # name -> (value, monotonic time), kept current by events
+
+# Control loop cadence: shortens near thresholds, backs off when flat and
+# wakes early on pushed events
+sampler = AdaptiveSampler(
+    [
+        Watch('pm25', (PM25_THRESHOLD_MEDIUM, PM25_THRESHOLD_HIGH), margin=1.0, flat_rate=0.5),
+        Watch('indoor_humidity', (HUMIDITY_LOW, HUMIDITY_HIGH), margin=1.5, flat_rate=0.2),
+    ],
+    base_interval=MAIN_LOOP_INTERVAL,
+    min_interval=MIN_LOOP_INTERVAL,
+    max_interval=MAX_LOOP_INTERVAL,
+    settle=EVENT_DEBOUNCE,  # Let a burst of events settle before reacting
+)
+bridge_task = None
+startup = Startup(INIT_RETRY_INTERVAL, on_ready=lambda name: sampler.wake(f"{name} ready"))
+
+# Timed sequences (Circulation Kick) run beside the control loop
+jobs = JobScheduler()
+STARTED_AT = datetime.now()  # Seeds the first circulation kick (top of the next hour)
 
 # Blueair
 blueair_account = None
@@ -74,27 +145,35 @@ blueair_devices = []
 blueair_connected = False
 
 # Relay (Dehumidifier)
-relay_port = None
-relay_connected = False
+relay = RelayTransport()  # Serial I/O runs on its own thread
 relay_channel = 2  # Default: Relay 2 for dehumidifier
 
-# System State
-system_state = {
-    'pm25': None,
-    'tvoc': None,
-    'humidity': None,
-    'temperature': None,
-    'occupancy': False,
-    'last_circulation_kick': None,
-}
-
-# Characteristic IDs for Ecobee (adjust based on your device)
-ECOBEE_AID = 1
-ECOBEE_TEMP_CURRENT = 10
-ECOBEE_HUMIDITY = 11  # May need adjustment
-ECOBEE_TARGET_STATE = 12
-ECOBEE_CURRENT_STATE = 13
-ECOBEE_FAN_MODE = 14  # May need adjustment
+
+def on_relay_change(channel, on):
+    if channel == relay_channel:
+        system_state.dehumidifier_on = on
+
+
+relay_scheduler = RelayScheduler(relay, RELAY_MIN_ON, RELAY_MIN_OFF, on_change=on_relay_change)  # Drops no-op writes
+
+# System State (same schema as server.py, see state.py)
+system_state = SystemState()
+history_store = TimeSeriesStore(HISTORY_STORE_DIR, recorded_fields(SystemState.FIELDS), CATEGORIES,
+                                HISTORY_FLUSH_INTERVAL, HISTORY_RETENTION_DAYS)
+
+# Ecobee characteristics mirrored via HomeKit events. Their (aid, iid) are
+# resolved by HomeKit type UUID when the pairing is loaded (see hap_map.py).
+ECOBEE_EVENT_CHARACTERISTICS = [
+    'temperature',
+    'target_temperature',
+    'target_mode',
+    'current_mode',
+    'humidity',
+]
+
+# Ecobee characteristics read each control cycle (one HAP request for
+# whichever aren't current in the event mirror)
+ECOBEE_CYCLE_CHARACTERISTICS = ('humidity', 'temperature', 'target_mode', 'current_mode')
 
 
 # ============================================================================
@@ -102,24 +181,33 @@ ECOBEE_FAN_MODE = 14  # May need adjustment
 # ============================================================================
 
 async def init_ecobee():
-    """Initialize Ecobee HomeKit connection"""
-    global ecobee_controller, ecobee_pairing, ecobee_device_id
+    """
+    Initialize Ecobee HomeKit connection
+    
+    Returns:
+        True if connected, False on failure (retried), None if not configured
+    """
+    global ecobee_controller, ecobee_pairing, ecobee_device_id, ecobee_chars
     
     try:
         # Get device ID from environment or config
         device_id = os.getenv('ECOBEE_DEVICE_ID')
         if not device_id:
             logger.warning("ECOBEE_DEVICE_ID not set. Ecobee control disabled.")
-            return False
+            return None
         
-        ecobee_controller = Controller()
-        await ecobee_controller.async_start()
+        if ecobee_controller is None:  # Kept across retries
+            controller = Controller()
+            await controller.async_start()
+            ecobee_controller = controller
         
         # Load existing pairing
         try:
             ecobee_pairing = await ecobee_controller.async_load_pairing(device_id)
             ecobee_device_id = device_id
+            ecobee_chars = await load_characteristic_map(device_id, ecobee_pairing)
             logger.info(f"Ecobee connected: {device_id}")
+            await subscribe_ecobee()
             return True
         except Exception as e:
             logger.error(f"Failed to load Ecobee pairing: {e}")
@@ -129,8 +217,59 @@ async def init_ecobee():
         return False
 
 
+def on_ecobee_events(events):
+    """Store pushed characteristic values and wake the control loop"""
+    names = {ecobee_chars[name]: name for name in ECOBEE_EVENT_CHARACTERISTICS if name in ecobee_chars}
+    now = time.monotonic()
+    changed = []
+    for key, event in events.items():
+        if key in names and 'value' in event:
+            ecobee_live[names[key]] = (event['value'], now)
+            changed.append(names[key])
+    
+    if changed:
+        sampler.wake(f"thermostat event ({', '.join(changed)})")
+
+
+async def subscribe_ecobee():
+    """Subscribe to Ecobee characteristic events (falls back to polling on failure)"""
+    global ecobee_subscribed
+    
+    if not HAP_EVENTS_ENABLED or not ecobee_pairing:
+        return False
+    
+    try:
+        ecobee_pairing.dispatcher_connect(on_ecobee_events)
+        await ecobee_pairing.subscribe([
+            ecobee_chars[name] for name in ECOBEE_EVENT_CHARACTERISTICS if name in ecobee_chars
+        ])
+        ecobee_subscribed = True
+        logger.info("Subscribed to Ecobee characteristic events")
+        return True
+    except Exception as e:
+        logger.warning(f"Ecobee event subscription failed, polling instead: {e}")
+        ecobee_subscribed = False
+        return False
+
+
+def get_ecobee_live_value(name):
+    """Return a value from the event mirror, or None if not subscribed or too old"""
+    if not ecobee_subscribed or name not in ecobee_live:
+        return None
+    
+    value, received_at = ecobee_live[name]
+    if time.monotonic() - received_at > EVENT_MIRROR_MAX_AGE:
+        return None
+    return value
+
+
 async def init_blueair():
-    """Initialize Blueair connection"""
+    """
+    Initialize Blueair connection
+    
+    Returns:
+        True if connected, False on failure (retried), None if not configured
+    """
     global blueair_account, blueair_devices, blueair_connected
     
     try:
@@ -139,7 +278,7 @@ async def init_blueair():
         
         if not username or not password:
             logger.warning("Blueair credentials not set. Blueair control disabled.")
-            return False
+            return None
         
         blueair_account = await get_blueair_account(username=username, password=password)
         blueair_devices = blueair_account.devices
@@ -152,46 +291,72 @@ async def init_blueair():
         return False
 
 
-def find_relay_port():
-    """Find USB relay module (CH340)"""
-    ports = serial.tools.list_ports.comports()
-    for port in ports:
-        if 'CH340' in port.description or 'CH340' in port.manufacturer:
-            return port.device
-        if port.vid == 0x1a86 and port.pid == 0x7523:  # CH340 VID/PID
-            return port.device
-    return None
-
-
 async def init_relay():
-    """Initialize USB relay connection"""
-    global relay_port, relay_connected
-    
+    """Initialize USB relay connection and start the hot-plug supervisor"""
+    connected = False
     try:
-        port_path = find_relay_port()
-        if not port_path:
-            logger.warning("No USB relay module found. Dehumidifier control disabled.")
-            return False
-        
-        relay_port = serial.Serial(
-            port_path,
-            baudrate=9600,
-            timeout=1,
-            write_timeout=1
-        )
-        relay_connected = True
-        logger.info(f"USB relay connected on {port_path}")
-        return True
+        port_path = os.getenv('RELAY_PORT') or find_relay_port()
+        if port_path:
+            await relay.open(port_path)
+            connected = True
+        else:
+            logger.warning("No USB relay module found - waiting for it to be plugged in")
     except Exception as e:
         logger.error(f"Failed to connect to relay: {e}")
-        relay_connected = False
-        return False
+    finally:
+        # Also when a startup deadline cancels the open
+        relay.start_supervisor(on_reconnect=replay_relay_states, pinned_path=os.getenv('RELAY_PORT'))
+    return connected
+
+
+async def replay_relay_states():
+    """Restore the dehumidifier state after the relay board is replugged"""
+    commands = await relay_scheduler.replay()
+    if commands:
+        logger.info(f"Replayed relay states: {commands}")
 
 
 # ============================================================================
 # Sensor Reading Functions
 # ============================================================================
 
+async def read_ecobee_characteristics(names):
+    """
+    Read several Ecobee characteristics by name in one HAP request
+    
+    Values current in the event mirror are served from it; only the rest
+    are fetched. Characteristics the thermostat doesn't expose are None.
+    
+    Returns:
+        {name: value}
+    """
+    values = {}
+    keys = {}
+    for name in names:
+        live = get_ecobee_live_value(name)
+        if live is not None:
+            values[name] = live
+        elif name in ecobee_chars:
+            keys[ecobee_chars[name]] = name
+        else:
+            values[name] = None
+    
+    if keys:
+        data = await ecobee_pairing.async_get_characteristics(list(keys))
+        now = time.monotonic()
+        for key, name in keys.items():
+            value = data.get(key, {}).get('value')
+            if value is not None:
+                ecobee_live[name] = (value, now)
+            values[name] = value
+    return values
+
+
+async def read_ecobee_characteristic(name):
+    """Read one Ecobee characteristic by name (see read_ecobee_characteristics)"""
+    return (await read_ecobee_characteristics([name]))[name]
+
+
 async def get_ecobee_humidity():
     """Get humidity from Ecobee"""
     global ecobee_pairing
@@ -200,16 +365,7 @@ async def get_ecobee_humidity():
         return None
     
     try:
-        # Read humidity characteristic
-        # Note: Ecobee may expose humidity differently - adjust iid as needed
-        data = await ecobee_pairing.async_get_characteristics([
-            (ECOBEE_AID, ECOBEE_HUMIDITY)
-        ])
-        
-        key = (ECOBEE_AID, ECOBEE_HUMIDITY)
-        if key in data:
-            return data[key].get('value')
-        return None
+        return await read_ecobee_characteristic('humidity')
     except Exception as e:
         logger.error(f"Error reading Ecobee humidity: {e}")
         return None
@@ -223,25 +379,18 @@ async def get_ecobee_temperature():
         return None
     
     try:
-        data = await ecobee_pairing.async_get_characteristics([
-            (ECOBEE_AID, ECOBEE_TEMP_CURRENT)
-        ])
-        
-        key = (ECOBEE_AID, ECOBEE_TEMP_CURRENT)
-        if key in data:
-            return data[key].get('value')
-        return None
+        return await read_ecobee_characteristic('temperature')
     except Exception as e:
         logger.error(f"Error reading Ecobee temperature: {e}")
         return None
 
 
 async def get_ecobee_occupancy():
-    """Get occupancy status from Ecobee motion sensors"""
+    """Get occupancy status from Ecobee motion sensors (None if unavailable)"""
     global ecobee_pairing
     
     if not ecobee_pairing:
-        return False
+        return None
     
     try:
         # Ecobee motion sensors are typically exposed as separate accessories
@@ -250,10 +399,10 @@ async def get_ecobee_occupancy():
         
         # Placeholder: Check if we can get occupancy from system state
         # This would need to be implemented based on your specific Ecobee setup
-        return system_state.get('occupancy', False)
+        return system_state.occupancy
     except Exception as e:
         logger.error(f"Error reading Ecobee occupancy: {e}")
-        return False
+        return None
 
 
 async def get_blueair_pm25():
@@ -277,7 +426,7 @@ async def get_blueair_pm25():
         # return sensor_data.get('pm25')
         
         # Placeholder: Return from system state if available
-        return system_state.get('pm25')
+        return system_state.pm25
     except Exception as e:
         logger.error(f"Error reading Blueair PM2.5: {e}")
         return None
@@ -292,12 +441,73 @@ async def get_blueair_tvoc():
     
     try:
         # Similar to PM2.5 - adjust based on actual API
-        return system_state.get('tvoc')
+        return system_state.tvoc
     except Exception as e:
         logger.error(f"Error reading Blueair tVOC: {e}")
         return None
 
 
+async def read_ecobee_snapshot():
+    """Every Ecobee reading the control cycle uses, in one HAP request"""
+    if not ecobee_pairing:
+        return {}
+    
+    values = await read_ecobee_characteristics(ECOBEE_CYCLE_CHARACTERISTICS)
+    snapshot = {
+        'indoor_humidity': values['humidity'],
+        'indoor_temp': values['temperature'],
+    }
+    if values['target_mode'] is not None:
+        snapshot['hvac_mode'] = {0: 'off', 1: 'heat', 2: 'cool', 3: 'auto'}.get(values['target_mode'], 'off')
+    if values['current_mode'] is not None:
+        snapshot['hvac_running'] = values['current_mode'] in (1, 2)
+    return snapshot
+
+
+async def read_sensor_snapshot():
+    """
+    Read all sensors for one control cycle, concurrently
+    
+    The Ecobee readings come from one HAP request and each Blueair reading
+    is fetched alongside it. Whatever isn't back within
+    CYCLE_READ_DEADLINE is cancelled. A failed or late source, or one
+    without a value (None), is left out of the readings, so updating
+    system_state with them keeps its last known value instead of a default.
+    
+    Returns:
+        (readings, missing) - readings keyed by system_state field (only
+        fields actually read), and {source: 'timeout' | error message} for
+        the sources that failed
+    """
+    sources = {
+        'ecobee': read_ecobee_snapshot(),
+        'pm25': get_blueair_pm25(),
+        'tvoc': get_blueair_tvoc(),
+        'occupancy': get_ecobee_occupancy(),
+    }
+    tasks = {name: asyncio.create_task(coro) for name, coro in sources.items()}
+    done, pending = await asyncio.wait(tasks.values(), timeout=CYCLE_READ_DEADLINE)
+    for task in pending:
+        task.cancel()
+    
+    readings = {}
+    missing = {}
+    for name, task in tasks.items():
+        if task in pending:
+            missing[name] = 'timeout'
+        elif task.exception() is not None:
+            missing[name] = str(task.exception())
+        elif name == 'ecobee':
+            readings.update(task.result())
+        else:
+            readings[name] = task.result()
+    readings = {field: value for field, value in readings.items() if value is not None}
+    
+    if missing:
+        logger.warning(f"  Missing readings this cycle: {missing}")
+    return readings, missing
+
+
 # ============================================================================
 # Actuator Control Functions
 # ============================================================================
@@ -328,15 +538,17 @@ async def set_ecobee_fan_mode(mode):
         logger.warning("Ecobee not connected. Cannot set fan mode.")
         return False
     
+    if 'fan_mode' not in ecobee_chars:
+        logger.warning("Ecobee does not expose a fan mode. Cannot set fan mode.")
+        return False
+    
     try:
-        # Map mode to HomeKit value
-        # Fan mode: 0=auto, 1=on
-        fan_value = 1 if mode == 'on' else 0
+        # Map mode to HomeKit Target Fan State: 0=Manual (on), 1=Auto
+        fan_value = 0 if mode == 'on' else 1
         
-        # Write fan mode characteristic
-        # Note: Adjust iid based on your Ecobee's actual characteristics
+        aid, iid = ecobee_chars['fan_mode']
         await ecobee_pairing.async_put_characteristics([
-            (ECOBEE_AID, ECOBEE_FAN_MODE, fan_value)
+            (aid, iid, fan_value)
         ])
         
         logger.info(f"Ecobee fan mode set to {mode}")
@@ -346,22 +558,25 @@ async def set_ecobee_fan_mode(mode):
         return False
 
 
-def set_dehumidifier_relay(on):
+async def set_dehumidifier_relay(on):
     """Control dehumidifier relay (True=on, False=off)"""
-    global relay_port, relay_connected
-    
-    if not relay_connected or not relay_port:
-        logger.warning("Relay not connected. Cannot control dehumidifier.")
-        return False
+    if not relay.connected:
+        # The scheduler still records the request; the supervisor replays it
+        # once the board is back
+        logger.warning("Relay not connected. Dehumidifier state will apply on reconnect.")
     
     try:
-        # AT command format: AT+ON1\r\n or AT+OFF1\r\n
-        command = f"AT+{'ON' if on else 'OFF'}{relay_channel}\r\n"
-        relay_port.write(command.encode())
-        logger.info(f"Dehumidifier relay {'ON' if on else 'OFF'}")
+        # Re-asserting the current state is dropped; early transitions wait
+        # out the min on/off time. Writes run on the relay I/O thread.
+        result = await relay_scheduler.request(relay_channel, on)
+        if result['action'] == 'sent':
+            logger.info(f"Dehumidifier relay {'ON' if on else 'OFF'}")
+        elif result['action'] == 'deferred':
+            logger.info(f"Dehumidifier relay {'ON' if on else 'OFF'} deferred {result['apply_in']}s (min on/off time)")
         return True
     except Exception as e:
-        logger.error(f"Failed to control relay: {e}")
+        if relay.connected:
+            logger.error(f"Failed to control relay: {e}")
         return False
 
 
@@ -414,55 +629,69 @@ async def evaluate_humidity_threat(humidity):
     
     if humidity > HUMIDITY_HIGH:
         # Mold risk. Dry it out.
-        logger.info(f"💧 HIGH Humidity ({humidity}%): Turning on dehumidifier")
-        set_dehumidifier_relay(True)
+        logger.info(f"💧 HIGH Humidity ({humidity}%): Dehumidifier on")
+        await set_dehumidifier_relay(True)
         
     elif humidity < HUMIDITY_LOW:
         # Too dry. Stop drying.
-        logger.info(f"🌵 LOW Humidity ({humidity}%): Turning off dehumidifier")
-        set_dehumidifier_relay(False)
+        logger.info(f"🌵 LOW Humidity ({humidity}%): Dehumidifier off")
+        await set_dehumidifier_relay(False)
     
     # If between 45-55%, maintain current state (hysteresis)
 
 
+def next_circulation_kick():
+    """
+    When the next circulation kick is due
+    
+    The first one at the top of the hour after startup, then an hour after
+    the last one. Independent of the loop cadence; the loop caps its wait at
+    this time (see PACE).
+    """
+    last_kick = system_state.last_circulation_kick
+    if last_kick is None:
+        return STARTED_AT.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return last_kick + timedelta(minutes=CIRCULATION_KICK_INTERVAL)
+
+
 async def circulation_kick():
     """
     The "Circulation Kick" - Every hour, if air is clean, stir it up to verify.
     
     Logic:
-    - Run every hour (at minute 0)
-    - Only if PM2.5 < 2 (we think it's clean)
+    - Run every hour (first at the top of the hour), see next_circulation_kick()
+    - Only if PM2.5 < 2 (we think it's clean); until then, every cycle rechecks
     - Turn on Ecobee fan to "stir the pot" and verify air quality
-    """
-    now = datetime.now()
-    last_kick = system_state.get('last_circulation_kick')
     
-    # Check if it's time for a circulation kick (every hour)
-    should_kick = False
-    if last_kick is None:
-        # First run - kick if it's at the top of the hour
-        should_kick = now.minute == 0
-    else:
-        # Check if an hour has passed
-        time_diff = (now - last_kick).total_seconds() / 60
-        should_kick = time_diff >= CIRCULATION_KICK_INTERVAL
+    The fan run itself is a job, so the control loop keeps its cadence.
+    """
+    if jobs.running('circulation_kick'):
+        return
     
-    if not should_kick:
+    now = datetime.now()
+    if now < next_circulation_kick():
         return
     
-    pm25 = system_state.get('pm25')
+    pm25 = system_state.pm25
     if pm25 is None or pm25 >= CIRCULATION_KICK_PM25_THRESHOLD:
         logger.debug(f"Skipping circulation kick: PM2.5 ({pm25}) not clean enough")
         return
     
     # Air is clean. Prove it by stirring.
-    logger.info(f"🌀 Circulation Kick: Stirring air (PM2.5: {pm25} µg/m³)")
+    system_state.last_circulation_kick = now
+    jobs.start('circulation_kick', run_circulation_kick, pm25)
+
+
+async def run_circulation_kick(job, pm25):
+    """Fan ON for CIRCULATION_KICK_DURATION, then back to AUTO (also when cancelled)"""
+    job.step(f"🌀 Circulation Kick: Stirring air (PM2.5: {pm25} µg/m³)")
     await set_ecobee_fan_mode('on')
-    system_state['last_circulation_kick'] = now
-    
-    # Turn fan off after 5 minutes (let it run briefly)
-    await asyncio.sleep(300)  # 5 minutes
-    await set_ecobee_fan_mode('auto')
+    try:
+        # Let it run briefly
+        await job.sleep(CIRCULATION_KICK_DURATION, "Fan ON")
+    finally:
+        job.step("Fan back to AUTO")
+        await set_ecobee_fan_mode('auto')
 
 
 # ============================================================================
@@ -474,38 +703,51 @@ async def asthma_shield_loop():
     logger.info("🧠 Asthma Shield BMS starting...")
     logger.info("=" * 60)
     
-    # Initialize all systems
+    # Initialize all systems concurrently; slow ones finish in the background
     logger.info("Initializing systems...")
-    await init_ecobee()
-    await init_blueair()
-    await init_relay()
+    startup.start('ecobee', init_ecobee, INIT_DEADLINES['ecobee'])
+    startup.start('blueair', init_blueair, INIT_DEADLINES['blueair'])
+    startup.start('relay', init_relay, INIT_DEADLINES['relay'], retry=False,
+                  probe=lambda: relay.connected)
+    if not await startup.wait(STARTUP_GRACE):
+        pending = [name for name, s in startup.subsystems.items() if s.state == 'starting']
+        logger.info(f"Still initializing: {', '.join(pending)} - continuing without them")
     
     logger.info("=" * 60)
     logger.info("✅ Systems initialized. Starting control loop...")
     logger.info("=" * 60)
+    startup.mark('loop')
+    
+    global bridge_task
+    if BRIDGE_URL:
+        bridge_task = asyncio.create_task(follow_bridge())
     
     iteration = 0
+    reasons = ['startup']
+    last_status = None
     
     while True:
         try:
             iteration += 1
-            logger.info(f"\n--- Iteration #{iteration} ---")
+            logger.info(f"\n--- Iteration #{iteration} ({'; '.join(reasons)}) ---")
             
             # 1. GATHER INTEL
             logger.info("📊 Gathering sensor data...")
             
-            pm25 = await get_blueair_pm25()
-            tvoc = await get_blueair_tvoc()
-            humidity = await get_ecobee_humidity()
-            temperature = await get_ecobee_temperature()
-            is_occupied = await get_ecobee_occupancy()
+            started = time.monotonic()
+            readings, missing = await read_sensor_snapshot()
+            pm25 = readings.get('pm25')
+            tvoc = readings.get('tvoc')
+            humidity = readings.get('indoor_humidity')
+            temperature = readings.get('indoor_temp')
+            logger.debug(f"  Sensors read in {time.monotonic() - started:.2f}s")
             
-            # Update system state
-            system_state['pm25'] = pm25
-            system_state['tvoc'] = tvoc
-            system_state['humidity'] = humidity
-            system_state['temperature'] = temperature
-            system_state['occupancy'] = is_occupied
+            # Update system state; fields not read this cycle keep their last value
+            changed = system_state.update(readings)
+            # Thresholds act on fresh readings only (None = skip), but a
+            # failed occupancy read must not look like an empty house
+            is_occupied = system_state.occupancy
+            logger.debug(f"  Changed: {', '.join(changed) or 'nothing'} (state v{system_state.version})")
             
             logger.info(f"  PM2.5: {pm25} µg/m³" if pm25 else "  PM2.5: N/A")
             logger.info(f"  tVOC: {tvoc} ppb" if tvoc else "  tVOC: N/A")
@@ -525,16 +767,90 @@ async def asthma_shield_loop():
             logger.info("\n🌀 Checking circulation kick...")
             await circulation_kick()
             
-            logger.info(f"\n✅ Control cycle complete. Sleeping {MAIN_LOOP_INTERVAL}s...")
+            # 5. RECORD
+            history_store.append(time.time(), system_state)
+            if history_store.flush_due():
+                await asyncio.get_running_loop().run_in_executor(None, history_store.flush)
+            
+            # 6. PACE: how soon the next cycle should run
+            sampler.observe({'pm25': pm25, 'indoor_humidity': humidity})
+            kick_in = (next_circulation_kick() - datetime.now()).total_seconds()
+            if kick_in > 0:
+                sampler.limit(kick_in, 'circulation kick due')
+            if last_status is None or time.monotonic() - last_status >= STATUS_WRITE_INTERVAL:
+                last_status = time.monotonic()
+                await asyncio.get_running_loop().run_in_executor(None, write_status, iteration)
+            
+            interval, reason = sampler.next_wait
+            logger.info(f"\n✅ Control cycle complete. Next in {interval}s ({reason})...")
             
         except KeyboardInterrupt:
             logger.info("\n🛑 Shutting down Asthma Shield...")
             break
         except Exception as e:
             logger.error(f"❌ Error in control loop: {e}", exc_info=True)
-            logger.info(f"Retrying in {MAIN_LOOP_INTERVAL}s...")
+            logger.info(f"Retrying in {sampler.interval}s...")
         
-        await asyncio.sleep(MAIN_LOOP_INTERVAL)
+        reasons = await sampler.wait()
+
+
+def on_bridge_event(event, data):
+    """Adopt bridge-only fields and wake the control loop on relevant changes"""
+    if event == 'snapshot':
+        changes = data.get('system_state') or {}
+    elif event == 'system_state':
+        changes = data
+    else:
+        return
+    
+    try:
+        system_state.update({field: changes[field] for field in BRIDGE_FIELDS if field in changes})
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Ignoring bridge state: {e}")
+    
+    woke = [field for field in BRIDGE_WAKE_FIELDS if field in changes]
+    if woke and event != 'snapshot':
+        sampler.wake(f"bridge ({', '.join(woke)})")
+
+
+async def follow_bridge():
+    """Follow the bridge's /api/stream, reconnecting with backoff"""
+    backoff = 1
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)  # Bridge heartbeats every 15s
+    while True:
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(f"{BRIDGE_URL}/api/stream") as response:
+                    response.raise_for_status()
+                    logger.info(f"📡 Following bridge state at {BRIDGE_URL}")
+                    backoff = 1
+                    event = None
+                    async for raw in response.content:
+                        line = raw.decode('utf-8').rstrip('\r\n')
+                        if line.startswith('event:'):
+                            event = line[6:].strip()
+                        elif line.startswith('data:') and event:
+                            on_bridge_event(event, json.loads(line[5:]))
+                        elif not line:
+                            event = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Bridge stream unavailable ({e}); retrying in {backoff}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+def write_status(iteration):
+    """Export the sampler and startup state for dashboards (shield-status.json)"""
+    save_json(STATUS_FILE, {
+        'updated': datetime.now().isoformat(),
+        'iteration': iteration,
+        'startup': startup.describe(),
+        'sampler': sampler.status(),
+        'system_state': system_state.as_dict(),
+        'jobs': jobs.describe(),
+    })
 
 
 # ============================================================================
@@ -550,6 +866,12 @@ async def main():
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
         raise
+    finally:
+        await startup.shutdown()
+        if bridge_task is not None:
+            bridge_task.cancel()
+        await jobs.shutdown()
+        history_store.flush()
 
 
 if __name__ == "__main__":
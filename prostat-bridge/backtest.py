@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+Historical replay / backtest of the control thresholds
+
+Replays a recorded system_state time series through vectorized versions of
+the control logic for a whole grid of threshold combinations at once:
+
+    humidity    - asthma_shield dehumidifier hysteresis (HUMIDITY_HIGH / HUMIDITY_LOW)
+    interlock   - server.py interlock rules (AC Overcool, Free Dry, optional thresholds)
+    air_quality - asthma_shield Blueair speed (PM25_THRESHOLD_HIGH / _MEDIUM)
+
+Consecutive readings that fall on the same side of every threshold in the
+grid decide the same for every combination, so runs of them are collapsed
+into weighted rows first. Each combination is then one column of a
+(time x combinations) matrix, built in blocks of rows: rule terms are array
+comparisons, evaluated once per distinct threshold and indexed per
+combination, and "hold the current state" is resolved by stepping through
+the rows with the state of every combination as one vector. Metrics are
+summed only over the rows where a column switches, against prefix sums of
+the weights. A year of minute data against thousands of combinations takes
+seconds.
+
+The replay is open loop: recorded readings already include the effect of
+whatever control ran at the time, so the results compare how the rules
+would have switched, not how the room would have responded. Minimum on/off
+dwell times are not modelled; look at the switch counts to see how often a
+combination would short-cycle.
+
+Input: CSV or JSON lines with a `timestamp` column and any of indoor_humidity,
+outdoor_temp, hvac_mode, hvac_running, pm25, occupancy - or the bridge's
+on-disk history store directory (HISTORY_STORE_DIR, see tsdb.py).
+
+Usage:
+    python backtest.py history.csv --model humidity \\
+        --grid humidity_high=50:65:1 humidity_low=40:55:1 --top 10
+    python backtest.py history.jsonl --model interlock \\
+        --grid free_dry_cutoff=55:70:1 free_dry_humidity=50:60:1
+    python backtest.py ./history --model humidity --grid humidity_high=50:65:1
+
+Requires numpy and pandas (root requirements.txt) - an offline tool, not
+needed on the Pi.
+"""
+
+import argparse
+import itertools
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from tsdb import MAX_TIME, TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+# Largest (time x combinations) block evaluated at once (elements)
+MAX_BLOCK = 5_000_000
+
+# Default parameters per model - the values the live loops use today.
+# Thresholds that are None (disabled) are encoded as NaN in the grid.
+MODEL_DEFAULTS = {
+    'humidity': {
+        'humidity_high': 55.0,  # asthma_shield.HUMIDITY_HIGH
+        'humidity_low': 45.0,  # asthma_shield.HUMIDITY_LOW
+        'band_high': 60.0,  # Out of band: above this with the dehumidifier off
+        'band_low': 40.0,  # Out of band: below this with the dehumidifier on
+    },
+    'interlock': {
+        'free_dry_cutoff': 65.0,  # Free Dry: outdoor below this (°F) ...
+        'free_dry_humidity': 55.0,  # ... and indoor humidity above this (%)
+        'overcool_temp': 80.0,  # AC Overcool: outdoor above this (°F) while cooling
+        'humidity_high': np.nan,  # server HUMIDITY_HIGH (unset)
+        'humidity_low': np.nan,  # server HUMIDITY_LOW (unset)
+        'band_high': 60.0,
+        'band_low': 40.0,
+    },
+    'air_quality': {
+        'pm25_high': 10.0,  # asthma_shield.PM25_THRESHOLD_HIGH
+        'pm25_medium': 5.0,  # asthma_shield.PM25_THRESHOLD_MEDIUM
+        'band_pm25': 10.0,  # Out of band: PM2.5 above this without max filtration
+    },
+}
+
+MODEL_COLUMNS = {
+    'humidity': ('indoor_humidity',),
+    'interlock': ('indoor_humidity', 'outdoor_temp', 'hvac_mode', 'hvac_running'),
+    'air_quality': ('pm25', 'occupancy'),
+}
+
+# Parameters each numeric input is only ever compared against
+MODEL_THRESHOLDS = {
+    'humidity': {
+        'indoor_humidity': ('humidity_high', 'humidity_low', 'band_high', 'band_low'),
+    },
+    'interlock': {
+        'indoor_humidity': ('free_dry_humidity', 'humidity_high', 'humidity_low', 'band_high', 'band_low'),
+        'outdoor_temp': ('free_dry_cutoff', 'overcool_temp'),
+    },
+    'air_quality': {
+        'pm25': ('pm25_high', 'pm25_medium', 'band_pm25'),
+    },
+}
+
+
+# ============================================================================
+# Input
+# ============================================================================
+
+def load_history(path, step='1min', max_gap='30min'):
+    """
+    Load a recorded time series onto a regular grid
+
+    Readings are carried forward across gaps of up to `max_gap`; longer gaps
+    stay missing (NaN), which the models treat as "no decision".
+
+    Returns:
+        DataFrame indexed by timestamp at `step` resolution
+    """
+    if os.path.isdir(path):
+        frame = load_store(path)
+    elif str(path).endswith(('.jsonl', '.json')):
+        frame = pd.read_json(path, lines=str(path).endswith('.jsonl'))
+    else:
+        frame = pd.read_csv(path)
+
+    frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+    frame = frame.set_index('timestamp').sort_index()
+    frame = frame[~frame.index.duplicated(keep='last')]
+
+    limit = max(1, int(pd.Timedelta(max_gap) / pd.Timedelta(step)))
+    return frame.resample(step).last().ffill(limit=limit)
+
+
+def load_store(path):
+    """Every row of an on-disk history store as a DataFrame (timestamps in UTC)"""
+    store = TimeSeriesStore(path)
+    times, columns = store.scan(0, MAX_TIME)
+    frame = pd.DataFrame({
+        field: np.frombuffer(column, dtype=np.float32).astype(float)
+        for field, column in columns.items()
+    })
+    for field, labels in store.categories.items():
+        if field in frame:
+            frame[field] = frame[field].map(dict(enumerate(labels)))
+    frame['timestamp'] = pd.to_datetime(np.frombuffer(times, dtype=np.float64), unit='s')
+    return frame
+
+
+def compress(frame, columns, thresholds=None):
+    """
+    Collapse runs of consecutive readings that decide alike into one weighted row
+
+    Identical inputs produce identical decisions. A numeric input that is
+    only compared against thresholds need not be identical, only on the same
+    side of every threshold, so a minute series usually shrinks by an order
+    of magnitude even when the sensor is noisy.
+
+    Args:
+        columns: Inputs the model reads
+        thresholds: Optional {column: sorted thresholds} for inputs compared
+            only against these values
+
+    Returns:
+        (frame of run starts, rows per run)
+    """
+    columns = [name for name in columns if name in frame]
+    values = frame[columns]
+    if thresholds:
+        values = values.assign(**{
+            name: threshold_bins(column(values, name)[:, 0], levels)
+            for name, levels in thresholds.items() if name in values
+        })
+    previous = values.shift()
+    changed = (values.ne(previous) & ~(values.isna() & previous.isna())).any(axis=1).to_numpy(copy=True)
+    if len(changed):
+        changed[0] = True
+    starts = np.flatnonzero(changed)
+    return frame.iloc[starts], np.diff(np.append(starts, len(frame)))
+
+
+def threshold_bins(values, thresholds):
+    """
+    Which side of every threshold each value falls on, as one code
+
+    Values strictly between the same two thresholds share a code, as do
+    values equal to the same threshold; NaN stays NaN.
+    """
+    codes = (np.searchsorted(thresholds, values, 'left')
+             + np.searchsorted(thresholds, values, 'right')).astype(float)
+    codes[np.isnan(values)] = np.nan
+    return codes
+
+
+def grid_thresholds(model, params):
+    """{column: sorted distinct finite thresholds} of the grid for compress()"""
+    thresholds = {}
+    for name, names in MODEL_THRESHOLDS[model].items():
+        levels = np.unique(params[list(names)].to_numpy(dtype=float))
+        thresholds[name] = levels[np.isfinite(levels)]
+    return thresholds
+
+
+def step_minutes(frame):
+    """Length of one row in minutes"""
+    if len(frame.index) < 2:
+        return 1.0
+    return (frame.index[1] - frame.index[0]).total_seconds() / 60
+
+
+# ============================================================================
+# Vectorized building blocks
+# ============================================================================
+
+def hysteresis(demand_on, demand_off, state):
+    """
+    Relay state per row of a block, stepping through time with every
+    combination at once
+
+    Rows where no rule decides hold the previous state; before the first
+    decision the relay is off. On and off demands never fall on the same row.
+
+    Args:
+        demand_on, demand_off: (rows, combinations) bool arrays
+        state: (combinations,) state before the block
+
+    Returns:
+        (rows, combinations) bool array
+    """
+    states = np.empty(demand_on.shape, dtype=bool)  # C order: rows are contiguous
+    keep = ~demand_off
+    previous = state
+    for row in range(len(states)):
+        current = states[row]
+        np.logical_or(previous, demand_on[row], out=current)
+        np.logical_and(current, keep[row], out=current)
+        previous = current
+    return states
+
+
+def switch_counts(state):
+    """Number of state changes per column"""
+    return np.count_nonzero(state[1:] != state[:-1], axis=0)
+
+
+def in_blocks(rows, count):
+    """Column slices keeping a (rows x slice) block under MAX_BLOCK elements"""
+    step = max(1, MAX_BLOCK // max(rows, 1))
+    for start in range(0, count, step):
+        yield slice(start, start + step)
+
+
+def time_blocks(rows, count):
+    """Row slices keeping a (slice x count) block under MAX_BLOCK elements"""
+    step = max(1, MAX_BLOCK // max(count, 1))
+    for start in range(0, rows, step):
+        yield slice(start, start + step)
+
+
+def column(frame, name, default=np.nan):
+    """One input column as a float vector (time, 1) for broadcasting"""
+    if name not in frame:
+        return np.full((len(frame), 1), default)
+    values = frame[name]
+    if values.dtype == object:
+        values = values.map(lambda v: np.nan if v is None else float(v in (True, 'true', 'True', 1, '1')))
+    return values.to_numpy(dtype=float)[:, None]
+
+
+def unique_row(params, name):
+    """Distinct values of a parameter as a (1, n) row, and each combination's index into it"""
+    values, inverse = np.unique(params[name].to_numpy(dtype=float), return_inverse=True)
+    return values[None, :], inverse
+
+
+def distinct(*indices):
+    """
+    Distinct tuples of per-parameter indices (from unique_row)
+
+    Returns:
+        (first combination with each tuple, each combination's index into them)
+    """
+    shape = [index.max(initial=0) + 1 for index in indices]
+    _, first, inverse = np.unique(np.ravel_multi_index(indices, shape), return_index=True, return_inverse=True)
+    return first, inverse
+
+
+def weighted_count(mask, weights):
+    """Per-column number of original rows where `mask` holds"""
+    return weights.astype(float) @ mask
+
+
+def prefix_sums(values):
+    """Running totals along time with a leading zero: sum over rows [a, b) is p[b] - p[a]"""
+    totals = np.zeros((len(values) + 1,) + values.shape[1:], dtype=values.dtype)
+    np.cumsum(values, axis=0, out=totals[1:])
+    return totals
+
+
+def concat_metrics(parts):
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+# ============================================================================
+# Models - each returns a metrics dict of per-combination vectors
+# ============================================================================
+
+class RelayMetrics:
+    """
+    Duty cycle, switches and out-of-band rows of a relay per combination
+
+    Fed the relay state block by block; only the rows where a column
+    switches are looked at. Each on-interval [start, end) of a column adds
+    p[end] - p[start] of the prefix sums of the weights (and of the weighted
+    out-of-band rows for its band), so nothing is summed over the whole
+    (time x combinations) state.
+
+    Args:
+        humidity: (time, 1) readings compared against the band
+        weights: Original rows per (compressed) row
+        params: Combinations, with band_high / band_low
+    """
+
+    def __init__(self, humidity, weights, params):
+        band_high, self.high_index = unique_row(params, 'band_high')
+        band_low, self.low_index = unique_row(params, 'band_low')
+        self.weights = prefix_sums(weights)
+        self.humid = prefix_sums(weights[:, None] * (humidity > band_high))
+        self.dry = prefix_sums(weights[:, None] * (humidity < band_low))
+
+        count = len(params)
+        self.state = np.zeros(count, dtype=bool)  # At the end of the last block
+        self.switches = np.zeros(count, dtype=np.int64)
+        self.on = np.zeros(count)  # Weighted rows on
+        self.humid_on = np.zeros(count)  # Weighted rows above band_high while on
+        self.dry_on = np.zeros(count)  # Weighted rows below band_low while on
+
+    def add(self, rows, state):
+        """
+        Account for one block
+
+        Args:
+            rows: Slice of the block's rows
+            state: (rows, combinations) bool relay state
+        """
+        changed = np.empty_like(state)
+        np.not_equal(state[0], self.state, out=changed[0])
+        np.not_equal(state[1:], state[:-1], out=changed[1:])
+        row, col = np.divmod(np.flatnonzero(changed), state.shape[1])
+        turned_on = state[row, col]
+        row += rows.start
+
+        # Turning on before the first row is not a switch
+        self.switches += np.bincount(col[row > 0], minlength=len(self.state))
+        self.edges(row, col, np.where(turned_on, -1.0, 1.0))
+        self.state = state[-1].copy()
+
+    def edges(self, row, col, sign):
+        """Add interval edges: -p[start] where a column turns on, +p[end] where it turns off"""
+        count = len(self.state)
+        self.on += np.bincount(col, sign * self.weights[row], count)
+        self.humid_on += np.bincount(col, sign * self.humid[row, self.high_index[col]], count)
+        self.dry_on += np.bincount(col, sign * self.dry[row, self.low_index[col]], count)
+
+    def result(self):
+        # Close the intervals still on after the last row
+        col = np.flatnonzero(self.state)
+        self.edges(np.full(len(col), len(self.weights) - 1), col, np.ones(len(col)))
+        self.state[:] = False
+
+        too_humid = self.humid[-1, self.high_index] - self.humid_on
+        return {
+            'duty_cycle': self.on / max(self.weights[-1], 1),
+            'switches': self.switches,
+            'out_of_band_rows': too_humid + self.dry_on,
+        }
+
+
+def humidity_model(frame, weights, params):
+    """asthma_shield.evaluate_humidity_threat: on above high, off below low, else hold"""
+    humidity = column(frame, 'indoor_humidity')
+
+    # "On" depends only on the high threshold and "off" only on the low one:
+    # compare once per distinct threshold and take the columns per combination
+    # (np.take keeps rows contiguous for hysteresis())
+    highs, high_index = unique_row(params, 'humidity_high')
+    lows, low_index = unique_row(params, 'humidity_low')
+
+    metrics = RelayMetrics(humidity, weights, params)
+    for rows in time_blocks(len(frame), len(params)):
+        demand_on = np.take(humidity[rows] > highs, high_index, axis=1)
+        demand_off = np.take(humidity[rows] < lows, low_index, axis=1)
+        metrics.add(rows, hysteresis(demand_on, demand_off, metrics.state))
+    return metrics.result()
+
+
+def interlock_model(frame, weights, params):
+    """server.INTERLOCK_RULES for the dehumidifier (AC Overcool > Free Dry > thresholds)"""
+    humidity = column(frame, 'indoor_humidity')
+    outdoor = column(frame, 'outdoor_temp')
+    if 'hvac_mode' in frame:
+        cooling = (frame['hvac_mode'] == 'cool').to_numpy()[:, None] & (column(frame, 'hvac_running') > 0)
+    else:
+        cooling = np.zeros((len(frame), 1), dtype=bool)
+
+    # Each rule term depends on one or two parameters: evaluate it once per
+    # distinct value (or tuple) and take the columns per combination
+    overcool_temps, overcool_index = unique_row(params, 'overcool_temp')
+    cutoffs, cutoff_index = unique_row(params, 'free_dry_cutoff')
+    free_dry_humidities, free_dry_index = unique_row(params, 'free_dry_humidity')
+    highs, high_index = unique_row(params, 'humidity_high')
+    lows, low_index = unique_row(params, 'humidity_low')
+    # Free Dry or above humidity_high, per (cutoff, free dry humidity, high)
+    dry_first, dry_index = distinct(cutoff_index, free_dry_index, high_index)
+    # Below humidity_low and neither of those, per (that, low)
+    low_first, low_only_index = distinct(dry_index, low_index)
+
+    metrics = RelayMetrics(humidity, weights, params)
+    for rows in time_blocks(len(frame), len(params)):
+        # Comparisons against NaN (disabled threshold / missing reading) are False
+        overcool = (outdoor[rows] > overcool_temps) & cooling[rows]
+        free_dry = ((outdoor[rows] < cutoffs)[:, cutoff_index[dry_first]]
+                    & (humidity[rows] > free_dry_humidities)[:, free_dry_index[dry_first]])
+        dry = free_dry | (humidity[rows] > highs)[:, high_index[dry_first]]
+        low_only = (humidity[rows] < lows)[:, low_index[low_first]] & ~dry[:, dry_index[low_first]]
+
+        overcool = np.take(overcool, overcool_index, axis=1)
+        demand_on = ~overcool & np.take(dry, dry_index, axis=1)
+        demand_off = overcool | np.take(low_only, low_only_index, axis=1)
+        metrics.add(rows, hysteresis(demand_on, demand_off, metrics.state))
+    return metrics.result()
+
+
+def air_quality_model(frame, weights, params):
+    """asthma_shield.evaluate_air_quality_threat: 3 above high, 2 above medium if occupied, else 1"""
+    pm25 = column(frame, 'pm25')[:, 0]
+    occupied = column(frame, 'occupancy', 0.0)[:, 0] > 0
+
+    # Without a reading asthma_shield skips the cycle and the speed holds, so
+    # only rows with a reading matter; each also stands for the rows until the next
+    total = max(weights.sum(), 1)
+    known = np.flatnonzero(np.isfinite(pm25))
+    weights = np.add.reduceat(weights, known) if len(known) else weights[:0]
+    pm25 = pm25[known][:, None]
+    occupied = occupied[known][:, None]
+
+    # Compare once per distinct threshold and take the columns per combination
+    highs, high_index = unique_row(params, 'pm25_high')
+    mediums, medium_index = unique_row(params, 'pm25_medium')
+    bands, band_index = unique_row(params, 'band_pm25')
+    above_high = pm25 > highs
+    above_medium = pm25 > mediums
+    above_band = pm25 > bands
+
+    parts = []
+    for cols in in_blocks(len(known), len(params)):
+        high = np.take(above_high, high_index[cols], axis=1)
+        medium = ~high & np.take(above_medium, medium_index[cols], axis=1) & occupied
+        speed = np.where(high, np.int8(3), np.where(medium, np.int8(2), np.int8(1)))
+        # The loop starts at speed 1
+        switches = switch_counts(speed) + (speed[:1] != 1).sum(axis=0) if len(speed) else np.zeros(high.shape[1])
+        parts.append({
+            'duty_max': weighted_count(high, weights) / total,
+            'duty_medium': weighted_count(medium, weights) / total,
+            'switches': switches,
+            'out_of_band_rows': weighted_count(np.take(above_band, band_index[cols], axis=1) & ~high, weights),
+        })
+    return concat_metrics(parts)
+
+
+MODELS = {
+    'humidity': humidity_model,
+    'interlock': interlock_model,
+    'air_quality': air_quality_model,
+}
+
+
+# ============================================================================
+# Sweep
+# ============================================================================
+
+def parameter_grid(model, grid):
+    """
+    Every combination of the grid values, defaults for the rest
+
+    Args:
+        grid: {param: [values]}
+
+    Returns:
+        DataFrame, one row per combination
+    """
+    defaults = MODEL_DEFAULTS[model]
+    unknown = set(grid) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown {model} parameters: {', '.join(sorted(unknown))}")
+
+    names = list(defaults)
+    values = [grid.get(name, [defaults[name]]) for name in names]
+    params = pd.DataFrame(list(itertools.product(*values)), columns=names, dtype=float)
+
+    # Hysteresis needs low < high
+    if {'humidity_high', 'humidity_low'} <= set(params):
+        both = params['humidity_high'].notna() & params['humidity_low'].notna()
+        params = params[~both | (params['humidity_low'] < params['humidity_high'])]
+    if {'pm25_high', 'pm25_medium'} <= set(params):
+        params = params[params['pm25_medium'] <= params['pm25_high']]
+    return params.reset_index(drop=True)
+
+
+def run_backtest(frame, model, grid):
+    """
+    Replay `frame` through `model` for every combination in `grid`
+
+    Returns:
+        DataFrame of parameters plus duty cycles, switch counts, switches per
+        day and out-of-band minutes, one row per combination
+    """
+    missing = [name for name in MODEL_COLUMNS[model] if name not in frame]
+    if missing:
+        logger.warning(f"History lacks {', '.join(missing)}; rules using them never fire")
+
+    params = parameter_grid(model, grid)
+    minutes = step_minutes(frame)
+    days = max(len(frame) * minutes / 1440, 1e-9)
+
+    rows, weights = compress(frame, MODEL_COLUMNS[model], grid_thresholds(model, params))
+    results = params.join(pd.DataFrame(MODELS[model](rows, weights, params), index=params.index))
+
+    results['switches_per_day'] = results['switches'] / days
+    results['out_of_band_minutes'] = results.pop('out_of_band_rows') * minutes
+    return results
+
+
+def parse_grid(specs):
+    """
+    Parse ["name=start:stop:step", "name=v1,v2", ...] into {name: [values]}
+
+    The stop of a range is inclusive. "none" stands for a disabled threshold.
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if ':' in values:
+            start, stop, step = (float(v) for v in values.split(':'))
+            grid[name] = list(np.round(np.arange(start, stop + step / 2, step), 6))
+        else:
+            grid[name] = [np.nan if v.lower() == 'none' else float(v) for v in values.split(',')]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest control thresholds against recorded data')
+    parser.add_argument('history', help='CSV or JSON lines with a timestamp column, or a history store directory')
+    parser.add_argument('--model', choices=sorted(MODELS), default='humidity')
+    parser.add_argument('--grid', nargs='*', default=[], help='name=start:stop:step or name=v1,v2')
+    parser.add_argument('--step', default='1min', help='Resampling step (pandas offset)')
+    parser.add_argument('--sort', default='out_of_band_minutes,switches', help='Columns to rank by')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--out', help='Write all results to this CSV')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    frame = load_history(args.history, args.step)
+    results = run_backtest(frame, args.model, parse_grid(args.grid))
+    logger.info(f"{len(results)} combinations over {len(frame)} rows ({frame.index[0]} - {frame.index[-1]})")
+
+    if args.out:
+        results.to_csv(args.out, index=False)
+    ranked = results.sort_values(args.sort.split(','))
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(ranked.head(args.top).round(3).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
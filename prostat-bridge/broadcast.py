@@ -0,0 +1,147 @@
+"""
+State change broadcaster for the /api/stream endpoint
+
+Publishers push dicts of changed fields under a topic ('system_state',
+'thermostat/<device_id>', ...). Each subscriber has a single pending slot
+per topic into which new changes are merged, so a slow consumer never
+builds a queue: it skips stale intermediate values and receives only the
+latest value of every field that changed since its last read. Publishing
+costs one dict update per subscriber, independent of how far behind the
+subscriber is.
+
+Every publish also advances a global version number and records it as the
+version of its topic, giving cheap change detection (ETags, long-polls)
+for clients that can't stream. Versions restart at 0 with the process, so
+clients get them as tokens "<epoch>-<version>" carrying a per-process boot
+epoch; a token from before a restart never matches the current state.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    """Pending changes of one stream client"""
+
+    __slots__ = ('pending', 'event', 'sent', 'dropped')
+
+    def __init__(self):
+        self.pending = {}  # topic -> {field: latest value}
+        self.event = asyncio.Event()
+        self.sent = 0  # Messages delivered
+        self.dropped = 0  # Intermediate values superseded before delivery
+
+
+class StateBroadcaster:
+    """Fan-out of state diffs to stream subscribers with latest-value coalescing"""
+
+    def __init__(self, max_subscribers=64):
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self.published = 0
+        self.version = 0  # Monotonic, bumped by every publish
+        self.epoch = format(time.time_ns() // 1000000, 'x')  # Boot epoch for version tokens
+        self.topic_versions = {}  # topic -> version of its last change
+        self._changed = asyncio.Event()  # Replaced after each publish
+
+    def subscribe(self):
+        """Register a subscriber, or raise RuntimeError if at capacity"""
+        if len(self._subscribers) >= self.max_subscribers:
+            raise RuntimeError(f"Too many stream subscribers (max {self.max_subscribers})")
+        subscriber = Subscriber()
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, topic, changes):
+        """Merge `changes` into every subscriber's pending slot for `topic`"""
+        if not changes:
+            return
+        self.published += 1
+        self.version += 1
+        self.topic_versions[topic] = self.version
+
+        for subscriber in self._subscribers:
+            pending = subscriber.pending.setdefault(topic, {})
+            subscriber.dropped += len(pending.keys() & changes.keys())
+            pending.update(changes)
+            subscriber.event.set()
+
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def version_of(self, topics):
+        """Latest version of any of `topics` (0 if none has changed yet)"""
+        return max((self.topic_versions.get(topic, 0) for topic in topics), default=0)
+
+    def token(self, version):
+        """Client-facing token for a version of this process"""
+        return f"{self.epoch}-{version}"
+
+    def parse_token(self, token):
+        """
+        Version a client's token refers to in this process
+
+        Returns:
+            The version, or None if the token was issued by another process
+            (or is ahead of this one) - the client's state is out of date
+
+        Raises:
+            ValueError: Not a version token
+        """
+        epoch, separator, number = token.rpartition('-')
+        version = int(number)
+        if not separator or epoch != self.epoch or not 0 <= version <= self.version:
+            return None
+        return version
+
+    async def wait_for_change(self, since, topics, timeout):
+        """
+        Wait until one of `topics` changes past version `since`
+
+        Returns:
+            True if it changed, False if `timeout` passed first
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.version_of(topics) <= since:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def next(self, subscriber, timeout=None):
+        """
+        Wait for changes
+
+        Returns:
+            {topic: {field: value}} accumulated since the last call, or None
+            if `timeout` passed without changes
+        """
+        try:
+            await asyncio.wait_for(subscriber.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        subscriber.event.clear()
+        pending, subscriber.pending = subscriber.pending, {}
+        subscriber.sent += len(pending)
+        return pending
+
+    def get_stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'published': self.published,
+            'version': self.version,
+            'epoch': self.epoch,
+            'dropped': sum(s.dropped for s in self._subscribers),
+        }
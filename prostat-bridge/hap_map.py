@@ -0,0 +1,133 @@
+"""
+HomeKit characteristic map - resolve thermostat characteristics by type UUID
+
+Instead of hard-coding (aid, iid) pairs, the accessory database of a paired
+device is enumerated once and each characteristic we use is located by its
+HomeKit type UUID. The resolved map is cached on disk keyed by device id and
+the accessory's configuration number (c#), which the accessory bumps
+whenever its database changes. Restarts reuse the cached map without
+enumerating the accessory again - but only when the current c# is known;
+without it a firmware update could not be told apart, so the accessory is
+enumerated instead.
+"""
+
+import logging
+
+from json_store import load_json, save_json, state_path
+
+logger = logging.getLogger(__name__)
+
+# Cache file: device_id -> {'config_num': c#, 'characteristics': {name: [aid, iid]}}
+HAP_MAP_CACHE = state_path('hap_map_cache.json')
+
+# Apple-defined HomeKit UUIDs share this base; short forms ("11") expand to it
+HAP_UUID_SUFFIX = '-0000-1000-8000-0026BB765291'
+
+THERMOSTAT_SERVICE = '0000004A' + HAP_UUID_SUFFIX
+
+# Characteristic name -> HomeKit characteristic type
+CHARACTERISTIC_TYPES = {
+    'temperature': '00000011' + HAP_UUID_SUFFIX,  # Current Temperature
+    'target_temperature': '00000035' + HAP_UUID_SUFFIX,  # Target Temperature
+    'target_mode': '00000033' + HAP_UUID_SUFFIX,  # Target Heating Cooling State
+    'current_mode': '0000000F' + HAP_UUID_SUFFIX,  # Current Heating Cooling State
+    'humidity': '00000010' + HAP_UUID_SUFFIX,  # Current Relative Humidity
+    'fan_mode': '000000BF' + HAP_UUID_SUFFIX,  # Target Fan State (0=Manual/On, 1=Auto)
+}
+
+
+def normalize_type(hap_type):
+    """Expand a short HomeKit type ("11", "4A") to its full upper-case UUID"""
+    hap_type = str(hap_type).upper()
+    if '-' in hap_type:
+        return hap_type
+    return f"{int(hap_type, 16):08X}{HAP_UUID_SUFFIX}"
+
+
+def resolve_characteristics(accessories, types=CHARACTERISTIC_TYPES):
+    """
+    Locate characteristics by type in an accessory database
+
+    Characteristics of a Thermostat service win over matches elsewhere
+    (e.g. remote sensors that also report Current Temperature).
+
+    Args:
+        accessories: Result of pairing.list_accessories_and_characteristics()
+        types: name -> HomeKit characteristic type
+
+    Returns:
+        dict name -> (aid, iid) for every type found
+    """
+    wanted = {normalize_type(t): name for name, t in types.items()}
+    found = {}
+    from_thermostat = set()
+
+    for accessory in accessories:
+        aid = accessory['aid']
+        for service in accessory.get('services', []):
+            is_thermostat = normalize_type(service.get('type', '0')) == THERMOSTAT_SERVICE
+            for characteristic in service.get('characteristics', []):
+                name = wanted.get(normalize_type(characteristic.get('type', '0')))
+                if name is None or name in from_thermostat:
+                    continue
+                if name not in found or is_thermostat:
+                    found[name] = (aid, characteristic['iid'])
+                    if is_thermostat:
+                        from_thermostat.add(name)
+
+    return found
+
+
+def get_config_num(pairing, default=None):
+    """Configuration number (c#) of a paired accessory, if the pairing knows it"""
+    config_num = getattr(pairing, 'config_num', None)
+    return default if config_num is None else config_num
+
+
+async def load_characteristic_map(device_id, pairing, config_num=None, cache_path=HAP_MAP_CACHE):
+    """
+    Get the characteristic map for a device, enumerating it only if needed
+
+    Args:
+        device_id: Paired device ID
+        pairing: aiohomekit pairing object
+        config_num: Current c# from discovery, if the pairing doesn't expose it
+
+    Returns:
+        dict name -> (aid, iid)
+    """
+    config_num = get_config_num(pairing, config_num)
+    cache = load_json(cache_path, {})
+    entry = cache.get(device_id)
+
+    if config_num is not None and entry is not None and entry.get('config_num') == config_num:
+        return {name: tuple(key) for name, key in entry['characteristics'].items()}
+
+    if config_num is None:
+        logger.info(f"Enumerating accessory database of {device_id} (c# unknown, cache not trusted)")
+    else:
+        logger.info(f"Enumerating accessory database of {device_id} (c# {config_num})")
+    accessories = await pairing.list_accessories_and_characteristics()
+    characteristics = resolve_characteristics(accessories)
+
+    missing = sorted(set(CHARACTERISTIC_TYPES) - set(characteristics))
+    if missing:
+        logger.warning(f"{device_id} does not expose: {', '.join(missing)}")
+
+    cache[device_id] = {
+        'config_num': config_num,
+        'characteristics': {name: list(key) for name, key in characteristics.items()},
+    }
+    try:
+        save_json(cache_path, cache)
+    except OSError as e:
+        logger.warning(f"Could not write characteristic map cache: {e}")
+
+    return characteristics
+
+
+def forget_characteristic_map(device_id, cache_path=HAP_MAP_CACHE):
+    """Remove a device from the cache (e.g. after unpairing)"""
+    cache = load_json(cache_path, {})
+    if cache.pop(device_id, None) is not None:
+        save_json(cache_path, cache)
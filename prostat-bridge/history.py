@@ -0,0 +1,297 @@
+"""
+In-memory sensor history with multi-resolution rollups
+
+Each metric keeps its recent raw samples plus min/max/mean rollups at 1
+minute, 15 minute and 1 hour resolution. Everything is stored in
+fixed-capacity ring buffers of parallel array('d') columns. Memory is
+allocated up front (8 bytes per value, see memory_bytes()) and never grows,
+and a range query is a binary search on the time column plus array slices,
+with no per-sample Python objects.
+
+Samples must be recorded in time order per metric; a timestamp older than
+the previous one is clamped to it (wall clock stepped back by NTP).
+
+downsample() builds the same buckets from raw columns read back from
+elsewhere (the on-disk store), for ranges older than the buffers.
+"""
+
+from array import array
+from bisect import bisect_left
+
+# Rollup resolutions: name -> bucket length (seconds)
+RESOLUTIONS = {'1m': 60, '15m': 900, '1h': 3600}
+
+# Default retention: raw samples and buckets per rollup. With a 10 s sample
+# interval: 24 h raw, 2 days of 1m, 30 days of 15m, a year of 1h buckets.
+RAW_SIZE = 8640
+ROLLUP_SIZES = {'1m': 2880, '15m': 2880, '1h': 8760}
+
+
+def downsample(times, values, seconds):
+    """
+    min/max/mean buckets from raw columns, aligned like the in-memory rollups
+
+    Args:
+        times: Sample times, ascending
+        values: Sample values (NaN = no reading, skipped)
+        seconds: Bucket length
+
+    Returns:
+        {'t', 'min', 'max', 'mean'}: array('d') (t is the bucket start)
+    """
+    result = {name: array('d') for name in ('t', 'min', 'max', 'mean')}
+    i, n = 0, len(times)
+    while i < n:
+        bucket = times[i] - times[i] % seconds
+        j = bisect_left(times, bucket + seconds, i)
+        chunk = values[i:j]
+        total = sum(chunk)
+        if total != total:  # NaN: drop the missing readings
+            chunk = [value for value in chunk if value == value]
+            total = sum(chunk)
+        if chunk:
+            result['t'].append(bucket)
+            result['min'].append(min(chunk))
+            result['max'].append(max(chunk))
+            result['mean'].append(total / len(chunk))
+        i = j
+    return result
+
+
+class Ring:
+    """
+    Fixed-capacity ring of parallel float columns, oldest row first
+
+    The first column is the row time and must not decrease.
+    """
+
+    __slots__ = ('capacity', 'names', 'columns', 'start', 'size')
+
+    def __init__(self, capacity, names):
+        self.capacity = capacity
+        self.names = names
+        self.columns = [array('d', bytes(8 * capacity)) for _ in names]
+        self.start = 0  # Physical index of the oldest row
+        self.size = 0
+
+    def append(self, *values):
+        if self.size < self.capacity:
+            i = (self.start + self.size) % self.capacity
+            self.size += 1
+        else:
+            i = self.start  # Overwrite the oldest row
+            self.start = (self.start + 1) % self.capacity
+        for column, value in zip(self.columns, values):
+            column[i] = value
+
+    def time_at(self, n):
+        """Time of the n-th oldest row"""
+        return self.columns[0][(self.start + n) % self.capacity]
+
+    @property
+    def oldest(self):
+        return self.time_at(0) if self.size else None
+
+    @property
+    def newest(self):
+        return self.time_at(self.size - 1) if self.size else None
+
+    def _bisect(self, t):
+        """Logical index of the first row with time >= t"""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.time_at(mid) < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start, end):
+        """
+        Rows with start <= time < end
+
+        Returns:
+            {column name: array('d')}
+        """
+        first = self._bisect(start)
+        last = self._bisect(end)
+        lo = (self.start + first) % self.capacity
+        count = last - first
+        result = {}
+        for name, column in zip(self.names, self.columns):
+            if lo + count <= self.capacity:
+                result[name] = column[lo:lo + count]
+            else:  # Wraps around the end of the buffer
+                result[name] = column[lo:] + column[:lo + count - self.capacity]
+        return result
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in self.columns)
+
+
+class Rollup:
+    """min/max/mean buckets of one resolution; the open bucket is not in the ring yet"""
+
+    __slots__ = ('seconds', 'ring', 'bucket', 'low', 'high', 'total', 'count')
+
+    def __init__(self, seconds, capacity):
+        self.seconds = seconds
+        self.ring = Ring(capacity, ('t', 'min', 'max', 'mean'))
+        self.bucket = None  # Start time of the open bucket
+        self.low = self.high = self.total = 0.0
+        self.count = 0
+
+    def add(self, t, value):
+        bucket = t - t % self.seconds
+        if bucket != self.bucket:
+            self.close()
+            self.bucket = bucket
+            self.low = self.high = value
+            self.total = 0.0
+            self.count = 0
+        elif value < self.low:
+            self.low = value
+        elif value > self.high:
+            self.high = value
+        self.total += value
+        self.count += 1
+
+    def close(self):
+        if self.count:
+            self.ring.append(self.bucket, self.low, self.high, self.total / self.count)
+        self.count = 0
+
+    def range(self, start, end):
+        rows = self.ring.range(start, end)
+        if self.count and start <= self.bucket < end:
+            for name, value in zip(self.ring.names,
+                                   (self.bucket, self.low, self.high, self.total / self.count)):
+                rows[name].append(value)
+        return rows
+
+
+class MetricHistory:
+    """Raw samples and rollups of one metric"""
+
+    __slots__ = ('raw', 'rollups', 'first_time', 'last_time')
+
+    def __init__(self, raw_size=RAW_SIZE, rollup_sizes=None):
+        rollup_sizes = rollup_sizes or ROLLUP_SIZES
+        self.raw = Ring(raw_size, ('t', 'value'))
+        self.rollups = {res: Rollup(RESOLUTIONS[res], size) for res, size in rollup_sizes.items()}
+        self.first_time = self.last_time = None
+
+    def record(self, t, value):
+        if self.last_time is not None and t < self.last_time:
+            t = self.last_time
+        if self.first_time is None:
+            self.first_time = t
+        self.last_time = t
+        value = float(value)
+        self.raw.append(t, value)
+        for rollup in self.rollups.values():
+            rollup.add(t, value)
+
+    def oldest(self, res):
+        if res == 'raw':
+            return self.raw.oldest
+        rollup = self.rollups[res]
+        return rollup.ring.oldest if rollup.ring.size else rollup.bucket
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(rollup.ring.nbytes() for rollup in self.rollups.values())
+
+
+class SensorHistory:
+    """
+    History of a fixed set of metrics
+
+    Args:
+        metrics: Metric names (e.g. system_state fields)
+        raw_size: Raw samples kept per metric
+        rollup_sizes: Buckets kept per rollup resolution ({'1m': n, ...})
+    """
+
+    def __init__(self, metrics, raw_size=RAW_SIZE, rollup_sizes=None):
+        self.metrics = {metric: MetricHistory(raw_size, rollup_sizes) for metric in metrics}
+        self.resolutions = ['raw', *next(iter(self.metrics.values())).rollups] if self.metrics else ['raw']
+
+    def record(self, metric, value, t):
+        """Add one sample; None (no reading) is skipped, booleans are stored as 0/1"""
+        if value is not None:
+            self.metrics[metric].record(t, value)
+
+    def sample(self, state, t):
+        """Record every tracked metric from a state mapping at time t"""
+        for metric, history in self.metrics.items():
+            value = state.get(metric)
+            if value is not None:
+                history.record(t, value)
+
+    def pick_resolution(self, metric, start):
+        """Finest resolution still holding data from `start` (or from the oldest data kept)"""
+        history = self.metrics[metric]
+        if history.first_time is not None:
+            # Coarsest buckets are floored to their resolution; data starts no earlier than first_time
+            start = max(start, history.first_time, history.oldest(self.resolutions[-1]))
+        for res in self.resolutions:
+            oldest = history.oldest(res)
+            if oldest is not None and oldest <= start:
+                return res
+        return self.resolutions[-1]
+
+    def resolution_for_span(self, span, sample_interval):
+        """
+        Finest resolution whose default retention covers `span` seconds
+
+        For ranges served from elsewhere (the on-disk store), so a range gets
+        the same resolution wherever it is read from.
+        """
+        history = next(iter(self.metrics.values()), None)
+        if history is None:
+            return 'raw'
+        if history.raw.capacity * sample_interval >= span:
+            return 'raw'
+        for res, rollup in history.rollups.items():
+            if rollup.ring.capacity * rollup.seconds >= span:
+                return res
+        return self.resolutions[-1]
+
+    def query(self, metric, start, end, res='auto'):
+        """
+        Samples or buckets of one metric in [start, end)
+
+        Args:
+            res: 'raw', '1m', '15m', '1h' or 'auto'
+
+        Returns:
+            (resolution, {column: array('d')}) - raw columns are t/value,
+            rollup columns t/min/max/mean (t is the bucket start)
+
+        Raises:
+            KeyError: Unknown metric
+            ValueError: Unknown resolution
+        """
+        history = self.metrics[metric]
+        if res == 'auto':
+            res = self.pick_resolution(metric, start)
+        if res == 'raw':
+            return res, history.raw.range(start, end)
+        if res not in history.rollups:
+            raise ValueError(f"Unknown resolution {res!r} (use one of: auto, {', '.join(self.resolutions)})")
+        return res, history.rollups[res].range(start, end)
+
+    def memory_bytes(self):
+        """Bytes allocated for all buffers (fixed at construction)"""
+        return sum(history.nbytes() for history in self.metrics.values())
+
+    def describe(self):
+        """Per-metric sample counts and oldest retained time per resolution"""
+        return {
+            metric: {
+                'samples': history.raw.size,
+                'oldest': {res: history.oldest(res) for res in self.resolutions},
+            }
+            for metric, history in self.metrics.items()
+        }
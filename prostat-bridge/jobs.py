@@ -0,0 +1,169 @@
+"""
+Scheduler for timed multi-step sequences (Circulation Kick, Dust Kicker, ...)
+
+A job is a coroutine function taking its Job as the first argument. It runs
+as its own task, so the control loop that started it carries on instead of
+sleeping through the sequence. Jobs record their steps and waits via
+job.step() / job.sleep(), which is what /api/tasks shows; a job's finally
+block is its cleanup and runs on cancellation too.
+
+    async def kick(job):
+        job.step("Fan ON")
+        await set_fan('on')
+        try:
+            await job.sleep(300, "Stirring air")
+        finally:
+            await set_fan('auto')
+
+    jobs = JobScheduler()
+    jobs.start('circulation_kick', kick)
+    ...
+    await jobs.shutdown()  # Cancels running jobs and waits for their cleanup
+
+Only one job of a name runs at a time.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """One run of a sequence: status, current step and step log"""
+
+    def __init__(self, name):
+        self.name = name
+        self.task = None
+        self.status = 'running'  # running, done, cancelled, failed
+        self.created = datetime.now().isoformat()
+        self.finished = None
+        self.error = None
+        self.current = None  # Description of the current step
+        self.wake_at = None  # Unix time the current wait ends
+        self.steps = []  # [(iso time, description)]
+
+    def step(self, description):
+        """Record the start of a step"""
+        self.current = description
+        self.wake_at = None
+        self.steps.append((datetime.now().isoformat(), description))
+        logger.info(f"[{self.name}] {description}")
+
+    async def sleep(self, seconds, description=None):
+        """Wait as part of the sequence (shown as the current step with its end time)"""
+        if description:
+            self.step(description)
+        self.wake_at = time.time() + seconds
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.wake_at = None
+
+    @property
+    def running(self):
+        return self.status == 'running'
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'status': self.status,
+            'created': self.created,
+            'finished': self.finished,
+            'step': self.current,
+            'remaining': round(self.wake_at - time.time(), 1) if self.wake_at else None,
+            'steps': [{'time': at, 'step': description} for at, description in self.steps],
+            'error': self.error,
+        }
+
+
+class JobScheduler:
+    """
+    Runs named jobs as tasks and keeps their handles
+
+    Args:
+        history_size: Finished jobs kept for describe()
+    """
+
+    def __init__(self, history_size=20):
+        self.jobs = {}  # name -> running Job
+        self.history = deque(maxlen=history_size)
+
+    def running(self, name):
+        return name in self.jobs
+
+    def start(self, name, function, *args):
+        """
+        Start function(job, *args) as job `name`
+
+        Returns:
+            The Job
+
+        Raises:
+            RuntimeError: A job of this name is already running
+        """
+        if name in self.jobs:
+            raise RuntimeError(f"{name} is already running")
+        job = Job(name)
+        job.task = asyncio.create_task(self._run(job, function, args), name=f"job:{name}")
+        # Bookkeeping in a done callback rather than _run's finally: a task
+        # cancelled before its first step never enters _run at all
+        job.task.add_done_callback(lambda task: self._finished(job, task))
+        self.jobs[name] = job
+        return job
+
+    async def _run(self, job, function, args):
+        try:
+            await function(job, *args)
+            job.status = 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+            logger.info(f"[{job.name}] Cancelled")
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            logger.error(f"[{job.name}] Failed: {e}", exc_info=True)
+
+    def _finished(self, job, task):
+        if task.cancelled() and job.running:
+            job.status = 'cancelled'
+            logger.info(f"[{job.name}] Cancelled before it started")
+        job.finished = datetime.now().isoformat()
+        job.current = None
+        job.wake_at = None
+        if self.jobs.get(job.name) is job:
+            del self.jobs[job.name]
+        self.history.append(job)
+
+    def cancel(self, name):
+        """
+        Cancel a running job; its cleanup (finally blocks) still runs
+
+        Returns:
+            True if a job was running
+        """
+        job = self.jobs.get(name)
+        if job is None:
+            return False
+        job.task.cancel()
+        return True
+
+    async def shutdown(self, timeout=30.0):
+        """Cancel every running job and wait up to `timeout` for their cleanup"""
+        tasks = [job.task for job in self.jobs.values()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                logger.warning(f"{len(pending)} job(s) still cleaning up after {timeout}s")
+
+    def describe(self):
+        """Running jobs and recently finished ones (newest first)"""
+        return {
+            'running': [job.describe() for job in self.jobs.values()],
+            'recent': [job.describe() for job in reversed(self.history)],
+        }
@@ -0,0 +1,73 @@
+"""
+Small JSON file helpers shared by the bridge services
+
+Files are written atomically (temp file + rename) so a power cut on the
+Pi never leaves a half-written cache or store behind. They are created
+owner-only (0600, directory 0700): the pairing store holds the HomeKit
+controller's long-term keys.
+"""
+
+import json
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+# Directory for bridge state files (caches, pairing store, ...), outside the
+# code tree so checkouts and their backups don't carry the pairing keys
+STATE_DIR = os.getenv('PROSTAT_STATE_DIR') or os.path.join(
+    os.getenv('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'),
+    'prostat-bridge'
+)
+
+# Where state files lived before STATE_DIR moved out of the code tree
+LEGACY_STATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def state_path(filename):
+    """
+    Path of a state file inside STATE_DIR
+    
+    With the default STATE_DIR, a file still in the legacy location (the
+    code directory) is moved over on first use and made owner-only.
+    """
+    path = os.path.join(STATE_DIR, filename)
+    legacy_path = os.path.join(LEGACY_STATE_DIR, filename)
+    if not os.getenv('PROSTAT_STATE_DIR') and os.path.exists(legacy_path) and not os.path.exists(path):
+        try:
+            os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+            shutil.move(legacy_path, path)
+            if os.path.isfile(path):
+                os.chmod(path, 0o600)
+            logger.info(f"Moved state file {legacy_path} to {path}")
+        except OSError as e:
+            logger.error(f"Could not move state file {legacy_path} to {path}: {e}")
+            return legacy_path
+    return path
+
+
+def load_json(path, default=None):
+    """Load a JSON file, returning `default` if it is missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable state file {path}: {e}")
+        return default
+
+
+def save_json(path, data):
+    """Atomically write `data` as JSON to `path`"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)  # Also if a stale temp file was left with other permissions
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
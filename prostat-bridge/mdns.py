@@ -0,0 +1,119 @@
+"""
+Incremental HomeKit discovery from mDNS announcements
+
+A zeroconf service browser on _hap._tcp reports accessories as their
+announcements arrive, change (a firmware update bumps the config number
+c#) or are withdrawn, so the discovery table follows the network without
+waiting for the next full scan.
+
+    browser = HapBrowser(on_update=record, on_remove=forget)
+    await browser.start()
+    ...
+    await browser.stop()
+
+on_update(device_id, description) gets the accessory's TXT record in the
+shape aiohomekit discovery descriptions have ('name', 'id', 'md', 'ci',
+'c#', ...); on_remove(device_id) is called when it says goodbye or its
+record expires.
+"""
+
+import asyncio
+import logging
+
+from zeroconf import ServiceStateChange
+from zeroconf.asyncio import AsyncServiceBrowser, AsyncServiceInfo, AsyncZeroconf
+
+logger = logging.getLogger(__name__)
+
+HAP_TYPE = '_hap._tcp.local.'
+RESOLVE_TIMEOUT_MS = 3000
+
+
+def parse_description(info):
+    """aiohomekit-style description dict from a resolved service, or None without an id"""
+    description = {'name': info.name, 'port': info.port}
+    for key, value in (info.properties or {}).items():
+        if value is not None:
+            description[key.decode('utf-8', 'replace').lower()] = value.decode('utf-8', 'replace')
+    return description if description.get('id') else None
+
+
+class HapBrowser:
+    """
+    Watches _hap._tcp announcements and reports each change
+
+    Args:
+        on_update: Callback (device_id, description) for a new or changed accessory
+        on_remove: Callback (device_id) when an accessory goes away
+    """
+
+    def __init__(self, on_update, on_remove):
+        self.on_update = on_update
+        self.on_remove = on_remove
+        self.zeroconf = None
+        self.browser = None
+        self.loop = None
+        self.names = {}  # Service name -> device ID, to map removals
+        self.tasks = set()
+        self.stats = {'announcements': 0, 'removals': 0, 'errors': 0}
+
+    @property
+    def running(self):
+        return self.browser is not None
+
+    async def start(self):
+        """Start browsing (announcements already cached are reported first)"""
+        if self.browser is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.zeroconf = AsyncZeroconf()
+        self.browser = AsyncServiceBrowser(self.zeroconf.zeroconf, HAP_TYPE, handlers=[self._handle])
+        logger.info(f"Browsing {HAP_TYPE} for HomeKit announcements")
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.browser is not None:
+            await self.browser.async_cancel()
+            self.browser = None
+        if self.zeroconf is not None:
+            await self.zeroconf.async_close()
+            self.zeroconf = None
+
+    def _handle(self, zeroconf, service_type, name, state_change):
+        # zeroconf may call handlers from its own thread
+        self.loop.call_soon_threadsafe(self._changed, name, state_change)
+
+    def _changed(self, name, state_change):
+        if state_change is ServiceStateChange.Removed:
+            device_id = self.names.pop(name, None)
+            if device_id is not None:
+                self.stats['removals'] += 1
+                self._call(self.on_remove, device_id)
+            return
+        task = asyncio.create_task(self._resolve(name))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _resolve(self, name):
+        info = AsyncServiceInfo(HAP_TYPE, name)
+        try:
+            if not await info.async_request(self.zeroconf.zeroconf, RESOLVE_TIMEOUT_MS):
+                return
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.debug(f"Resolving {name} failed: {e}")
+            return
+        description = parse_description(info)
+        if description is None:
+            return
+        self.names[name] = description['id']
+        self.stats['announcements'] += 1
+        self._call(self.on_update, description['id'], description)
+
+    def _call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"mDNS discovery callback failed: {e}")
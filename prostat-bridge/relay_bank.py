@@ -0,0 +1,121 @@
+"""
+Named relay channels
+
+Maps names ('dehumidifier', 'erv', 'humidifier', 'booster_fan') to board
+channel numbers on top of the RelayScheduler, so callers switch equipment
+rather than relay numbers and can switch several pieces of equipment in
+one batch. Channel state lives in the scheduler; status() reports
+every channel from memory without touching the board.
+
+Channel map format (RELAY_CHANNELS): "dehumidifier=2,erv=1,humidifier=3,booster_fan=4"
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-channel fields that only change with a published state change
+STATE_KEYS = ('on', 'pending', 'cycles')
+
+
+def parse_channel_map(spec):
+    """
+    Parse "name=channel,..." into {name: channel}
+
+    Raises:
+        ValueError: Malformed entry or a channel used twice
+    """
+    channels = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, number = entry.partition('=')
+        name = name.strip()
+        if not name or not number.strip().isdigit():
+            raise ValueError(f"Invalid relay channel entry: {entry!r}")
+        channel = int(number)
+        if channel < 1:
+            raise ValueError(f"Relay channels are 1-based: {entry!r}")
+        if channel in channels.values():
+            raise ValueError(f"Relay channel {channel} assigned twice")
+        channels[name] = channel
+    return channels
+
+
+class RelayBank:
+    """
+    Named channels of one relay board
+
+    Args:
+        scheduler: RelayScheduler driving the board
+        channels: {name: channel number}
+    """
+
+    def __init__(self, scheduler, channels):
+        self.scheduler = scheduler
+        self.channels = dict(channels)
+        self.names = {channel: name for name, channel in self.channels.items()}
+
+    def name_of(self, channel):
+        return self.names.get(channel, f"relay{channel}")
+
+    def resolve(self, key):
+        """
+        Channel number for a name or number ("erv", 3, "3")
+
+        Raises:
+            ValueError: Unknown name or invalid number
+        """
+        if isinstance(key, str) and key in self.channels:
+            return self.channels[key]
+        try:
+            channel = int(key)
+        except (TypeError, ValueError):
+            raise ValueError(f"Unknown relay channel: {key!r}") from None
+        if channel < 1:
+            raise ValueError(f"Relay channels are 1-based: {key!r}")
+        return channel
+
+    async def switch(self, key, on, force=False):
+        """Switch one channel; see switch_many()"""
+        return (await self.switch_many([(key, on)], force))[0]
+
+    async def switch_many(self, commands, force=False):
+        """
+        Switch several channels; everything due now goes out in one batch
+
+        Args:
+            commands: {name_or_channel: on} or [(name_or_channel, on), ...]
+            force: Ignore min on/off times (manual override)
+
+        Returns:
+            list of scheduler results with 'name' added
+        """
+        if isinstance(commands, dict):
+            commands = commands.items()
+        resolved = [(self.resolve(key), bool(on)) for key, on in commands]
+        results = await self.scheduler.request_many(resolved, force)
+        for result in results:
+            result['name'] = self.name_of(result['channel'])
+        return results
+
+    def is_on(self, key):
+        return bool(self.scheduler.commanded(self.resolve(key)))
+
+    def status(self, counters=True):
+        """
+        State of every channel, keyed by name
+
+        Named channels are always listed (on=None until first written);
+        unnamed channels appear once they have been switched.
+
+        Args:
+            counters: Include write counters and runtimes, which move without
+                a state change (leave out for ETagged responses)
+        """
+        stats = self.scheduler.get_stats()
+        status = {}
+        for channel in sorted(set(self.names) | {int(c) for c in stats}):
+            entry = stats.get(str(channel), {'on': None, 'pending': None})
+            if not counters:
+                entry = {key: entry.get(key) for key in STATE_KEYS}
+            status[self.name_of(channel)] = {'channel': channel, **entry}
+        return status
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Relay path latency / throughput benchmark
+
+Drives relay commands through one of the bridge's relay paths against the
+PTY simulator (relay_sim.py) and reports how long each command takes to be
+acknowledged by the caller and to reach the "board":
+
+    transport - RelayTransport + RelayScheduler (no HTTP, no server import)
+    control   - server.control_relay()
+    shield    - asthma_shield.set_dehumidifier_relay()
+    http      - POST /api/relay/control on a running bridge
+
+Each run has a sequential phase (one command at a time: latency) and a
+burst phase (--concurrency commands in flight: throughput). Every command
+toggles a channel so none is dropped as a no-op.
+
+Usage:
+    python relay_bench.py --path transport -n 500
+    python relay_bench.py --path http --spawn-server -n 200
+    python relay_bench.py --path control --drop-rate 0.01 --delay 0.002
+
+Min on/off times are disabled for the run (RELAY_MIN_ON=RELAY_MIN_OFF=0).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from relay_sim import RelaySimulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(label, ack, delivered, lost, elapsed):
+    """One result row; latencies in ms"""
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+    count = len(ack)
+    return {
+        'phase': label,
+        'commands': count,
+        'lost': lost,
+        'throughput_per_s': round(count / elapsed, 1) if elapsed else None,
+        'ack_p50_ms': ms(percentile(ack, 0.5)),
+        'ack_p95_ms': ms(percentile(ack, 0.95)),
+        'ack_p99_ms': ms(percentile(ack, 0.99)),
+        'delivered_p50_ms': ms(percentile(delivered, 0.5)),
+        'delivered_p95_ms': ms(percentile(delivered, 0.95)),
+        'delivered_max_ms': ms(max(delivered) if delivered else None),
+    }
+
+
+def command_sequence(count, channels):
+    """(channel, on) pairs that flip a channel on every use"""
+    state = {}
+    for i in range(count):
+        channel = channels[i % len(channels)]
+        state[channel] = not state.get(channel, False)
+        yield channel, state[channel]
+
+
+async def wait_delivered(sim, count, timeout):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, sim.wait_for, count, timeout)
+
+
+async def run_sequential(send, sim, commands, timeout):
+    ack, delivered, lost = [], [], 0
+    started = time.monotonic()
+    for channel, on in commands:
+        expected = sim.stats['commands'] + 1
+        t0 = time.monotonic()
+        try:
+            await send(channel, on)
+        except Exception:
+            lost += 1
+            continue
+        ack.append(time.monotonic() - t0)
+        if await wait_delivered(sim, expected, timeout):
+            delivered.append(sim.received[-1][0] - t0)
+        else:
+            lost += 1
+    return summarize('sequential', ack, delivered, lost, time.monotonic() - started)
+
+
+async def run_burst(send, sim, commands, concurrency, timeout):
+    """
+    Keep `concurrency` commands in flight. Commands for one channel are
+    serialized so the toggles stay meaningful.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    channel_locks = {}
+    ack, errors = [], 0
+    baseline = sim.stats['commands']
+
+    async def one(channel, on):
+        nonlocal errors
+        lock = channel_locks.setdefault(channel, asyncio.Lock())
+        async with semaphore, lock:
+            t0 = time.monotonic()
+            try:
+                await send(channel, on)
+                ack.append(time.monotonic() - t0)
+            except Exception:
+                errors += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(channel, on) for channel, on in commands))
+    await wait_delivered(sim, baseline + len(ack), timeout)
+    elapsed = time.monotonic() - started
+    lost = errors + max(0, baseline + len(ack) - sim.stats['commands'])
+    return summarize(f'burst x{concurrency}', ack, [], lost, elapsed)
+
+
+# ============================================================================
+# Relay paths
+# ============================================================================
+
+async def transport_path(sim):
+    from relay_transport import RelayTransport
+    from relay_scheduler import RelayScheduler
+
+    relay = RelayTransport()
+    await relay.open(os.path.realpath(sim.port))
+    scheduler = RelayScheduler(relay)
+    relay.start_supervisor(on_reconnect=scheduler.replay, pinned_path=sim.port)
+
+    async def send(channel, on):
+        await scheduler.request(channel, on, force=True)
+
+    return send, relay.close
+
+
+async def control_path(sim):
+    os.environ['RELAY_PORT'] = sim.port
+    import server
+
+    await server.init_relay()
+
+    async def send(channel, on):
+        await server.control_relay(channel, on, force=True)
+
+    return send, server.relay.close
+
+
+async def shield_path(sim):
+    import asthma_shield
+
+    # Its min on/off times are constants, not environment settings
+    asthma_shield.relay_scheduler.min_on = asthma_shield.relay_scheduler.min_off = 0
+    os.environ['RELAY_PORT'] = sim.port
+    await asthma_shield.init_relay()
+
+    async def send(channel, on):
+        if not await asthma_shield.set_dehumidifier_relay(on):
+            raise RuntimeError('relay command failed')
+
+    return send, asthma_shield.relay.close
+
+
+async def http_path(sim, url, spawn_server):
+    import aiohttp
+
+    process = None
+    if spawn_server:
+        env = dict(os.environ, RELAY_PORT=sim.port, RELAY_MIN_ON='0', RELAY_MIN_OFF='0')
+        process = subprocess.Popen([sys.executable, os.path.join(HERE, 'server.py')],
+                                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            async with session.get(f"{url}/api/relay/status") as response:
+                if (await response.json()).get('connected'):
+                    break
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            await session.close()
+            raise RuntimeError(f"Bridge at {url} not reachable or relay not connected")
+        await asyncio.sleep(0.25)
+
+    async def send(channel, on):
+        payload = {'channel': channel, 'on': on, 'force': True}
+        async with session.post(f"{url}/api/relay/control", json=payload) as response:
+            if response.status != 200:
+                raise RuntimeError(await response.text())
+
+    async def close():
+        await session.close()
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    return send, close
+
+
+async def run(args):
+    sim = RelaySimulator(channels=8, delay=args.delay, drop_rate=args.drop_rate,
+                         disconnect_every=args.disconnect_every,
+                         disconnect_for=args.disconnect_for, link=args.link, seed=1)
+    sim.start()
+    try:
+        if args.path == 'transport':
+            send, close = await transport_path(sim)
+        elif args.path == 'control':
+            send, close = await control_path(sim)
+        elif args.path == 'shield':
+            send, close = await shield_path(sim)
+        else:
+            send, close = await http_path(sim, args.url, args.spawn_server)
+
+        # asthma_shield only drives the dehumidifier channel
+        channels = [2] if args.path == 'shield' else list(range(1, 9))
+        commands = list(command_sequence(2 * args.count, channels))
+        try:
+            results = [
+                await run_sequential(send, sim, commands[:args.count], args.timeout),
+                await run_burst(send, sim, commands[args.count:], args.concurrency, args.timeout),
+            ]
+        finally:
+            await close()
+    finally:
+        sim.stop()
+
+    return {'path': args.path, 'results': results, 'simulator': sim.stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Relay path latency/throughput benchmark')
+    parser.add_argument('--path', choices=('transport', 'control', 'shield', 'http'), default='transport')
+    parser.add_argument('-n', '--count', type=int, default=200, help='Commands per phase')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=2.0, help='Seconds to wait for delivery')
+    parser.add_argument('--delay', type=float, default=0.0, help='Simulated board delay per command')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Simulated byte loss')
+    parser.add_argument('--disconnect-every', type=float, help='Simulated unplug interval (s)')
+    parser.add_argument('--disconnect-for', type=float, default=1.0, help='Simulated unplug duration (s)')
+    parser.add_argument('--link', default='/tmp/relay-bench', help='Simulator PTY symlink')
+    parser.add_argument('--url', default='http://localhost:8080', help='Bridge URL (http path)')
+    parser.add_argument('--spawn-server', action='store_true', help='Start server.py against the simulator')
+    args = parser.parse_args()
+
+    # Benchmark the write path, not the compressor protection
+    os.environ['RELAY_MIN_ON'] = os.environ['RELAY_MIN_OFF'] = '0'
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
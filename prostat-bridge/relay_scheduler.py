@@ -0,0 +1,228 @@
+"""
+State-diffing relay scheduler
+
+Sits between the control logic and RelayTransport:
+- Tracks the commanded state of every channel and drops writes that
+  wouldn't change anything (control loops may re-assert a state every cycle)
+- Enforces minimum on/off dwell times so the dehumidifier compressor can't
+  short-cycle. A transition requested too early is deferred until the dwell
+  has elapsed; a later request for the other state cancels it (last wins).
+- Counts cycles and accumulated on-time per channel
+- Remembers the last requested state even if the write failed, so
+  replay() can restore the board after a reconnect
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelState:
+    """Bookkeeping for one relay channel"""
+
+    __slots__ = ('commanded', 'desired', 'changed_at', 'pending', 'timer',
+                 'cycles', 'on_seconds', 'writes', 'suppressed', 'deferred')
+
+    def __init__(self):
+        self.commanded = None  # Unknown until first write
+        self.desired = None  # Last requested state (survives failed writes)
+        self.changed_at = None  # monotonic time of last transition
+        self.pending = None  # Deferred target state
+        self.timer = None  # Task applying the deferred state
+        self.cycles = 0  # off -> on transitions
+        self.on_seconds = 0.0  # Accumulated on-time (closed intervals)
+        self.writes = 0
+        self.suppressed = 0  # No-op requests dropped
+        self.deferred = 0  # Requests delayed by dwell times
+
+
+class RelayScheduler:
+    """
+    Decides when relay commands actually reach the transport
+
+    Args:
+        transport: RelayTransport (or anything with send_many())
+        min_on: Minimum seconds a channel stays on before it may turn off
+        min_off: Minimum seconds a channel stays off before it may turn on
+        on_change: Optional callback(channel, on) after a state is written
+        on_pending: Optional callback(channel, target) when a deferred
+            transition is scheduled or dropped (target None)
+    """
+
+    def __init__(self, transport, min_on=0.0, min_off=0.0, on_change=None, on_pending=None):
+        self.transport = transport
+        self.min_on = min_on
+        self.min_off = min_off
+        self.on_change = on_change
+        self.on_pending = on_pending
+        self._channels = {}
+        self._dwell = {}  # channel -> (min_on, min_off) overrides
+
+    def set_dwell(self, channel, min_on, min_off):
+        """Per-channel min on/off times (e.g. none for a fan, long for a compressor)"""
+        self._dwell[channel] = (min_on, min_off)
+
+    def _state(self, channel):
+        if channel not in self._channels:
+            self._channels[channel] = ChannelState()
+        return self._channels[channel]
+
+    def commanded(self, channel):
+        """Last state written to a channel (None if never written)"""
+        state = self._channels.get(channel)
+        return state.commanded if state else None
+
+    def _dwell_remaining(self, channel, state):
+        if state.commanded is None or state.changed_at is None:
+            return 0.0
+        min_on, min_off = self._dwell.get(channel, (self.min_on, self.min_off))
+        dwell = min_on if state.commanded else min_off
+        return max(0.0, dwell - (time.monotonic() - state.changed_at))
+
+    def _set_pending(self, channel, state, target):
+        if state.pending != target:
+            state.pending = target
+            if self.on_pending:
+                self.on_pending(channel, target)
+
+    def _cancel_pending(self, channel, state):
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = None
+        self._set_pending(channel, state, None)
+
+    async def request(self, channel, on, force=False):
+        """Request one channel state; see request_many()"""
+        return (await self.request_many([(channel, on)], force))[0]
+
+    async def request_many(self, commands, force=False):
+        """
+        Request several channel states; immediate ones go out in one batch
+
+        Args:
+            commands: [(channel, on), ...]
+            force: Ignore dwell times (manual override)
+
+        Returns:
+            list of {'channel', 'on', 'action'} where action is 'sent',
+            'noop' or 'deferred' (with 'apply_in' seconds)
+        """
+        results = []
+        immediate = []
+
+        for channel, on in commands:
+            on = bool(on)
+            state = self._state(channel)
+            state.desired = on
+
+            if state.commanded == on:
+                # Already there - drop the write and any contrary deferral
+                self._cancel_pending(channel, state)
+                state.suppressed += 1
+                results.append({'channel': channel, 'on': on, 'action': 'noop'})
+                continue
+
+            wait = 0.0 if force else self._dwell_remaining(channel, state)
+            if wait > 0:
+                self._set_pending(channel, state, on)
+                state.deferred += 1
+                if state.timer is None:
+                    state.timer = asyncio.create_task(self._apply_later(channel, wait))
+                results.append({'channel': channel, 'on': on, 'action': 'deferred',
+                                'apply_in': round(wait, 1)})
+                continue
+
+            self._cancel_pending(channel, state)
+            immediate.append((channel, on))
+            results.append({'channel': channel, 'on': on, 'action': 'sent'})
+
+        if immediate:
+            await self._write(immediate)
+
+        return results
+
+    async def _apply_later(self, channel, delay):
+        """Apply a deferred transition once its dwell time has passed"""
+        state = self._state(channel)
+        try:
+            await asyncio.sleep(delay)
+            state.timer = None
+            target = state.pending
+            self._set_pending(channel, state, None)
+            if target is None or target == state.commanded:
+                return
+            logger.info(f"Relay {channel}: applying deferred {'ON' if target else 'OFF'}")
+            await self._write([(channel, target)])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Deferred relay {channel} transition failed: {e}")
+
+    async def _write(self, commands):
+        if len(commands) == 1:
+            await self.transport.send(*commands[0])
+        else:
+            await self.transport.send_many(commands)
+        self._record(commands)
+
+    def _record(self, commands):
+        """Bookkeeping after commands reached the board"""
+        now = time.monotonic()
+        for channel, on in commands:
+            state = self._state(channel)
+            if state.commanded and not on and state.changed_at is not None:
+                state.on_seconds += now - state.changed_at
+            if on and not state.commanded:
+                state.cycles += 1
+            changed = state.commanded != on
+            state.commanded = on
+            state.writes += 1
+            if changed:
+                state.changed_at = now
+                if self.on_change:
+                    self.on_change(channel, on)
+
+    async def replay(self):
+        """
+        Re-send every channel's state in one batch (e.g. after the board
+        reconnects - a power-cycled board comes back with all relays off)
+
+        Channels whose last request failed to write get their requested
+        state; deferred transitions stay deferred.
+
+        Returns:
+            [(channel, on), ...] as sent
+        """
+        commands = []
+        for channel, state in sorted(self._channels.items()):
+            target = state.desired if state.timer is None else state.commanded
+            if target is None:
+                target = state.commanded
+            if target is not None:
+                commands.append((channel, target))
+        if commands:
+            await self.transport.send_many(commands)
+            self._record(commands)
+        return commands
+
+    def get_stats(self):
+        """Per-channel state, cycle counts and runtime"""
+        now = time.monotonic()
+        stats = {}
+        for channel, state in sorted(self._channels.items()):
+            on_seconds = state.on_seconds
+            if state.commanded and state.changed_at is not None:
+                on_seconds += now - state.changed_at
+            stats[str(channel)] = {
+                'on': state.commanded,
+                'pending': state.pending,
+                'since_change': round(now - state.changed_at, 1) if state.changed_at else None,
+                'cycles': state.cycles,
+                'on_seconds': round(on_seconds, 1),
+                'writes': state.writes,
+                'suppressed': state.suppressed,
+                'deferred': state.deferred,
+            }
+        return stats
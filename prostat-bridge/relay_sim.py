@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+CH340 USB relay board simulator on a Linux pseudo-terminal
+
+Speaks the board's AT+ONn / AT+OFFn protocol so the relay path of
+server.py and asthma_shield.py can be exercised without hardware. Faults
+can be injected to check the transport and supervisor:
+- delay: seconds the "board" takes to consume each command
+- drop rate: probability that any received byte is lost
+- disconnects: the PTY is torn down every N seconds and comes back after
+  a pause, like a USB glitch
+
+The PTY slave path changes on every reconnect, so a stable symlink (--link)
+is kept pointing at the current one - point RELAY_PORT at it.
+
+Usage:
+    python relay_sim.py --link /tmp/relay-sim
+    RELAY_PORT=/tmp/relay-sim RELAY_MIN_ON=0 RELAY_MIN_OFF=0 python server.py
+
+Linux/macOS only (needs os.openpty).
+"""
+
+import argparse
+import logging
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+
+logger = logging.getLogger(__name__)
+
+COMMAND_RE = re.compile(rb'AT\+(ON|OFF)(\d+)')
+
+
+class RelaySimulator:
+    """
+    Simulated relay board
+
+    Args:
+        channels: Number of relays on the board
+        delay: Seconds spent on each command before reading the next one
+        drop_rate: Probability (0-1) of losing each received byte
+        disconnect_every: Seconds between simulated unplugs (None = never)
+        disconnect_for: Seconds the board stays unplugged
+        link: Symlink kept pointing at the current PTY
+        seed: Random seed for reproducible byte drops
+    """
+
+    def __init__(self, channels=8, delay=0.0, drop_rate=0.0, disconnect_every=None,
+                 disconnect_for=1.0, link=None, seed=None):
+        self.channels = channels
+        self.delay = delay
+        self.drop_rate = drop_rate
+        self.disconnect_every = disconnect_every
+        self.disconnect_for = disconnect_for
+        self.link = link
+        self._random = random.Random(seed)
+        self.state = [False] * (channels + 1)  # 1-based; index 0 unused
+        self.received = []  # (monotonic time, channel, on) per parsed command
+        self.stats = {'commands': 0, 'invalid': 0, 'dropped_bytes': 0, 'disconnects': 0}
+        self.slave_path = None
+        self._master = None
+        self._slave = None
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def port(self):
+        """Path to open as the relay port"""
+        return self.link or self.slave_path
+
+    def start(self):
+        """Create the PTY and start serving it on a background thread"""
+        self._open_pty()
+        self._thread = threading.Thread(target=self._run, name='relay-sim', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._close_pty()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _open_pty(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.slave_path = os.ttyname(self._slave)
+        if self.link:
+            tmp = f"{self.link}.tmp"
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            os.symlink(self.slave_path, tmp)
+            os.replace(tmp, self.link)
+        logger.info(f"Relay simulator on {self.slave_path}" + (f" ({self.link})" if self.link else ""))
+
+    def _close_pty(self):
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def _run(self):
+        buffer = b''
+        next_disconnect = (time.monotonic() + self.disconnect_every) if self.disconnect_every else None
+
+        while not self._stop.is_set():
+            if next_disconnect is not None and time.monotonic() >= next_disconnect:
+                self.stats['disconnects'] += 1
+                logger.info("Relay simulator: unplugged")
+                self._close_pty()
+                buffer = b''
+                if self._stop.wait(self.disconnect_for):
+                    break
+                self._open_pty()
+                next_disconnect = time.monotonic() + self.disconnect_every
+
+            try:
+                readable, _, _ = select.select([self._master], [], [], 0.05)
+                if not readable:
+                    continue
+                data = os.read(self._master, 1024)
+            except (OSError, ValueError, TypeError):
+                continue
+
+            if self.drop_rate:
+                kept = bytes(b for b in data if self._random.random() >= self.drop_rate)
+                self.stats['dropped_bytes'] += len(data) - len(kept)
+                data = kept
+
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self._handle(line.strip())
+
+    def _handle(self, line):
+        if not line:
+            return
+        if self.delay:
+            time.sleep(self.delay)
+        match = COMMAND_RE.fullmatch(line)
+        channel = int(match.group(2)) if match else 0
+        if not match or not 1 <= channel <= self.channels:
+            self.stats['invalid'] += 1
+            logger.debug(f"Relay simulator: invalid command {line!r}")
+            return
+
+        on = match.group(1) == b'ON'
+        with self._changed:
+            self.state[channel] = on
+            self.stats['commands'] += 1
+            self.received.append((time.monotonic(), channel, on))
+            self._changed.notify_all()
+
+    def wait_for(self, count, timeout=5.0):
+        """
+        Block until `count` commands have been received in total
+
+        Returns:
+            True if they arrived before `timeout`
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.stats['commands'] >= count, timeout)
+
+    def snapshot(self):
+        """{channel: on} for every relay"""
+        return {channel: self.state[channel] for channel in range(1, self.channels + 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated CH340 relay board on a PTY')
+    parser.add_argument('--channels', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds per command')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='Probability of losing each byte')
+    parser.add_argument('--disconnect-every', type=float, help='Seconds between simulated unplugs')
+    parser.add_argument('--disconnect-for', type=float, default=1.0, help='Seconds unplugged')
+    parser.add_argument('--link', default='/tmp/relay-sim', help='Stable symlink to the PTY')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    sim = RelaySimulator(args.channels, args.delay, args.drop_rate, args.disconnect_every,
+                         args.disconnect_for, args.link, args.seed)
+    with sim:
+        logger.info(f"Set RELAY_PORT={sim.port}")
+        last = None
+        try:
+            while True:
+                time.sleep(1)
+                state = sim.snapshot()
+                if state != last:
+                    logger.info("Relays: " + ' '.join(f"{c}:{'ON' if on else 'off'}" for c, on in state.items()))
+                    last = state
+        except KeyboardInterrupt:
+            logger.info(f"Stopped: {sim.stats}")
+
+
+if __name__ == '__main__':
+    main()
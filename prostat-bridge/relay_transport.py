@@ -0,0 +1,291 @@
+"""
+Non-blocking serial transport for the CH340 USB relay module
+
+pyserial writes block (up to write_timeout) and a wedged USB relay would
+stall the asyncio event loop - and with it every HTTP handler and HomeKit
+connection. RelayTransport runs all port I/O on one dedicated thread fed
+by a command queue; callers get asyncio futures that resolve when the
+bytes have been written.
+
+An optional supervisor task handles hot-plug: it remembers the identity of
+the last good port (VID/PID, serial number, /dev/serial/by-id link),
+notices an unplug or write error within a second, and reconnects with
+exponential backoff - trying the remembered paths first and rescanning all
+comports only occasionally. After reconnecting it calls back so the last
+commanded channel states can be replayed.
+
+AT command format: AT+ON1\r\n / AT+OFF1\r\n (1-based channel number)
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+import serial.tools.list_ports
+
+logger = logging.getLogger(__name__)
+
+CH340_VID = 0x1a86
+CH340_PID = 0x7523
+
+SERIAL_BY_ID_DIR = '/dev/serial/by-id'
+
+
+def is_relay_port(port, identity=None):
+    """True if a comports() entry looks like our relay board"""
+    if identity and identity.get('vid') is not None:
+        if (port.vid, port.pid) != (identity['vid'], identity['pid']):
+            return False
+        # Tell identical boards apart when they report a serial number
+        return not identity.get('serial_number') or port.serial_number == identity['serial_number']
+    # Look for CH340 chip (common in USB relay modules)
+    if 'CH340' in (port.description or '') or 'CH340' in (port.manufacturer or ''):
+        return True
+    # Also check for common relay module VID/PID
+    return port.vid == CH340_VID and port.pid == CH340_PID
+
+
+def find_relay_port(identity=None):
+    """Find USB relay module (CH340), preferring a remembered identity"""
+    for port in serial.tools.list_ports.comports():
+        if is_relay_port(port, identity):
+            return port.device
+    return None
+
+
+def by_id_path(device):
+    """The stable /dev/serial/by-id symlink for a device node, if any"""
+    try:
+        target = os.path.realpath(device)
+        for name in os.listdir(SERIAL_BY_ID_DIR):
+            path = os.path.join(SERIAL_BY_ID_DIR, name)
+            if os.path.realpath(path) == target:
+                return path
+    except OSError:
+        pass
+    return None
+
+
+def port_identity(device):
+    """Remember how to recognize this port after a replug"""
+    identity = {'device': device, 'by_id': by_id_path(device), 'vid': None, 'pid': None, 'serial_number': None}
+    for port in serial.tools.list_ports.comports():
+        if port.device == device:
+            identity.update(vid=port.vid, pid=port.pid, serial_number=port.serial_number)
+            break
+    return identity
+
+
+def format_command(channel, on):
+    """AT command for one channel"""
+    return f"AT+{'ON' if on else 'OFF'}{channel}\r\n".encode()
+
+
+class RelayTransport:
+    """
+    Serial port owned by a single I/O thread
+
+    The executor's one worker thread is the command queue: writes are
+    executed in submission order and never on the event loop.
+    """
+
+    def __init__(self, baudrate=9600, write_timeout=1.0, single_frame=False):
+        self.baudrate = baudrate
+        self.write_timeout = write_timeout
+        # Board is known to accept several commands per write (opt-in: a
+        # CH340 board acting only on the first would silently drop the rest)
+        self.single_frame = single_frame
+        self.port_path = None
+        self.identity = None  # Set by the first successful open
+        self._port = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='relay-io')
+        self._supervisor = None
+        self.stats = {'writes': 0, 'bytes': 0, 'errors': 0, 'disconnects': 0, 'reconnects': 0}
+
+    @property
+    def connected(self):
+        return self._port is not None
+
+    async def open(self, port_path):
+        """Open the serial port (on the I/O thread)"""
+        loop = asyncio.get_running_loop()
+        self._port = await loop.run_in_executor(self._executor, self._open_blocking, port_path)
+        self.port_path = port_path
+        if self.identity is None or self.identity.get('device') != port_path:
+            self.identity = await loop.run_in_executor(self._executor, port_identity, port_path)
+        logger.info(f"USB relay connected on {port_path}")
+
+    def _open_blocking(self, port_path):
+        return serial.Serial(
+            port_path,
+            baudrate=self.baudrate,
+            timeout=1,
+            write_timeout=self.write_timeout
+        )
+
+    def submit(self, data):
+        """
+        Queue bytes for the port
+
+        Returns:
+            asyncio future resolved once written (or failed with the serial error)
+        """
+        if not self.connected:
+            raise Exception("Relay not connected")
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, self._write_blocking, self._port, data)
+
+    def _write_blocking(self, port, data):
+        try:
+            port.write(data)
+            self.stats['writes'] += 1
+            self.stats['bytes'] += len(data)
+        except Exception:
+            self.stats['errors'] += 1
+            # Drop the port so later commands fail fast instead of piling up
+            if self._port is port:
+                self._port = None
+            try:
+                port.close()
+            except Exception:
+                pass
+            raise
+
+    async def write(self, data):
+        """Write bytes and wait for completion"""
+        await self.submit(data)
+
+    async def send(self, channel, on):
+        """Switch one channel"""
+        await self.write(format_command(channel, on))
+
+    async def send_many(self, commands):
+        """
+        Switch several channels
+
+        By default each command is its own write, queued back to back on the
+        I/O thread without a round trip through the event loop in between.
+        With single_frame, boards known to accept several commands per write
+        get them all in one serial frame.
+
+        Args:
+            commands: [(channel, on), ...]
+        """
+        if self.single_frame or len(commands) == 1:
+            await self.write(b''.join(format_command(channel, on) for channel, on in commands))
+            return
+        writes = [self.submit(format_command(channel, on)) for channel, on in commands]
+        await asyncio.gather(*writes)
+
+    def start_supervisor(self, on_reconnect=None, on_disconnect=None,
+                         check_interval=0.5, max_backoff=30.0, pinned_path=None):
+        """
+        Watch the port and reconnect in the background
+
+        Args:
+            on_reconnect: Coroutine function awaited after each reconnect
+                (e.g. to replay channel states)
+            on_disconnect: Callback when the port is lost
+            check_interval: Seconds between liveness checks (a stat() call)
+            max_backoff: Upper bound of the reconnect backoff (seconds)
+            pinned_path: Always try this path first (e.g. RELAY_PORT)
+        """
+        if self._supervisor is None:
+            self._supervisor = asyncio.create_task(self._supervise(
+                on_reconnect, on_disconnect, check_interval, max_backoff, pinned_path
+            ))
+
+    async def _supervise(self, on_reconnect, on_disconnect, check_interval, max_backoff, pinned_path):
+        was_connected = self.connected
+        error_delay = check_interval
+        while True:
+            # Anything escaping an iteration would end hot-plug recovery for
+            # good: log it and keep supervising, backing off while it repeats
+            try:
+                # Cheap liveness check: the device node disappears on unplug
+                if self.connected and not os.path.exists(self.port_path):
+                    await self._drop_port()
+
+                if was_connected and not self.connected:
+                    self.stats['disconnects'] += 1
+                    logger.warning("USB relay disconnected - reconnecting in background")
+                    if on_disconnect:
+                        try:
+                            on_disconnect()
+                        except Exception as e:
+                            logger.error(f"Relay disconnect callback failed: {e}")
+                was_connected = self.connected
+
+                error_delay = check_interval
+                if self.connected:
+                    await asyncio.sleep(check_interval)
+                    continue
+
+                if await self._reconnect(check_interval, max_backoff, pinned_path):
+                    was_connected = True
+                    self.stats['reconnects'] += 1
+                    if on_reconnect:
+                        try:
+                            await on_reconnect()
+                        except Exception as e:
+                            logger.error(f"Relay state replay failed: {e}")
+            except Exception as e:
+                logger.error(f"Relay supervisor error (retrying in {error_delay:.1f}s): {e}", exc_info=True)
+                was_connected = self.connected
+                await asyncio.sleep(error_delay)
+                error_delay = min(error_delay * 2, max_backoff)
+
+    async def _reconnect(self, initial_backoff, max_backoff, pinned_path):
+        """Retry until the port opens; returns True once connected"""
+        backoff = initial_backoff
+        attempt = 0
+        loop = asyncio.get_running_loop()
+        remembered = [path for path in (pinned_path, (self.identity or {}).get('by_id'), self.port_path) if path]
+        while True:
+            attempt += 1
+            candidates = [path for path in remembered if os.path.exists(path)]
+            # Full comport scan only when the remembered paths are gone,
+            # and then only every few attempts
+            if not candidates and attempt % 4 == 1:
+                found = await loop.run_in_executor(self._executor, find_relay_port, self.identity)
+                if found:
+                    candidates.append(found)
+
+            for path in dict.fromkeys(candidates):
+                try:
+                    await self.open(os.path.realpath(path))
+                    logger.info(f"USB relay reconnected after {attempt} attempt(s)")
+                    return True
+                except Exception as e:
+                    logger.debug(f"Relay reconnect via {path} failed: {e}")
+
+            # Back off between open attempts, but keep stat()ing the
+            # remembered paths so a replug is noticed within initial_backoff
+            present = set(candidates)
+            deadline = loop.time() + backoff
+            while loop.time() < deadline:
+                await asyncio.sleep(initial_backoff)
+                if any(os.path.exists(path) and path not in present for path in remembered):
+                    break
+            backoff = min(backoff * 2, max_backoff)
+
+    async def _drop_port(self):
+        port, self._port = self._port, None
+        if port is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self._executor, port.close)
+            except Exception:
+                pass
+
+    async def close(self):
+        """Stop supervising and close the port after queued writes finish"""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            self._supervisor = None
+        port, self._port = self._port, None
+        if port is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, port.close)
@@ -0,0 +1,162 @@
+"""
+Incremental rule engine for the interlock logic
+
+Rules are declared as data: a name, the target they decide ('dehumidifier',
+'noise_cancellation', ...), a condition, the value they propose, a reason
+template and a priority. A rule's input fields are the parameter names of
+its condition, read once when the engine is built and indexed field ->
+rules. An update re-runs only the rules reading a changed field; every
+other rule keeps its cached result, so adding rules costs nothing on
+updates that don't touch their inputs.
+
+For each target the highest-priority matching rule wins. A target with no
+matching rule is held (value None). The engine records which rule decided
+each target and why, plus a short history of decision changes.
+"""
+
+import inspect
+import logging
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class Rule:
+    """
+    One declarative rule
+
+    Args:
+        name: Unique rule name
+        target: What the rule decides
+        when: Condition; its parameter names are the state fields it reads.
+            A rule whose inputs include None (unknown reading) does not match.
+        value: Value proposed for the target when the condition holds
+        reason: Explanation, formatted with the input fields
+        priority: Higher wins when several rules for a target match
+    """
+
+    __slots__ = ('name', 'target', 'when', 'value', 'reason', 'priority', 'inputs')
+
+    def __init__(self, name, target, when, value, reason, priority=0):
+        self.name = name
+        self.target = target
+        self.when = when
+        self.value = value
+        self.reason = reason
+        self.priority = priority
+        self.inputs = tuple(inspect.signature(when).parameters)
+
+    def evaluate(self, state):
+        """Reason string if the rule matches `state`, else None"""
+        values = {field: state.get(field) for field in self.inputs}
+        if any(value is None for value in values.values()):
+            return None
+        if not self.when(**values):
+            return None
+        return self.reason.format(**values)
+
+
+class RuleEngine:
+    """Evaluates rules incrementally as state fields change"""
+
+    def __init__(self, rules, history_size=50):
+        self.rules = sorted(rules, key=lambda rule: -rule.priority)
+        names = [rule.name for rule in self.rules]
+        if len(set(names)) != len(names):
+            raise ValueError("Rule names must be unique")
+
+        # Compiled once: which rules read a field, which rules decide a target
+        self._by_input = {}
+        self._by_target = {}
+        for rule in self.rules:
+            for field in rule.inputs:
+                self._by_input.setdefault(field, []).append(rule)
+            self._by_target.setdefault(rule.target, []).append(rule)
+
+        self._matched = {}  # rule name -> reason while it matches
+        self.decisions = {
+            target: {'value': None, 'rule': None, 'reason': None, 'since': None}
+            for target in self._by_target
+        }
+        self.history = deque(maxlen=history_size)
+        self.stats = {'updates': 0, 'evaluated': 0, 'skipped': 0}
+
+    @property
+    def inputs(self):
+        """Every state field some rule reads"""
+        return self._by_input.keys()
+
+    def update(self, state, changed=None):
+        """
+        Re-evaluate the rules affected by a state change
+
+        Args:
+            state: Current state (mapping of field -> value)
+            changed: Fields that changed; None re-evaluates every rule
+
+        Returns:
+            {target: decision} for targets whose decision changed
+        """
+        if changed is None:
+            affected = self.rules
+        else:
+            affected = {}
+            for field in changed:
+                for rule in self._by_input.get(field, ()):
+                    affected[rule.name] = rule
+            affected = affected.values()
+
+        self.stats['updates'] += 1
+        self.stats['evaluated'] += len(affected)
+        self.stats['skipped'] += len(self.rules) - len(affected)
+
+        targets = set()
+        for rule in affected:
+            try:
+                reason = rule.evaluate(state)
+            except Exception as e:
+                logger.error(f"Rule {rule.name} failed: {e}")
+                reason = None
+            if reason != self._matched.get(rule.name):
+                if reason is None:
+                    self._matched.pop(rule.name, None)
+                else:
+                    self._matched[rule.name] = reason
+                targets.add(rule.target)
+
+        changed_decisions = {}
+        for target in targets:
+            decision = self._decide(target)
+            current = self.decisions[target]
+            if (decision['value'], decision['rule']) != (current['value'], current['rule']):
+                decision['since'] = datetime.now().isoformat()
+                self.decisions[target] = decision
+                self.history.append({'target': target, **decision})
+                changed_decisions[target] = decision
+            elif decision['reason'] != current['reason']:
+                current['reason'] = decision['reason']  # Same rule, fresher numbers
+        return changed_decisions
+
+    def _decide(self, target):
+        for rule in self._by_target[target]:
+            reason = self._matched.get(rule.name)
+            if reason is not None:
+                return {'value': rule.value, 'rule': rule.name, 'reason': reason}
+        return {'value': None, 'rule': None, 'reason': None}
+
+    def decision(self, target):
+        """Current decision for a target: {'value', 'rule', 'reason', 'since'}"""
+        return self.decisions[target]
+
+    def describe(self):
+        """Rules with their inputs and whether they currently match"""
+        return [{
+            'name': rule.name,
+            'target': rule.target,
+            'inputs': list(rule.inputs),
+            'priority': rule.priority,
+            'value': rule.value,
+            'matched': rule.name in self._matched,
+            'reason': self._matched.get(rule.name),
+        } for rule in self.rules]
@@ -0,0 +1,176 @@
+"""
+Adaptive control-loop interval
+
+Instead of a fixed sleep, the loop asks the sampler how long to wait after
+each cycle. The sampler looks at the watched metrics:
+
+- close to a threshold (within its margin): sample at the minimum interval
+- moving toward a threshold: sample a few times before it is expected to
+  be crossed (time to threshold / 4), if that is sooner than otherwise
+- flat (every metric changing slower than its flat rate): back off by
+  `backoff` each cycle, up to the maximum interval
+- otherwise: the base interval
+
+Pushed events (thermostat events, bridge state changes) call wake(), which
+ends the current wait early. Scheduled actions call limit() so the next wait
+ends when they are due. The current interval, the reason for it and
+the reasons for the last wake are kept for status export.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+
+class Watch:
+    """
+    A metric the sampler adapts to
+
+    Args:
+        name: Key in the values passed to observe()
+        thresholds: Values the control logic switches at
+        margin: Distance to a threshold that counts as "close"
+        flat_rate: Change per minute below which the metric counts as flat
+    """
+
+    __slots__ = ('name', 'thresholds', 'margin', 'flat_rate')
+
+    def __init__(self, name, thresholds, margin, flat_rate):
+        self.name = name
+        self.thresholds = tuple(thresholds)
+        self.margin = margin
+        self.flat_rate = flat_rate
+
+
+class AdaptiveSampler:
+    """
+    Args:
+        watches: Watch per metric
+        base_interval: Interval when nothing calls for faster or slower sampling (s)
+        min_interval / max_interval: Bounds of the interval (s)
+        backoff: Interval growth factor per flat cycle
+        settle: After a wake, wait this long for related events before returning (s)
+    """
+
+    def __init__(self, watches, base_interval=60.0, min_interval=10.0, max_interval=300.0,
+                 backoff=1.5, settle=0.0):
+        self.watches = list(watches)
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.settle = settle
+
+        self.interval = base_interval
+        self.reason = 'startup'
+        self.last_wake = None  # {'time', 'reasons'}
+        self._limit = None  # (seconds, reason) capping the next wait only
+        self.stats = {'cycles': 0, 'wakes': 0, 'timeouts': 0}
+        self._last = {}  # metric -> (value, monotonic time)
+        self._wake = asyncio.Event()
+        self._wake_reasons = []
+
+    def observe(self, values, now=None):
+        """
+        Update the interval from a new set of readings
+
+        Args:
+            values: Mapping of metric -> reading (None = unavailable)
+
+        Returns:
+            The new interval (seconds)
+        """
+        now = time.monotonic() if now is None else now
+        candidates = []  # (interval, reason)
+        rates_seen = False
+        flat = True
+
+        for watch in self.watches:
+            value = values.get(watch.name)
+            if value is None:
+                continue
+            previous = self._last.get(watch.name)
+            self._last[watch.name] = (value, now)
+
+            nearest = min(watch.thresholds, key=lambda threshold: abs(value - threshold))
+            if abs(value - nearest) <= watch.margin:
+                candidates.append((self.min_interval, f"{watch.name} {value} near threshold {nearest}"))
+
+            if previous is None or now <= previous[1]:
+                continue
+            rate = (value - previous[0]) / (now - previous[1])  # per second
+            rates_seen = True
+            if abs(rate) * 60 >= watch.flat_rate:
+                flat = False
+            ahead = [threshold for threshold in watch.thresholds if (threshold - value) * rate > 0]
+            if ahead:
+                target = min(ahead, key=lambda threshold: abs(threshold - value))
+                eta = abs(target - value) / abs(rate)
+                direction = 'rising' if rate > 0 else 'falling'
+                candidates.append((eta / 4, f"{watch.name} {direction} {abs(rate) * 60:.2g}/min, "
+                                            f"~{eta:.0f}s from {target}"))
+
+        if rates_seen and flat:
+            candidates.append((max(self.interval, self.base_interval) * self.backoff, 'readings flat'))
+        else:
+            candidates.append((self.base_interval, 'steady'))
+        interval, reason = min(candidates)
+
+        self.interval = round(min(max(interval, self.min_interval), self.max_interval), 1)
+        self.reason = reason
+        self.stats['cycles'] += 1
+        return self.interval
+
+    def limit(self, seconds, reason):
+        """
+        Cap the next wait at `seconds` (not below the minimum interval),
+        e.g. for an action that falls due; the backoff state is unaffected
+        """
+        seconds = round(max(seconds, self.min_interval), 1)
+        if seconds < self.interval and (self._limit is None or seconds < self._limit[0]):
+            self._limit = (seconds, reason)
+
+    @property
+    def next_wait(self):
+        """(interval, reason) the next wait() will use"""
+        return self._limit or (self.interval, self.reason)
+
+    def wake(self, reason):
+        """End the current wait early (callable from event callbacks)"""
+        if reason not in self._wake_reasons:
+            self._wake_reasons.append(reason)
+        self._wake.set()
+
+    async def wait(self):
+        """
+        Sleep for the current interval or until wake()
+
+        Returns:
+            Why the wait ended (list of reasons)
+        """
+        interval, reason = self.next_wait
+        self._limit = None
+        try:
+            await asyncio.wait_for(self._wake.wait(), interval)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            reasons = [f"timer ({interval}s: {reason})"]
+        else:
+            self.stats['wakes'] += 1
+            if self.settle:
+                await asyncio.sleep(self.settle)
+            reasons = list(self._wake_reasons)
+        self._wake.clear()
+        self._wake_reasons = []
+        self.last_wake = {'time': datetime.now().isoformat(), 'reasons': reasons}
+        return reasons
+
+    def status(self):
+        return {
+            'interval': self.interval,
+            'reason': self.reason,
+            'limit': self._limit and {'interval': self._limit[0], 'reason': self._limit[1]},
+            'last_wake': self.last_wake,
+            'pending_wake': list(self._wake_reasons),
+            **self.stats,
+        }
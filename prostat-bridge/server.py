@@ -18,14 +18,28 @@ Usage:
 import asyncio
 import json
 import logging
+import os
+import time
 from aiohomekit.controller import Controller
 from aiohomekit.exceptions import AccessoryNotFoundError, AlreadyPairedError
 from aiohttp import web, web_runner
 import aiohttp_cors
-import serial
-import serial.tools.list_ports
+from array import array
 from datetime import datetime
 from blueair_api import get_blueair_account
+from hap_map import load_characteristic_map, forget_characteristic_map
+from mdns import HapBrowser
+from json_store import load_json, save_json, state_path
+from broadcast import StateBroadcaster
+from relay_transport import RelayTransport, find_relay_port
+from relay_scheduler import RelayScheduler
+from relay_bank import RelayBank, parse_channel_map
+from rules import Rule, RuleEngine
+from history import RESOLUTIONS, SensorHistory, downsample
+from startup import Startup
+from jobs import JobScheduler
+from state import CATEGORIES, InterlockState, SYSTEM_STATE_FIELDS, TrackedState, recorded_fields
+from tsdb import TimeSeriesStore
 
 # Configure logging
 logging.basicConfig(
@@ -36,87 +50,469 @@ logger = logging.getLogger(__name__)
 
 # Global controller instance
 controller = None
+controller_task = None  # Controller start in progress, shared by concurrent callers
 pairings = {}  # device_id -> pairing object
-device_info = {}  # device_id -> device info cache
+device_info = {}  # device_id -> device info, maintained by background discovery
 
 # Relay control
-relay_port = None
-relay_connected = False
-relay_channel = 2  # Default: Relay 2 for dehumidifier (Y2 terminal)
+# Set RELAY_SINGLE_FRAME=1 for boards verified to act on every command of a
+# multi-command write; by default each command is written separately
+relay = RelayTransport(single_frame=os.getenv('RELAY_SINGLE_FRAME', '0') == '1')  # Serial I/O runs on its own thread
+
+# Equipment wired to the relay board: name -> channel (1-based)
+RELAY_CHANNELS = parse_channel_map(os.getenv('RELAY_CHANNELS', 'dehumidifier=2'))
+
+# Minimum dwell times protecting the dehumidifier compressor (seconds).
+# Transitions requested sooner are deferred until the dwell has passed.
+RELAY_MIN_ON = float(os.getenv('RELAY_MIN_ON', '300'))
+RELAY_MIN_OFF = float(os.getenv('RELAY_MIN_OFF', '180'))
+# Without a dehumidifier entry it gets Relay 2 (Y2 terminal) - unless another
+# name already has that channel, which would silently put the compressor
+# dwell times on that equipment
+if 'dehumidifier' not in RELAY_CHANNELS:
+    taken = [name for name, channel in RELAY_CHANNELS.items() if channel == 2]
+    if taken:
+        raise ValueError(f"RELAY_CHANNELS assigns relay 2, the default dehumidifier channel, to {taken[0]}; "
+                         f"add an explicit dehumidifier=<channel> entry")
+    RELAY_CHANNELS = {'dehumidifier': 2, **RELAY_CHANNELS}
+relay_channel = RELAY_CHANNELS['dehumidifier']
 
 # Blueair control
 blueair_account = None
 blueair_devices = []
 blueair_connected = False
 
-# System state for interlock logic
-system_state = {
-    'indoor_temp': None,
-    'indoor_humidity': None,
-    'outdoor_temp': None,
-    'hvac_mode': 'off',  # 'off', 'heat', 'cool'
-    'hvac_running': False,
-    'hvac_fan_running': False,  # Fan-only mode
-    'dehumidifier_on': False,
-    'occupancy': False,  # From Ecobee motion sensor
-    'blueair_fan_speed': 0,  # 0-3 (0=off, 1=low, 2=med, 3=max)
-    'blueair_led_brightness': 100,  # 0-100
-    'last_update': None,
-}
+# System state for interlock logic (schema shared with asthma_shield.py, see
+# state.py). Named relay channels besides the dehumidifier get '<name>_on'.
+SystemState = TrackedState.define('SystemState', SYSTEM_STATE_FIELDS + tuple(
+    (f'{name}_on', bool, False) for name in RELAY_CHANNELS if name != 'dehumidifier'))
+system_state = SystemState()
 
 # Interlock state tracking
-interlock_state = {
-    'dust_kicker_active': False,
-    'dust_kicker_start_time': None,
-    'noise_cancellation_active': False,
+interlock_state = InterlockState()
+
+# Thermostat characteristics read for /api/status. Their (aid, iid) are
+# resolved per device by HomeKit type UUID (see hap_map.py).
+THERMOSTAT_CHARACTERISTICS = (
+    'temperature',
+    'target_temperature',
+    'target_mode',  # 0=Off, 1=Heat, 2=Cool, 3=Auto
+    'current_mode',  # 0=Off, 1=Heating, 2=Cooling
+    'humidity',
+)
+
+# Resolved characteristic maps: device_id -> {name: (aid, iid)}
+characteristic_maps = {}
+
+# Read cache TTL per characteristic (seconds). Setpoints and modes change
+# rarely and are refreshed in the cache by our own writes.
+CHARACTERISTIC_TTL = {
+    'temperature': 10.0,
+    'target_temperature': 30.0,
+    'target_mode': 30.0,
+    'current_mode': 5.0,
+    'humidity': 30.0,
 }
 
-# Characteristic IDs for Ecobee (these may need adjustment based on actual device)
-# Common HomeKit characteristics:
-# Current Temperature: (aid, iid) where aid=1, iid=10 typically
-# Target Temperature: aid=1, iid=11
-# Target Heating Cooling State: aid=1, iid=12
-# Current Heating Cooling State: aid=1, iid=13
+# Subscribe to HomeKit characteristic events after pairing. Subscribed devices
+# are kept current by pushed events instead of TTL-based polling.
+HAP_EVENTS_ENABLED = os.getenv('HAP_EVENTS', '1') != '0'
+
+# Even with events, re-read a value this old in case the subscription was
+# silently lost (seconds). Unchanged values produce no events.
+EVENT_MIRROR_MAX_AGE = 600.0
+
+# Change stream for /api/stream subscribers
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', '64'))
+STREAM_HEARTBEAT = 15.0  # seconds - keep-alive comment when nothing changes
+broadcaster = StateBroadcaster(STREAM_MAX_SUBSCRIBERS)
+
+# Longest a ?since=<version> long-poll is held open (seconds)
+LONG_POLL_TIMEOUT = float(os.getenv('LONG_POLL_TIMEOUT', '30'))
+
+# State updates arriving within this window are folded into one interlock
+# evaluation pass by the background worker (seconds)
+INTERLOCK_DEBOUNCE = float(os.getenv('INTERLOCK_DEBOUNCE', '0.2'))
+
+# Topics whose versions make up the /api/relay/status ETag
+RELAY_STATUS_TOPICS = ('system_state', 'interlock_state', 'relay')
+
+# Sensor history for /api/history: system_state fields sampled every
+# HISTORY_INTERVAL seconds into fixed-size in-memory buffers (see history.py)
+HISTORY_METRICS = ('indoor_temp', 'indoor_humidity', 'outdoor_temp', 'pm25', 'tvoc',
+                   'dehumidifier_on', 'hvac_running', 'hvac_fan_running', 'blueair_fan_speed')
+HISTORY_INTERVAL = float(os.getenv('HISTORY_INTERVAL', '10'))
+HISTORY_RAW_SIZE = int(os.getenv('HISTORY_RAW_SIZE', '8640'))  # 24 h at 10 s
+sensor_history = SensorHistory(HISTORY_METRICS, HISTORY_RAW_SIZE)
+
+# Every sample is also appended to an on-disk store (see tsdb.py) that keeps
+# all numeric system_state fields across restarts. Rows are written and
+# fsynced in batches every HISTORY_FLUSH_INTERVAL seconds.
+HISTORY_STORE_DIR = os.getenv('HISTORY_STORE_DIR', state_path('history'))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '300'))
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', '400'))
+HISTORY_MAX_RAW_POINTS = 100000  # Largest raw range /api/history returns from disk
+HISTORY_MAX_BUCKETS = 20000  # Largest rollup range /api/history returns from disk
+history_store = TimeSeriesStore(HISTORY_STORE_DIR, recorded_fields(SystemState.FIELDS), CATEGORIES,
+                                HISTORY_FLUSH_INTERVAL, HISTORY_RETENTION_DAYS)
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+background_tasks = set()
+
+# Timed sequences (Dust Kicker, ...), listed by /api/tasks
+jobs = JobScheduler()
+DUST_KICKER_STIR_TIME = 30  # seconds - HVAC fan alone before the Blueair boost
+DUST_KICKER_RUN_TIME = 600  # seconds - Blueair at max
+
+# Per-device deadline for the all-devices GET /api/status fan-out (seconds).
+# A slow or offline thermostat is reported stale instead of delaying the others.
+STATUS_DEVICE_TIMEOUT = float(os.getenv('STATUS_DEVICE_TIMEOUT', '3.0'))
+
+# Background mDNS discovery: rescan interval, bound for ?refresh=1 scans, and
+# how long an unpaired device may go unseen before it is dropped (seconds)
+DISCOVERY_INTERVAL = float(os.getenv('DISCOVERY_INTERVAL', '300'))
+DISCOVERY_REFRESH_TIMEOUT = float(os.getenv('DISCOVERY_REFRESH_TIMEOUT', '10'))
+DISCOVERY_EXPIRY = 3 * DISCOVERY_INTERVAL
+
+discovery_task = None  # Scan in progress, shared by concurrent refreshes
+last_discovery_scan = None  # Unix time of the last completed scan
+
+# Thermostat writes within this window are coalesced into one put (seconds)
+WRITE_COALESCE_WINDOW = float(os.getenv('WRITE_COALESCE_WINDOW', '0.25'))
+
+write_pipelines = {}  # device_id -> WritePipeline
+
+# Pairings survive restarts: device_id -> {'pairing_data': ..., 'info': ...}
+PAIRING_STORE = state_path('pairings.json')
+
+# Startup deadline for reconnecting stored pairings (seconds). Devices still
+# connecting afterwards keep trying in the background.
+PAIRING_RESTORE_TIMEOUT = float(os.getenv('PAIRING_RESTORE_TIMEOUT', '15'))
+
+# Reconnect status per stored device: 'connecting', 'connected' or 'failed'
+pairing_status = {}
+pairings_restored = False  # Readiness flag for /health
+
+# Subsystems start concurrently after the HTTP listener is up (see startup.py).
+# Each attempt gets its own deadline (seconds); HomeKit and Blueair retry in
+# the background with backoff, the relay is left to its hot-plug supervisor.
+INIT_DEADLINES = {
+    'homekit': float(os.getenv('HOMEKIT_INIT_DEADLINE', '10')),
+    'relay': float(os.getenv('RELAY_INIT_DEADLINE', '5')),
+    'blueair': float(os.getenv('BLUEAIR_INIT_DEADLINE', '20')),
+}
+INIT_RETRY_INTERVAL = float(os.getenv('INIT_RETRY_INTERVAL', '30'))
+startup = Startup(INIT_RETRY_INTERVAL)
+
+# Last successful reading per device: device_id -> (result dict, monotonic time)
+last_thermostat_data = {}
+stale_devices = {}  # device_id -> True while its last status read failed
+
+
+def run_in_background(coro):
+    """Start a fire-and-forget task, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro, name=getattr(coro, '__qualname__', None))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def update_system_state(changes):
+    """Apply changes to system_state and publish the fields that actually changed"""
+    diff = system_state.update(changes)
+    broadcaster.publish('system_state', diff)
+    return diff
+
+
+def update_interlock_state(changes):
+    """Apply changes to interlock_state and publish the fields that actually changed"""
+    diff = interlock_state.update(changes)
+    broadcaster.publish('interlock_state', diff)
+    return diff
+
+
+class CharacteristicCache:
+    """
+    TTL cache in front of pairing.async_get_characteristics
+    
+    Values are cached per (device_id, characteristic name). Concurrent reads
+    of the same device share one in-flight HAP request instead of each
+    issuing their own (single-flight).
+    
+    For devices with an event subscription ("live" devices) the cache is a
+    mirror kept current by pushed events, so entries stay valid for up to
+    EVENT_MIRROR_MAX_AGE instead of their TTL.
+    """
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.live_devices = set()
+        self._values = {}  # (device_id, name) -> (value, monotonic time)
+        self._inflight = {}  # device_id -> (frozenset of names, asyncio.Task)
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'hap_reads': 0, 'events': 0}
+    
+    def set(self, device_id, name, value):
+        """Store a value, e.g. after a successful write"""
+        previous = self._values.get((device_id, name))
+        self._values[(device_id, name)] = (value, time.monotonic())
+        if previous is None or previous[0] != value:
+            broadcaster.publish(f"thermostat/{device_id}", {name: value})
+    
+    def is_fresh(self, device_id, characteristics):
+        """True if every characteristic can be served without a HAP read"""
+        now = time.monotonic()
+        live = device_id in self.live_devices
+        for name in characteristics:
+            entry = self._values.get((device_id, name))
+            max_age = EVENT_MIRROR_MAX_AGE if live else self.ttl.get(name, 0)
+            if entry is None or now - entry[1] >= max_age:
+                return False
+        return True
+    
+    def invalidate(self, device_id):
+        """Drop all cached values for a device"""
+        self.live_devices.discard(device_id)
+        for key in [k for k in self._values if k[0] == device_id]:
+            del self._values[key]
+    
+    async def read(self, device_id, pairing, characteristics):
+        """
+        Read characteristics by name, from cache where fresh
+        
+        Args:
+            characteristics: name -> (aid, iid) of the characteristics to read
+        
+        Returns:
+            dict name -> value (names missing from the HAP response are omitted)
+        """
+        now = time.monotonic()
+        live = device_id in self.live_devices
+        values = {}
+        missing = []
+        for name in characteristics:
+            entry = self._values.get((device_id, name))
+            max_age = EVENT_MIRROR_MAX_AGE if live else self.ttl.get(name, 0)
+            if entry is not None and now - entry[1] < max_age:
+                values[name] = entry[0]
+            else:
+                missing.append(name)
+        
+        if not missing:
+            self.stats['hits'] += 1
+            return values
+        
+        inflight = self._inflight.get(device_id)
+        if inflight is not None and inflight[0].issuperset(missing):
+            # Someone is already reading what we need - wait for their result
+            self.stats['coalesced'] += 1
+            task = inflight[1]
+        else:
+            self.stats['misses'] += 1
+            task = asyncio.create_task(self._fetch(
+                device_id, pairing, {name: characteristics[name] for name in missing}
+            ))
+            self._inflight[device_id] = (frozenset(missing), task)
+            task.add_done_callback(lambda t: self._clear_inflight(device_id, t))
+        
+        # Shield so a caller hitting its deadline doesn't cancel the shared read
+        fetched = await asyncio.shield(task)
+        values.update((name, fetched[name]) for name in missing if name in fetched)
+        return values
+    
+    def _clear_inflight(self, device_id, task):
+        inflight = self._inflight.get(device_id)
+        if inflight is not None and inflight[1] is task:
+            del self._inflight[device_id]
+    
+    async def _fetch(self, device_id, pairing, characteristics):
+        """Issue one HAP read for `characteristics` and store the results"""
+        self.stats['hap_reads'] += 1
+        keys = {key: name for name, key in characteristics.items()}
+        
+        # Format: [(aid, iid), ...] -> {(aid, iid): {'value': value, ...}, ...}
+        data = await pairing.async_get_characteristics(list(keys))
+        
+        fetched = {}
+        for key, name in keys.items():
+            if key in data:
+                fetched[name] = data[key].get('value')
+                self.set(device_id, name, fetched[name])
+        return fetched
+    
+    def get_stats(self):
+        """Counters plus hit ratio, for /api/cache/stats"""
+        requests = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+        served = self.stats['hits'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'requests': requests,
+            'hit_ratio': round(served / requests, 3) if requests else None,
+            'entries': len(self._values),
+        }
+
 
-ECOBEE_AID = 1  # Accessory ID (usually 1 for main accessory)
-ECOBEE_TEMP_CURRENT = 10  # Current Temperature
-ECOBEE_TEMP_TARGET = 11    # Target Temperature
-ECOBEE_TARGET_STATE = 12   # Target Heating Cooling State (0=Off, 1=Heat, 2=Cool, 3=Auto)
-ECOBEE_CURRENT_STATE = 13  # Current Heating Cooling State
+characteristic_cache = CharacteristicCache(CHARACTERISTIC_TTL)
 
 
 async def init_controller():
-    """Initialize the HomeKit controller"""
+    """
+    Initialize the HomeKit controller
+    
+    Safe to call concurrently (startup, first /api/discover): callers share
+    one start, which keeps going if a caller's deadline cancels its wait.
+    """
+    global controller_task
+    
+    if controller is not None:
+        return controller
+    if controller_task is None or (
+            controller_task.done() and (controller_task.cancelled() or controller_task.exception())):
+        controller_task = asyncio.create_task(start_controller())
+    return await asyncio.shield(controller_task)
+
+
+async def start_controller():
     global controller
-    controller = Controller()
-    await controller.async_start()
+    instance = Controller()
+    await instance.async_start()
+    controller = instance
     logger.info("HomeKit controller initialized")
     return controller
 
 
+async def init_homekit():
+    """Start the controller, then reconnect pairings and run discovery in the background"""
+    await init_controller()
+    
+    # Reconnect stored pairings in the background; /health reports readiness
+    run_in_background(restore_pairings())
+    
+    # Keep the discovery table current so /api/discover answers instantly:
+    # mDNS announcements update it as they arrive, periodic scans catch up
+    # and expire devices that went quiet
+    try:
+        await hap_browser.start()
+    except Exception as e:
+        logger.warning(f"mDNS browser unavailable, relying on periodic scans: {e}")
+    run_in_background(discovery_loop())
+    return True
+
+
+def record_discovered_device(device):
+    """Add or refresh a device found by a scan in the device_info index"""
+    return record_device_description(device.device_id, device.description)
+
+
+def record_device_description(device_id, description):
+    """Add or refresh a device in the device_info index from its discovery description"""
+    info = {
+        'device_id': device_id,
+        'name': description.get('name', 'Unknown'),
+        'model': description.get('md', 'Unknown'),
+        'category': description.get('ci', 'Unknown'),
+        'config_num': description.get('c#'),
+        'last_seen': time.time(),
+    }
+    
+    previous = device_info.get(device_id)
+    if previous is None:
+        logger.info(f"Found device: {info['name']} ({device_id})")
+    elif previous.get('config_num') != info['config_num']:
+        # Accessory database changed - re-resolve characteristics on next use
+        characteristic_maps.pop(device_id, None)
+    
+    device_info[device_id] = info
+    return info
+
+
+def forget_announced_device(device_id):
+    """An accessory withdrew its mDNS announcement: drop it unless paired"""
+    if device_id not in pairings and device_info.pop(device_id, None) is not None:
+        logger.info(f"Device left the network: {device_id}")
+
+
+hap_browser = HapBrowser(record_device_description, forget_announced_device)
+
+
 async def discover_devices():
-    """Discover HomeKit devices on the local network"""
+    """Scan for HomeKit devices, updating device_info as each one is found"""
+    global last_discovery_scan
+    
     if not controller:
         await init_controller()
     
     logger.info("Scanning for HomeKit devices...")
-    devices = await controller.async_discover()
+    found = controller.async_discover()
     
     result = []
-    for device in devices:
-        info = {
-            'device_id': device.device_id,
-            'name': device.description.get('name', 'Unknown'),
-            'model': device.description.get('md', 'Unknown'),
-            'category': device.description.get('ci', 'Unknown'),
-        }
-        device_info[device.device_id] = info
-        result.append(info)
-        logger.info(f"Found device: {info['name']} ({device.device_id})")
+    if hasattr(found, '__aiter__'):
+        # Newer aiohomekit yields devices as their announcements arrive
+        async for device in found:
+            result.append(record_discovered_device(device))
+    else:
+        for device in await found:
+            result.append(record_discovered_device(device))
+    
+    # Forget unpaired devices that stopped announcing themselves
+    cutoff = time.time() - DISCOVERY_EXPIRY
+    for device_id in [d for d, info in device_info.items()
+                      if d not in pairings and info.get('last_seen', 0) < cutoff]:
+        del device_info[device_id]
     
+    last_discovery_scan = time.time()
     return result
 
 
+async def refresh_discovery():
+    """
+    Run a bounded rescan, sharing one scan between concurrent callers
+    
+    Returns when the scan finishes or DISCOVERY_REFRESH_TIMEOUT passes;
+    a scan that overruns keeps updating device_info in the background.
+    """
+    global discovery_task
+    
+    if discovery_task is None or discovery_task.done():
+        discovery_task = asyncio.create_task(discover_devices())
+    
+    try:
+        await asyncio.wait_for(asyncio.shield(discovery_task), DISCOVERY_REFRESH_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Discovery scan still running after {DISCOVERY_REFRESH_TIMEOUT}s")
+
+
+async def discovery_loop():
+    """Periodic background scans: fallback for missed announcements and expiry"""
+    while True:
+        try:
+            await refresh_discovery()
+        except Exception as e:
+            logger.error(f"Background discovery error: {e}")
+        await asyncio.sleep(DISCOVERY_INTERVAL)
+
+
+async def history_loop():
+    """Sample system_state into the in-memory history and the on-disk store at a fixed interval"""
+    loop = asyncio.get_running_loop()
+    while True:
+        now = time.time()
+        sensor_history.sample(system_state, now)
+        history_store.append(now, system_state)
+        if history_store.flush_due():
+            await loop.run_in_executor(None, history_store.flush)
+        await asyncio.sleep(HISTORY_INTERVAL)
+
+
+def list_discovered_devices():
+    """Current discovery table, most recently seen first"""
+    devices = [
+        {**info, 'paired': device_id in pairings}
+        for device_id, info in device_info.items()
+    ]
+    devices.sort(key=lambda info: info.get('last_seen') or 0, reverse=True)
+    return devices
+
+
 async def pair_device(device_id: str, pairing_code: str):
     """
     Pair with a HomeKit device
@@ -139,22 +535,195 @@ async def pair_device(device_id: str, pairing_code: str):
         pairing = await controller.async_pair(device_id, code)
         pairings[device_id] = pairing
         logger.info(f"Successfully paired with {device_id}")
+        save_pairing(device_id)
+        await subscribe_device(device_id)
         return pairing
     except AlreadyPairedError:
         logger.warning(f"Device {device_id} is already paired")
         # Try to load existing pairing
         pairing = await controller.async_load_pairing(device_id)
         pairings[device_id] = pairing
+        save_pairing(device_id)
+        await subscribe_device(device_id)
         return pairing
     except Exception as e:
         logger.error(f"Pairing failed: {e}")
         raise
 
 
+def save_pairing(device_id: str):
+    """Persist a pairing's keys so it survives a restart"""
+    pairing_data = getattr(pairings[device_id], 'pairing_data', None)
+    if not pairing_data:
+        logger.warning(f"Pairing for {device_id} has no pairing data to persist")
+        return
+    
+    store = load_json(PAIRING_STORE, {})
+    store[device_id] = {
+        'pairing_data': pairing_data,
+        'info': device_info.get(device_id, {'device_id': device_id}),
+    }
+    try:
+        save_json(PAIRING_STORE, store)
+        pairing_status[device_id] = 'connected'
+    except OSError as e:
+        logger.error(f"Failed to persist pairing for {device_id}: {e}")
+
+
+def forget_pairing(device_id: str):
+    """Remove a pairing from the persistent store"""
+    pairing_status.pop(device_id, None)
+    store = load_json(PAIRING_STORE, {})
+    if store.pop(device_id, None) is not None:
+        save_json(PAIRING_STORE, store)
+
+
+async def reconnect_pairing(device_id: str):
+    """Warm up a restored pairing: characteristic map, subscription, first read"""
+    pairing_status[device_id] = 'connecting'
+    try:
+        await get_characteristic_map(device_id)
+        await subscribe_device(device_id)
+        await get_thermostat_data(device_id)
+        pairing_status[device_id] = 'connected'
+        logger.info(f"Reconnected to {device_id}")
+    except Exception as e:
+        pairing_status[device_id] = 'failed'
+        logger.error(f"Failed to reconnect to {device_id}: {e}")
+
+
+async def restore_pairings():
+    """
+    Reload stored pairings and reconnect them concurrently
+    
+    Waits at most PAIRING_RESTORE_TIMEOUT; slower devices keep reconnecting
+    in the background. Sets the /health readiness flag when done.
+    """
+    global pairings_restored
+    
+    store = load_json(PAIRING_STORE, {})
+    tasks = []
+    for device_id, entry in store.items():
+        try:
+            pairings[device_id] = controller.load_pairing(device_id, entry['pairing_data'])
+            device_info.setdefault(device_id, entry.get('info', {'device_id': device_id}))
+        except Exception as e:
+            pairing_status[device_id] = 'failed'
+            logger.error(f"Failed to load stored pairing for {device_id}: {e}")
+            continue
+        tasks.append(run_in_background(reconnect_pairing(device_id)))
+    
+    if tasks:
+        logger.info(f"Reconnecting {len(tasks)} stored pairing(s)...")
+        done, pending = await asyncio.wait(tasks, timeout=PAIRING_RESTORE_TIMEOUT)
+        if pending:
+            logger.warning(f"{len(pending)} pairing(s) still connecting after {PAIRING_RESTORE_TIMEOUT}s")
+    
+    pairings_restored = True
+    startup.mark('pairings')
+
+
+async def get_characteristic_map(device_id: str):
+    """
+    Get {name: (aid, iid)} for a paired device
+    
+    Resolved by type UUID from the accessory database on first use and
+    cached on disk until the accessory's config number changes.
+    """
+    if device_id not in characteristic_maps:
+        config_num = device_info.get(device_id, {}).get('config_num')
+        characteristic_maps[device_id] = await load_characteristic_map(
+            device_id, pairings[device_id], config_num
+        )
+    return characteristic_maps[device_id]
+
+
+def thermostat_characteristics(device_id: str):
+    """The resolved subset of THERMOSTAT_CHARACTERISTICS for a device"""
+    char_map = characteristic_maps.get(device_id, {})
+    return {name: char_map[name] for name in THERMOSTAT_CHARACTERISTICS if name in char_map}
+
+
+async def get_characteristic_key(device_id: str, name: str):
+    """(aid, iid) of a characteristic, or ValueError if the device lacks it"""
+    char_map = await get_characteristic_map(device_id)
+    if name not in char_map:
+        raise ValueError(f"Device {device_id} does not expose {name}")
+    return char_map[name]
+
+
+def handle_characteristic_events(device_id, events):
+    """
+    Apply pushed HomeKit characteristic events to the live mirror
+    
+    Args:
+        events: {(aid, iid): {'value': value, ...}, ...} as delivered by aiohomekit
+    """
+    if device_id not in pairings:
+        return
+    
+    names = {key: name for name, key in thermostat_characteristics(device_id).items()}
+    changes = {}
+    for key, event in events.items():
+        name = names.get(key)
+        if name is None or 'value' not in event:
+            continue
+        characteristic_cache.set(device_id, name, event['value'])
+        changes[name] = event['value']
+    
+    if not changes:
+        return
+    
+    characteristic_cache.stats['events'] += 1
+    logger.debug(f"Events from {device_id}: {changes}")
+    
+    # Mirror the readings the interlock logic uses and react immediately
+    state_changes = {'last_update': datetime.now().isoformat()}
+    if 'temperature' in changes:
+        state_changes['indoor_temp'] = changes['temperature']
+    if 'humidity' in changes:
+        state_changes['indoor_humidity'] = changes['humidity']
+    if 'target_mode' in changes:
+        state_changes['hvac_mode'] = {0: 'off', 1: 'heat', 2: 'cool', 3: 'auto'}.get(changes['target_mode'], 'off')
+    if 'current_mode' in changes:
+        state_changes['hvac_running'] = changes['current_mode'] in (1, 2)
+    diff = update_system_state(state_changes)
+    
+    if diff.keys() & interlock_rules.inputs:
+        interlock_worker.request()
+
+
+async def subscribe_device(device_id: str):
+    """Subscribe to characteristic events so the cache becomes a live mirror"""
+    if not HAP_EVENTS_ENABLED or device_id not in pairings:
+        return False
+    
+    pairing = pairings[device_id]
+    
+    try:
+        await get_characteristic_map(device_id)
+        pairing.dispatcher_connect(
+            lambda events: handle_characteristic_events(device_id, events)
+        )
+        await pairing.subscribe(list(thermostat_characteristics(device_id).values()))
+        characteristic_cache.live_devices.add(device_id)
+        logger.info(f"Subscribed to characteristic events on {device_id}")
+        return True
+    except Exception as e:
+        # Not fatal - reads fall back to TTL-based polling
+        logger.warning(f"Event subscription failed for {device_id}, polling instead: {e}")
+        return False
+
+
 async def unpair_device(device_id: str):
     """Unpair from a HomeKit device"""
     if device_id in pairings:
         del pairings[device_id]
+    characteristic_cache.invalidate(device_id)
+    characteristic_maps.pop(device_id, None)
+    write_pipelines.pop(device_id, None)
+    forget_characteristic_map(device_id)
+    forget_pairing(device_id)
     
     if controller:
         try:
@@ -177,83 +746,174 @@ async def get_thermostat_data(device_id: str):
     
     pairing = pairings[device_id]
     
-    # Read characteristics
-    # Format: [(aid, iid), ...]
-    characteristics = [
-        (ECOBEE_AID, ECOBEE_TEMP_CURRENT),
-        (ECOBEE_AID, ECOBEE_TEMP_TARGET),
-        (ECOBEE_AID, ECOBEE_TARGET_STATE),
-        (ECOBEE_AID, ECOBEE_CURRENT_STATE),
-    ]
-    
     try:
-        data = await pairing.async_get_characteristics(characteristics)
+        # Served from the read cache when fresh; concurrent callers share one HAP read
+        await get_characteristic_map(device_id)
+        values = await characteristic_cache.read(
+            device_id, pairing, thermostat_characteristics(device_id)
+        )
         
-        # Parse response
-        # Data format: {(aid, iid): {'value': value, ...}, ...}
         result = {
             'device_id': device_id,
-            'temperature': None,
-            'target_temperature': None,
+            'temperature': values.get('temperature'),
+            'target_temperature': values.get('target_temperature'),
             'target_mode': None,  # 0=Off, 1=Heat, 2=Cool, 3=Auto
-            'current_mode': None,
+            'current_mode': values.get('current_mode'),
+            'humidity': values.get('humidity'),
             'mode': 'off',  # Human-readable
+            'live': device_id in characteristic_cache.live_devices,
         }
         
-        # Extract values
-        temp_key = (ECOBEE_AID, ECOBEE_TEMP_CURRENT)
-        target_temp_key = (ECOBEE_AID, ECOBEE_TEMP_TARGET)
-        target_state_key = (ECOBEE_AID, ECOBEE_TARGET_STATE)
-        current_state_key = (ECOBEE_AID, ECOBEE_CURRENT_STATE)
-        
-        if temp_key in data:
-            result['temperature'] = data[temp_key].get('value')
-        
-        if target_temp_key in data:
-            result['target_temperature'] = data[target_temp_key].get('value')
-        
-        if target_state_key in data:
-            state = data[target_state_key].get('value')
+        if 'target_mode' in values:
+            state = values['target_mode']
             result['target_mode'] = state
             result['mode'] = {0: 'off', 1: 'heat', 2: 'cool', 3: 'auto'}.get(state, 'unknown')
         
-        if current_state_key in data:
-            result['current_mode'] = data[current_state_key].get('value')
-        
+        last_thermostat_data[device_id] = (result, time.monotonic())
         return result
     except Exception as e:
         logger.error(f"Error reading thermostat data: {e}")
         raise
 
 
-async def set_temperature(device_id: str, temperature: float):
-    """Set target temperature"""
+class WritePipeline:
+    """
+    Per-device, last-write-wins queue for thermostat writes
+    
+    Writes submitted within WRITE_COALESCE_WINDOW are flushed together:
+    repeated writes to one characteristic collapse to the latest value and
+    different characteristics go out in a single async_put_characteristics.
+    Only one put per device is in flight at a time; writes arriving during
+    a put are batched into the next one.
+    """
+    
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self._pending = {}  # name -> latest value
+        self._waiters = []  # futures resolved when the pending batch is written
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        self.stats = {'submitted': 0, 'collapsed': 0, 'puts': 0}
+    
+    def submit(self, name, value):
+        """
+        Queue a write
+        
+        Returns:
+            Future resolved with the written {name: value} batch once the
+            thermostat acknowledges it (or failed with the write error)
+        """
+        self.stats['submitted'] += 1
+        if name in self._pending:
+            self.stats['collapsed'] += 1
+        self._pending[name] = value
+        
+        future = asyncio.get_running_loop().create_future()
+        # Callers may not wait for the ack; don't warn about unretrieved errors
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._waiters.append(future)
+        
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after(WRITE_COALESCE_WINDOW))
+        return future
+    
+    async def flush(self):
+        """Write everything pending now instead of waiting out the window"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+    
+    async def _flush_after(self, delay):
+        await asyncio.sleep(delay)
+        await self._flush()
+    
+    async def _flush(self):
+        async with self._lock:
+            # Writes submitted while we waited for the lock join this batch
+            if self._flush_task is asyncio.current_task():
+                self._flush_task = None
+            values, waiters = self._pending, self._waiters
+            self._pending, self._waiters = {}, []
+            if not values:
+                return
+            
+            try:
+                await write_characteristics(self.device_id, values)
+                self.stats['puts'] += 1
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(values)
+            except Exception as e:
+                logger.error(f"Write to {self.device_id} failed: {e}")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+
+
+def get_write_pipeline(device_id: str):
+    """The write pipeline of a paired device"""
+    if device_id not in write_pipelines:
+        write_pipelines[device_id] = WritePipeline(device_id)
+    return write_pipelines[device_id]
+
+
+async def write_characteristics(device_id: str, values: dict):
+    """Write several characteristics by name in one HAP put"""
     if device_id not in pairings:
         raise ValueError(f"Device {device_id} is not paired")
     
     pairing = pairings[device_id]
     
-    # Write target temperature
     # Format: [(aid, iid, value), ...]
-    await pairing.async_put_characteristics([
-        (ECOBEE_AID, ECOBEE_TEMP_TARGET, temperature)
-    ])
+    writes = []
+    for name, value in values.items():
+        aid, iid = await get_characteristic_key(device_id, name)
+        writes.append((aid, iid, value))
+    
+    await pairing.async_put_characteristics(writes)
+    for name, value in values.items():
+        characteristic_cache.set(device_id, name, value)
     
+    logger.info(f"Wrote {values} to {device_id}")
+
+
+async def set_temperature(device_id: str, temperature: float, wait: bool = True):
+    """
+    Set target temperature
+    
+    Args:
+        wait: Wait for the thermostat to acknowledge; otherwise return once queued
+    
+    Returns:
+        Future of the thermostat's acknowledgement
+    """
+    if device_id not in pairings:
+        raise ValueError(f"Device {device_id} is not paired")
+    
+    await get_characteristic_key(device_id, 'target_temperature')
+    
+    ack = get_write_pipeline(device_id).submit('target_temperature', temperature)
     logger.info(f"Set temperature to {temperature}°F on {device_id}")
+    if wait:
+        await ack
+    return ack
 
 
-async def set_mode(device_id: str, mode: str):
+async def set_mode(device_id: str, mode: str, wait: bool = True):
     """
     Set HVAC mode
     
     Args:
         mode: 'off', 'heat', 'cool', or 'auto'
+        wait: Wait for the thermostat to acknowledge; otherwise return once queued
+    
+    Returns:
+        Future of the thermostat's acknowledgement
     """
     if device_id not in pairings:
         raise ValueError(f"Device {device_id} is not paired")
     
-    pairing = pairings[device_id]
-    
     # Map mode to HomeKit state
     mode_map = {
         'off': 0,
@@ -266,21 +926,68 @@ async def set_mode(device_id: str, mode: str):
     if state is None:
         raise ValueError(f"Invalid mode: {mode}")
     
-    # Write target state
-    await pairing.async_put_characteristics([
-        (ECOBEE_AID, ECOBEE_TARGET_STATE, state)
-    ])
+    await get_characteristic_key(device_id, 'target_mode')
     
+    ack = get_write_pipeline(device_id).submit('target_mode', state)
     logger.info(f"Set mode to {mode} on {device_id}")
+    if wait:
+        await ack
+    return ack
+
+
+def set_device_stale(device_id: str, stale: bool):
+    """Publish a change in a device's staleness so ETags and streams see it"""
+    if stale_devices.get(device_id, False) != stale:
+        stale_devices[device_id] = stale
+        broadcaster.publish(f"thermostat/{device_id}", {'stale': stale})
+
+
+async def get_thermostat_data_with_deadline(device_id: str, timeout: float):
+    """
+    Read a thermostat, giving up after `timeout` seconds
+    
+    Never raises. On timeout or error the last known reading (if any) is
+    returned with 'stale': True, its age and the error, so one offline
+    device cannot fail or delay a multi-device response.
+    """
+    try:
+        data = await asyncio.wait_for(get_thermostat_data(device_id), timeout)
+        set_device_stale(device_id, False)
+        return {**data, 'stale': False}
+    except asyncio.TimeoutError:
+        error = f"Timed out after {timeout}s"
+    except Exception as e:
+        error = str(e)
+    
+    logger.error(f"Error getting status for {device_id}: {error}")
+    set_device_stale(device_id, True)
+    
+    cached = last_thermostat_data.get(device_id)
+    if cached is None:
+        return {'device_id': device_id, 'stale': True, 'age': None, 'error': error}
+    
+    data, read_at = cached
+    return {
+        **data,
+        'stale': True,
+        'age': round(time.monotonic() - read_at, 1),
+        'error': error,
+    }
 
 
 # REST API Handlers
 
 async def handle_discover(request):
-    """GET /api/discover - Discover HomeKit devices"""
+    """GET /api/discover - Discovered HomeKit devices (?refresh=1 to rescan)"""
     try:
-        devices = await discover_devices()
-        return web.json_response({'devices': devices})
+        if request.query.get('refresh') == '1':
+            await refresh_discovery()
+        return web.json_response({
+            'devices': list_discovered_devices(),
+            'last_scan': last_discovery_scan,
+            'scanning': discovery_task is not None and not discovery_task.done(),
+            'browsing': hap_browser.running,
+        })
     except Exception as e:
         logger.error(f"Discovery error: {e}")
         return web.json_response({'error': str(e)}, status=500)
@@ -322,8 +1029,58 @@ async def handle_unpair(request):
         return web.json_response({'error': str(e)}, status=500)
 
 
+def make_etag(version):
+    """Weak ETag for a state version of this process"""
+    return f'W/"{broadcaster.token(version)}"'
+
+
+def etag_matches(request, etag):
+    """True if the request's If-None-Match names `etag`"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or etag in candidates or etag[2:] in candidates
+
+
+async def conditional_json(request, topics, build, is_fresh=lambda: True):
+    """
+    JSON response with version-based ETag, 304s and ?since= long-polling
+    
+    Args:
+        topics: Broadcaster topics whose versions describe the response
+        build: Coroutine function producing the response dict
+        is_fresh: True if the last published state is current, so a matching
+            If-None-Match can be answered without building (touching devices)
+    """
+    since = request.query.get('since')
+    if since is not None:
+        try:
+            since = broadcaster.parse_token(since)
+        except ValueError:
+            return web.json_response({'error': "since must be the version of an earlier response"},
+                                     status=400)
+        # Hold the request until something changes past `since`. A version
+        # from before a restart counts as changed and is answered at once.
+        if since is not None and not await broadcaster.wait_for_change(since, topics, LONG_POLL_TIMEOUT):
+            return web.Response(status=304, headers={'ETag': make_etag(broadcaster.version_of(topics))})
+    
+    etag = make_etag(broadcaster.version_of(topics))
+    if etag_matches(request, etag) and is_fresh():
+        return web.Response(status=304, headers={'ETag': etag})
+    
+    data = await build()
+    
+    # Building may have refreshed readings and moved the version
+    version = broadcaster.version_of(topics)
+    etag = make_etag(version)
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers={'ETag': etag})
+    return web.json_response({**data, 'version': broadcaster.token(version)}, headers={'ETag': etag})
+
+
 async def handle_status(request):
-    """GET /api/status - Get thermostat status"""
+    """GET /api/status - Get thermostat status (ETag / ?since= aware)"""
     try:
         device_id = request.query.get('device_id')
         
@@ -332,20 +1089,33 @@ async def handle_status(request):
             if not pairings:
                 return web.json_response({'devices': []})
             
-            results = []
-            for did in pairings.keys():
-                try:
-                    data = await get_thermostat_data(did)
-                    results.append(data)
-                except Exception as e:
-                    logger.error(f"Error getting status for {did}: {e}")
-                    results.append({'device_id': did, 'error': str(e)})
+            device_ids = list(pairings.keys())
+            timeout = float(request.query.get('timeout', STATUS_DEVICE_TIMEOUT))
+            
+            async def build():
+                # Query all devices concurrently, each bounded by its own deadline
+                results = await asyncio.gather(*(
+                    get_thermostat_data_with_deadline(did, timeout)
+                    for did in device_ids
+                ))
+                return {'devices': list(results)}
             
-            return web.json_response({'devices': results})
+            return await conditional_json(
+                request,
+                [f"thermostat/{did}" for did in device_ids],
+                build,
+                lambda: all(characteristic_cache.is_fresh(did, thermostat_characteristics(did))
+                            for did in device_ids),
+            )
         
         # Get specific device
-        data = await get_thermostat_data(device_id)
-        return web.json_response(data)
+        return await conditional_json(
+            request,
+            [f"thermostat/{device_id}"],
+            lambda: get_thermostat_data(device_id),
+            lambda: device_id in pairings and characteristic_cache.is_fresh(
+                device_id, thermostat_characteristics(device_id)),
+        )
     except Exception as e:
         logger.error(f"Status error: {e}")
         return web.json_response({'error': str(e)}, status=500)
@@ -364,8 +1134,10 @@ async def handle_set_temperature(request):
                 status=400
             )
         
-        await set_temperature(device_id, float(temperature))
-        return web.json_response({'success': True})
+        # Return once queued unless the caller asks to wait for the thermostat
+        wait = bool(data.get('wait')) or request.query.get('wait') == '1'
+        await set_temperature(device_id, float(temperature), wait=wait)
+        return web.json_response({'success': True, 'acknowledged': wait}, status=200 if wait else 202)
     except Exception as e:
         logger.error(f"Set temperature error: {e}")
         return web.json_response({'error': str(e)}, status=500)
@@ -384,13 +1156,30 @@ async def handle_set_mode(request):
                 status=400
             )
         
-        await set_mode(device_id, mode)
-        return web.json_response({'success': True})
+        # Return once queued unless the caller asks to wait for the thermostat
+        wait = bool(data.get('wait')) or request.query.get('wait') == '1'
+        await set_mode(device_id, mode, wait=wait)
+        return web.json_response({'success': True, 'acknowledged': wait}, status=200 if wait else 202)
     except Exception as e:
         logger.error(f"Set mode error: {e}")
         return web.json_response({'error': str(e)}, status=500)
 
 
+async def handle_health(request):
+    """GET /health - Liveness plus startup readiness, overall and per subsystem"""
+    return web.json_response({
+        'status': 'ok',
+        'ready': pairings_restored,
+        'pairings': pairing_status,
+        **startup.describe(),
+    })
+
+
+async def handle_cache_stats(request):
+    """GET /api/cache/stats - Characteristic read cache counters"""
+    return web.json_response(characteristic_cache.get_stats())
+
+
 async def handle_paired_devices(request):
     """GET /api/paired - List all paired devices"""
     devices = []
@@ -405,217 +1194,398 @@ async def handle_paired_devices(request):
 # Relay Control (Dehumidifier)
 # ============================================================================
 
-def find_relay_port():
-    """Find USB relay module (CH340)"""
-    ports = serial.tools.list_ports.comports()
-    for port in ports:
-        # Look for CH340 chip (common in USB relay modules)
-        if 'CH340' in port.description or 'CH340' in port.manufacturer:
-            return port.device
-        # Also check for common relay module VID/PID
-        if port.vid == 0x1a86 and port.pid == 0x7523:  # CH340 VID/PID
-            return port.device
-    return None
-
-
 async def init_relay():
-    """Initialize USB relay connection"""
-    global relay_port, relay_connected
+    """
+    Initialize USB relay connection
     
+    Starts the hot-plug supervisor either way, so a board that is missing,
+    unplugged or glitches later is picked up again without a restart.
+    """
+    connected = False
     try:
-        port_path = find_relay_port()
-        if not port_path:
-            logger.warning("No USB relay module found. Dehumidifier control disabled.")
-            return False
-        
-        relay_port = serial.Serial(
-            port_path,
-            baudrate=9600,
-            timeout=1,
-            write_timeout=1
-        )
-        relay_connected = True
-        logger.info(f"USB relay connected on {port_path}")
-        return True
+        port_path = os.getenv('RELAY_PORT') or find_relay_port()
+        if port_path:
+            await relay.open(port_path)
+            broadcaster.publish('relay', {'connected': True})
+            connected = True
+        else:
+            logger.warning("No USB relay module found - waiting for it to be plugged in")
     except Exception as e:
         logger.error(f"Failed to connect to relay: {e}")
-        relay_connected = False
-        return False
+    finally:
+        # Also when a startup deadline cancels the open
+        relay.start_supervisor(
+            on_reconnect=on_relay_reconnect,
+            on_disconnect=on_relay_disconnect,
+            pinned_path=os.getenv('RELAY_PORT')
+        )
+    return connected
+
+
+async def on_relay_reconnect():
+    """Restore the last commanded channel states after a replug"""
+    broadcaster.publish('relay', {'connected': True})
+    commands = await relay_scheduler.replay()
+    if commands:
+        logger.info(f"Replayed relay states: {commands}")
+
+
+def on_relay_disconnect():
+    broadcaster.publish('relay', {'connected': False})
+
+
+def on_relay_change(channel, on):
+    """Called by the relay scheduler whenever a channel state changes on the board"""
+    name = relay_bank.name_of(channel)
+    logger.info(f"Relay {channel} ({name}) {'ON' if on else 'OFF'}")
+    broadcaster.publish('relay', {name: on})
+    if channel == relay_channel:
+        update_system_state({'dehumidifier_on': on})
+    elif f'{name}_on' in system_state:
+        update_system_state({f'{name}_on': on})
 
 
-async def control_relay(channel, on):
+# Only the dehumidifier compressor needs min on/off times; fans, the ERV
+# and the humidifier valve may switch freely
+def on_relay_pending(channel, target):
+    """Called by the relay scheduler when a deferred transition is scheduled or dropped"""
+    broadcaster.publish('relay', {f'{relay_bank.name_of(channel)}_pending': target})
+
+
+relay_scheduler = RelayScheduler(relay, on_change=on_relay_change, on_pending=on_relay_pending)
+relay_scheduler.set_dwell(relay_channel, RELAY_MIN_ON, RELAY_MIN_OFF)
+relay_bank = RelayBank(relay_scheduler, RELAY_CHANNELS)
+
+
+async def control_relay(channel, on, force=False):
     """
     Control relay channel (AT command format for CH340)
     
+    Goes through the relay scheduler: requests for the current state are
+    dropped and transitions inside the min on/off time are deferred. The
+    write runs on the relay I/O thread, never on the event loop.
+    
     Args:
-        channel: Relay number (1-8, 1-based)
+        channel: Relay number (1-8, 1-based) or channel name ('erv')
         on: True to turn on, False to turn off
+        force: Ignore min on/off times (manual override)
+    
+    Returns:
+        dict with 'action': 'sent', 'noop' or 'deferred'
     """
-    global relay_port, relay_connected
+    try:
+        return await relay_bank.switch(channel, on, force)
+    except ValueError:
+        raise  # Unknown channel - nothing was sent
+    except Exception as e:
+        logger.error(f"Failed to control relay: {e}")
+        broadcaster.publish('relay', {'connected': relay.connected})
+        raise
+
+
+async def control_relays(commands, force=False):
+    """
+    Switch several relay channels with a single serial write
     
-    if not relay_connected or not relay_port:
-        raise Exception("Relay not connected")
+    Args:
+        commands: [(channel_or_name, on), ...] or {channel_or_name: on}
     
+    Returns:
+        list of per-channel scheduler results
+    """
     try:
-        # AT command format: AT+ON1\r\n or AT+OFF1\r\n
-        command = f"AT+{'ON' if on else 'OFF'}{channel}\r\n"
-        relay_port.write(command.encode())
-        logger.info(f"Relay {channel} {'ON' if on else 'OFF'}")
-        return True
+        return await relay_bank.switch_many(commands, force)
+    except ValueError:
+        raise  # Unknown channel - nothing was sent
     except Exception as e:
         logger.error(f"Failed to control relay: {e}")
-        relay_connected = False
+        broadcaster.publish('relay', {'connected': relay.connected})
         raise
 
 
 async def get_relay_status(channel):
     """Get relay status (may not be supported by all modules)"""
     # Most CH340 modules don't support status readback
-    # Return last known state from system_state
-    return system_state.get('dehumidifier_on', False)
+    # Return last commanded state
+    commanded = relay_scheduler.commanded(channel)
+    if commanded is None and channel == relay_channel:
+        return system_state.dehumidifier_on
+    return bool(commanded)
 
 
 # ============================================================================
 # Interlock Logic (Free Dry, etc.)
 # ============================================================================
 
-async def evaluate_interlock_logic():
+# Optional humidity thresholds for the dehumidifier (%). When unset, the
+# dehumidifier holds its state unless Free Dry or AC Overcool applies.
+HUMIDITY_HIGH = float(os.getenv('HUMIDITY_HIGH')) if os.getenv('HUMIDITY_HIGH') else None
+HUMIDITY_LOW = float(os.getenv('HUMIDITY_LOW')) if os.getenv('HUMIDITY_LOW') else None
+
+# Interlock rules, highest priority first per target. Each condition's
+# parameters are the system_state fields it depends on.
+INTERLOCK_RULES = [
+    # AC Overcool: hot outside and the AC is running - let it dehumidify for "free"
+    Rule('ac_overcool', 'dehumidifier',
+         lambda outdoor_temp, hvac_mode, hvac_running: outdoor_temp > 80 and hvac_mode == 'cool' and hvac_running,
+         False, "AC overcool mode (outdoor {outdoor_temp}°F > 80°F, AC running)", priority=30),
+    # Free Dry: cool outside (< 65°F) and humid inside (> 55%)
+    Rule('free_dry', 'dehumidifier',
+         lambda outdoor_temp, indoor_humidity: outdoor_temp < 65 and indoor_humidity > 55,
+         True, "Free dry mode (outdoor {outdoor_temp}°F < 65°F, humidity {indoor_humidity}% > 55%)", priority=20),
+    # Noise Cancellation: quiet while occupied, turbo while away
+    Rule('occupied_quiet', 'noise_cancellation', lambda occupancy: occupancy,
+         True, "Occupancy detected - LEDs off, fan low (Whisper)"),
+    Rule('unoccupied_turbo', 'noise_cancellation', lambda occupancy: not occupancy,
+         False, "No occupancy - fan max (Turbo)"),
+]
+if HUMIDITY_HIGH is not None:
+    INTERLOCK_RULES.append(Rule(
+        'humidity_high', 'dehumidifier', lambda indoor_humidity: indoor_humidity > HUMIDITY_HIGH,
+        True, f"Humidity {{indoor_humidity}}% > {HUMIDITY_HIGH}%", priority=10))
+if HUMIDITY_LOW is not None:
+    INTERLOCK_RULES.append(Rule(
+        'humidity_low', 'dehumidifier', lambda indoor_humidity: indoor_humidity < HUMIDITY_LOW,
+        False, f"Humidity {{indoor_humidity}}% < {HUMIDITY_LOW}%", priority=10))
+
+interlock_rules = RuleEngine(INTERLOCK_RULES)
+
+# system_state version seen by the last evaluation; the next one re-runs
+# the rules reading fields changed after it (None: evaluate everything)
+interlock_seen_version = None
+
+
+async def evaluate_interlock_logic(full=False):
     """
-    Evaluate interlock logic for dehumidifier control
+    Evaluate interlock logic for dehumidifier control and noise cancellation
     
-    Rules:
+    Only rules whose input fields changed since the last evaluation are
+    re-run (see INTERLOCK_RULES); then the devices are brought in line with
+    the current decisions:
     1. Free Dry: If outdoor_temp < 65°F AND indoor_humidity > 55% → Run dehumidifier
     2. AC Overcool: If outdoor_temp > 80°F → Disable dehumidifier, let AC handle it
     3. Min on/off times: Respect minimum runtime to prevent short cycling
+       (enforced by the relay scheduler, which defers early transitions)
+    4. Noise Cancellation: Blueair whisper mode while occupied, turbo while away
+    
+    Args:
+        full: Re-run every rule regardless of what changed
     """
-    global system_state
-    
-    indoor_humidity = system_state.get('indoor_humidity')
-    outdoor_temp = system_state.get('outdoor_temp')
-    hvac_mode = system_state.get('hvac_mode')
-    hvac_running = system_state.get('hvac_running')
-    current_dehu_state = system_state.get('dehumidifier_on', False)
-    
-    # Rule 1: Free Dry Logic
-    # If it's cool outside (< 65°F) and humid inside (> 55%), run dehumidifier
-    free_dry_condition = (
-        outdoor_temp is not None and outdoor_temp < 65 and
-        indoor_humidity is not None and indoor_humidity > 55
-    )
-    
-    # Rule 2: AC Overcool Logic
-    # If it's hot outside (> 80°F), let AC handle dehumidification
-    ac_overcool_condition = (
-        outdoor_temp is not None and outdoor_temp > 80 and
-        hvac_mode == 'cool' and hvac_running
-    )
-    
-    # Decision logic
-    should_run = False
-    reason = ""
-    
-    if ac_overcool_condition:
-        # AC is running and it's hot - let AC dehumidify for "free"
-        should_run = False
-        reason = "AC overcool mode (outdoor > 80°F, AC running)"
-    elif free_dry_condition:
-        # Cool outside, humid inside - run dehumidifier
-        should_run = True
-        reason = f"Free dry mode (outdoor {outdoor_temp}°F < 65°F, humidity {indoor_humidity}% > 55%)"
-    else:
-        # Default: Use humidity setpoint logic (can be extended)
-        # For now, keep current state unless explicitly changed
+    global interlock_seen_version
+    
+    changed = None
+    if not full and interlock_seen_version is not None:
+        changed = system_state.changed_since(interlock_seen_version).keys()
+    interlock_seen_version = system_state.version
+    interlock_rules.update(system_state, changed)
+    
+    decision = interlock_rules.decision('dehumidifier')
+    current_dehu_state = system_state.dehumidifier_on
+    if decision['value'] is None:
         should_run = current_dehu_state
         reason = "Maintaining current state"
+    else:
+        should_run = decision['value']
+        reason = decision['reason']
     
     # Only change if state needs to change
+    relay_action = None
     if should_run != current_dehu_state:
         try:
-            await control_relay(relay_channel, should_run)
-            system_state['dehumidifier_on'] = should_run
-            logger.info(f"Dehumidifier {'ON' if should_run else 'OFF'}: {reason}")
+            result = await control_relay(relay_channel, should_run)
+            relay_action = result['action']
+            logger.info(f"Dehumidifier {'ON' if should_run else 'OFF'} ({relay_action}): {reason}")
         except Exception as e:
             logger.error(f"Failed to control dehumidifier: {e}")
     
+    await apply_noise_cancellation(interlock_rules.decision('noise_cancellation'))
+    
     return {
         'should_run': should_run,
         'reason': reason,
+        'rule': decision['rule'],
         'current_state': current_dehu_state,
+        'relay_action': relay_action,
+        'noise_cancellation': interlock_state.noise_cancellation_active,
     }
 
 
+class InterlockWorker:
+    """
+    Runs interlock evaluation in the background, debounced
+    
+    Requests made within INTERLOCK_DEBOUNCE of each other share one
+    evaluation pass, so a burst of sensor updates costs a single round of
+    relay/Blueair decisions. Passes never overlap; requests arriving during
+    a pass are served by the next one.
+    """
+    
+    def __init__(self, debounce):
+        self.debounce = debounce
+        self._waiters = []  # futures resolved with the result of the next pass
+        self._full = False
+        self._task = None
+        self.last_result = None
+        self.stats = {'requests': 0, 'passes': 0}
+    
+    def request(self, full=False):
+        """
+        Schedule an evaluation pass
+        
+        Args:
+            full: Re-run every rule (see evaluate_interlock_logic)
+        
+        Returns:
+            Future resolved with the pass's result
+        """
+        self.stats['requests'] += 1
+        self._full = self._full or full
+        
+        future = asyncio.get_running_loop().create_future()
+        # Most callers don't wait for the result; don't warn about unretrieved errors
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._waiters.append(future)
+        
+        if self._task is None:
+            self._task = run_in_background(self._run())
+        return future
+    
+    async def _run(self):
+        try:
+            while self._waiters:
+                await asyncio.sleep(self.debounce)
+                waiters, self._waiters = self._waiters, []
+                full, self._full = self._full, False
+                
+                try:
+                    result = await evaluate_interlock_logic(full=full)
+                    self.stats['passes'] += 1
+                    self.last_result = result
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(result)
+                except Exception as e:
+                    logger.error(f"Interlock evaluation failed: {e}")
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+        finally:
+            self._task = None
+
+
+interlock_worker = InterlockWorker(INTERLOCK_DEBOUNCE)
+
+
 # ============================================================================
 # API Handlers for Relay Control
 # ============================================================================
 
 async def handle_relay_status(request):
-    """GET /api/relay/status - Get relay status"""
+    """
+    GET /api/relay/status - Get relay status (ETag / ?since= aware)
+    
+    Only state that changes with a publish is included, so a matching ETag
+    means an identical body; counters are at /api/relay/stats.
+    """
     try:
-        status = await get_relay_status(relay_channel)
-        return web.json_response({
-            'connected': relay_connected,
-            'channel': relay_channel,
-            'on': status,
-            'system_state': system_state,
-        })
+        async def build():
+            status = await get_relay_status(relay_channel)
+            return {
+                'connected': relay.connected,
+                'port': relay.port_path,
+                'channel': relay_channel,
+                'on': status,
+                'channels': relay_bank.status(counters=False),
+                'min_on': RELAY_MIN_ON,
+                'min_off': RELAY_MIN_OFF,
+                'system_state': system_state.as_dict(),
+            }
+        
+        return await conditional_json(request, RELAY_STATUS_TOPICS, build)
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
 
 
+async def handle_relay_stats(request):
+    """GET /api/relay/stats - Transport counters and per-channel runtimes"""
+    return web.json_response({
+        'transport': relay.stats,
+        'channels': relay_bank.status(),
+    })
+
+
 async def handle_relay_control(request):
-    """POST /api/relay/control - Manually control relay"""
+    """
+    POST /api/relay/control - Manually control relay
+    
+    Body: {"channel": 2 | "erv", "on": true} for one channel, or
+    {"channels": {"erv": true, "booster_fan": false}} to switch several in
+    one batch. Either form accepts "force": true.
+    """
     try:
         data = await request.json()
+        force = bool(data.get('force', False))
+        
+        if 'channels' in data:
+            if not isinstance(data['channels'], dict) or not data['channels']:
+                return web.json_response({'error': 'channels must be a non-empty object'}, status=400)
+            try:
+                results = await control_relays(data['channels'], force)
+            except ValueError as e:
+                return web.json_response({'error': str(e)}, status=400)
+            return web.json_response({'success': True, 'results': results})
+        
         channel = data.get('channel', relay_channel)
         on = data.get('on', False)
         
-        await control_relay(channel, on)
-        system_state['dehumidifier_on'] = on
+        try:
+            result = await control_relay(channel, on, force)
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
         
         return web.json_response({
             'success': True,
-            'channel': channel,
-            'on': on,
+            **result,
         })
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
 
 
 async def handle_update_system_state(request):
-    """POST /api/system-state - Update system state for interlock logic"""
+    """
+    POST /api/system-state - Update system state for interlock logic
+    
+    Responds 202 once the state is applied; the interlock is evaluated by
+    the background worker. With ?wait=1 (or "wait": true) the response is
+    sent after that evaluation and includes its result.
+    """
     try:
         data = await request.json()
         
         # Update system state
-        if 'indoor_temp' in data:
-            system_state['indoor_temp'] = data['indoor_temp']
-        if 'indoor_humidity' in data:
-            system_state['indoor_humidity'] = data['indoor_humidity']
-        if 'outdoor_temp' in data:
-            system_state['outdoor_temp'] = data['outdoor_temp']
-        if 'hvac_mode' in data:
-            system_state['hvac_mode'] = data['hvac_mode']
-        if 'hvac_running' in data:
-            system_state['hvac_running'] = data['hvac_running']
-        if 'hvac_fan_running' in data:
-            system_state['hvac_fan_running'] = data['hvac_fan_running']
-        if 'occupancy' in data:
-            system_state['occupancy'] = data['occupancy']
-        
-        system_state['last_update'] = datetime.now().isoformat()
-        
-        # Evaluate interlock logic
-        interlock_result = await evaluate_interlock_logic()
-        
-        # Also evaluate noise cancellation if occupancy changed
-        if 'occupancy' in data:
-            await evaluate_noise_cancellation()
+        fields = ('indoor_temp', 'indoor_humidity', 'outdoor_temp', 'hvac_mode',
+                  'hvac_running', 'hvac_fan_running', 'occupancy')
+        changes = {field: data[field] for field in fields if field in data}
+        changes['last_update'] = datetime.now().isoformat()
+        try:
+            diff = update_system_state(changes)
+        except (TypeError, ValueError) as e:
+            return web.json_response({'error': f'Invalid system state: {e}'}, status=400)
+        
+        # Evaluate interlock logic in the background (re-runs only rules
+        # whose inputs changed)
+        wait = bool(data.get('wait')) or request.query.get('wait') == '1'
+        interlock_result = None
+        if wait or diff.keys() & interlock_rules.inputs:
+            evaluation = interlock_worker.request()
+            if wait:
+                interlock_result = await evaluation
         
         return web.json_response({
             'success': True,
-            'system_state': system_state,
+            'system_state': system_state.as_dict(),
             'interlock_result': interlock_result,
-        })
+        }, status=200 if wait else 202)
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
 
@@ -623,31 +1593,45 @@ async def handle_update_system_state(request):
 async def handle_evaluate_interlock(request):
     """POST /api/interlock/evaluate - Manually trigger interlock evaluation"""
     try:
-        result = await evaluate_interlock_logic()
-        # Also evaluate noise cancellation
-        await evaluate_noise_cancellation()
+        result = await interlock_worker.request(full=True)
         return web.json_response(result)
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
 
 
+async def handle_interlock_rules(request):
+    """GET /api/interlock/rules - Rules, current decisions and why they were made"""
+    return web.json_response({
+        'rules': interlock_rules.describe(),
+        'decisions': interlock_rules.decisions,
+        'history': list(interlock_rules.history),
+        'stats': interlock_rules.stats,
+        'worker': interlock_worker.stats,
+        'last_result': interlock_worker.last_result,
+    })
+
+
 # ============================================================================
 # Blueair Control Functions
 # ============================================================================
 
 async def init_blueair():
-    """Initialize Blueair connection"""
+    """
+    Initialize Blueair connection
+    
+    Returns:
+        True if connected, False on failure (retried), None if not configured
+    """
     global blueair_account, blueair_devices, blueair_connected
     
     try:
         # Get credentials from environment or config
-        import os
         username = os.getenv('BLUEAIR_USERNAME')
         password = os.getenv('BLUEAIR_PASSWORD')
         
         if not username or not password:
             logger.warning("Blueair credentials not set. Set BLUEAIR_USERNAME and BLUEAIR_PASSWORD environment variables.")
-            return False
+            return None
         
         blueair_account = await get_blueair_account(username=username, password=password)
         blueair_devices = blueair_account.devices
@@ -679,7 +1663,7 @@ async def control_blueair_fan(device_index=0, speed=0):
     try:
         purifier = blueair_devices[device_index]
         await purifier.set_fan_speed(speed)
-        system_state['blueair_fan_speed'] = speed
+        update_system_state({'blueair_fan_speed': speed})
         logger.info(f"Blueair fan speed set to {speed}")
         return True
     except Exception as e:
@@ -706,7 +1690,7 @@ async def control_blueair_led(device_index=0, brightness=100):
     try:
         purifier = blueair_devices[device_index]
         await purifier.set_led_brightness(brightness)
-        system_state['blueair_led_brightness'] = brightness
+        update_system_state({'blueair_led_brightness': brightness})
         logger.info(f"Blueair LED brightness set to {brightness}%")
         return True
     except Exception as e:
@@ -730,91 +1714,84 @@ async def get_blueair_status(device_index=0):
         # This is a placeholder - adjust based on actual API
         return {
             'device_index': device_index,
-            'fan_speed': system_state.get('blueair_fan_speed', 0),
-            'led_brightness': system_state.get('blueair_led_brightness', 100),
+            'fan_speed': system_state.blueair_fan_speed,
+            'led_brightness': system_state.blueair_led_brightness,
         }
     except Exception as e:
         logger.error(f"Failed to get Blueair status: {e}")
         return None
 
 
-async def start_dust_kicker_cycle():
+async def dust_kicker_cycle(job):
     """
-    Start the "Dust Kicker" cycle:
+    The "Dust Kicker" cycle (runs as the 'dust_kicker' job):
     1. Ecobee turns HVAC Fan ON (to stir up dust)
     2. Wait 30 seconds
     3. Blueair to MAX (to catch the dust)
     4. Run for 10 minutes
     5. Turn both down to "Silent"
-    """
-    global interlock_state
-    
-    if interlock_state['dust_kicker_active']:
-        logger.warning("Dust Kicker cycle already active")
-        return
-    
-    interlock_state['dust_kicker_active'] = True
-    interlock_state['dust_kicker_start_time'] = datetime.now()
     
-    logger.info("Starting Dust Kicker cycle...")
+    Cancelling it (POST /api/tasks/cancel, shutdown) jumps to step 5.
+    """
+    update_interlock_state({
+        'dust_kicker_active': True,
+        'dust_kicker_start_time': datetime.now().isoformat(),
+    })
     
+    boosted = False
     try:
         # Step 1: Turn on HVAC fan (via Ecobee - would need to implement)
         # For now, we'll just log it
-        logger.info("Step 1: HVAC Fan ON (stirring up dust)")
+        job.step("Step 1: HVAC Fan ON (stirring up dust)")
         
         # Step 2: Wait 30 seconds
-        await asyncio.sleep(30)
-        logger.info("Step 2: 30 seconds elapsed")
+        await job.sleep(DUST_KICKER_STIR_TIME, "Step 2: Waiting for the dust to lift")
         
         # Step 3: Blueair to MAX
+        job.step("Step 3: Blueair to MAX (catching dust)")
         await control_blueair_fan(0, 3)  # Max speed
-        logger.info("Step 3: Blueair set to MAX (catching dust)")
+        boosted = True
         
         # Step 4: Run for 10 minutes
-        await asyncio.sleep(600)  # 10 minutes
-        logger.info("Step 4: 10 minutes elapsed")
-        
-        # Step 5: Turn both to silent
-        await control_blueair_fan(0, 1)  # Low speed (silent)
-        logger.info("Step 5: Blueair set to Silent mode")
-        # HVAC fan would be turned off here (via Ecobee)
-        
-        logger.info("Dust Kicker cycle complete")
-    except Exception as e:
-        logger.error(f"Dust Kicker cycle error: {e}")
+        await job.sleep(DUST_KICKER_RUN_TIME, "Step 4: Filtering")
     finally:
-        interlock_state['dust_kicker_active'] = False
-        interlock_state['dust_kicker_start_time'] = None
+        try:
+            # Step 5: Turn both to silent
+            if boosted:
+                job.step("Step 5: Blueair to Silent")
+                await control_blueair_fan(0, 1)  # Low speed (silent)
+            # HVAC fan would be turned off here (via Ecobee)
+        finally:
+            update_interlock_state({
+                'dust_kicker_active': False,
+                'dust_kicker_start_time': None,
+            })
 
 
-async def evaluate_noise_cancellation():
+async def apply_noise_cancellation(decision):
     """
-    Noise Cancellation Mode:
+    Noise Cancellation Mode (decided by the occupancy rules):
     - Occupancy detected → LEDs OFF, Fan to LOW (Whisper mode)
     - No occupancy → Fan to Turbo Mode (scrub air while gone)
-    """
-    global system_state, interlock_state
     
-    occupancy = system_state.get('occupancy', False)
-    
-    if not blueair_connected:
+    Args:
+        decision: interlock_rules decision for 'noise_cancellation'
+    """
+    active = decision['value']
+    if not blueair_connected or active is None or active == interlock_state.noise_cancellation_active:
         return
     
     try:
-        if occupancy:
+        if active:
             # Occupancy detected - quiet mode
-            if not interlock_state['noise_cancellation_active']:
-                logger.info("Occupancy detected - activating Noise Cancellation mode")
-                await control_blueair_led(0, 0)  # LEDs OFF
-                await control_blueair_fan(0, 1)  # Low speed (Whisper)
-                interlock_state['noise_cancellation_active'] = True
+            logger.info(f"Activating Noise Cancellation mode ({decision['reason']})")
+            await control_blueair_led(0, 0)  # LEDs OFF
+            await control_blueair_fan(0, 1)  # Low speed (Whisper)
         else:
             # No occupancy - turbo mode
-            if interlock_state['noise_cancellation_active']:
-                logger.info("No occupancy - activating Turbo mode")
-                await control_blueair_fan(0, 3)  # Max speed (Turbo)
-                interlock_state['noise_cancellation_active'] = False
+            logger.info(f"Activating Turbo mode ({decision['reason']})")
+            await control_blueair_fan(0, 3)  # Max speed (Turbo)
+        update_interlock_state({'noise_cancellation_active': active})
     except Exception as e:
         logger.error(f"Noise Cancellation mode error: {e}")
 
@@ -881,18 +1858,373 @@ async def handle_blueair_led(request):
 
 
 async def handle_dust_kicker(request):
-    """POST /api/blueair/dust-kicker - Start Dust Kicker cycle"""
+    """POST /api/blueair/dust-kicker - Start Dust Kicker cycle (see /api/tasks)"""
     try:
-        # Start cycle in background (don't wait for it)
-        asyncio.create_task(start_dust_kicker_cycle())
+        if jobs.running('dust_kicker'):
+            return web.json_response({'error': 'Dust Kicker cycle already active'}, status=409)
+        
+        # Runs as a job (don't wait for it)
+        job = jobs.start('dust_kicker', dust_kicker_cycle)
         return web.json_response({
             'success': True,
             'message': 'Dust Kicker cycle started',
+            'task': job.describe(),
         })
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
 
 
+async def handle_tasks(request):
+    """GET /api/tasks - Running and recently finished jobs, plus background tasks"""
+    try:
+        return web.json_response({
+            **jobs.describe(),
+            'background': sorted(task.get_name() for task in background_tasks),
+        })
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+async def handle_cancel_task(request):
+    """
+    POST /api/tasks/cancel - Cancel a running job
+    
+    Body: {"name": "dust_kicker"}. The job's cleanup steps still run.
+    """
+    try:
+        data = await request.json()
+        name = data.get('name')
+        if not jobs.cancel(name):
+            return web.json_response({'error': f"No running task named {name}"}, status=404)
+        return web.json_response({'success': True, 'name': name})
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+# ============================================================================
+# Sensor History
+# ============================================================================
+
+def parse_time(value):
+    """Unix seconds or an ISO 8601 timestamp -> Unix seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def read_stored_history(metric, start, end, res, coarsen=False):
+    """
+    Samples (res='raw') or min/max/mean buckets of one metric from the
+    on-disk store (blocking I/O)
+    
+    The store is read one daily segment at a time, so memory use is bounded
+    by the response, which is capped at HISTORY_MAX_RAW_POINTS samples or
+    HISTORY_MAX_BUCKETS buckets.
+    
+    Args:
+        coarsen: Instead of failing, step up to a coarser rollup until the
+            range fits in HISTORY_MAX_BUCKETS (for res=auto)
+    
+    Returns:
+        (resolution, {column: list})
+    
+    Raises:
+        ValueError: Too many samples or buckets in range
+    """
+    if res == 'raw':
+        times, values = array('d'), array('f')
+        for segment_times, segment_columns in history_store.scan_segments(start, end, [metric]):
+            times.extend(segment_times)
+            values.extend(segment_columns[metric])
+            if len(times) > HISTORY_MAX_RAW_POINTS:
+                hint = '' if metric in history_store.categories else " or use a rollup resolution"
+                raise ValueError(f"More than {HISTORY_MAX_RAW_POINTS} samples in range; "
+                                 f"narrow the range{hint}")
+        return res, {'t': times.tolist(), 'value': history_store.decode(metric, values)}
+    
+    # Bucket count over the part of the range the store actually holds
+    first = history_store.first_time()
+    span = end - max(start, first) if first is not None else 0
+    resolutions = list(RESOLUTIONS)
+    while span / RESOLUTIONS[res] > HISTORY_MAX_BUCKETS:
+        coarser = resolutions.index(res) + 1
+        if not coarsen or coarser == len(resolutions):
+            raise ValueError(f"About {int(span // RESOLUTIONS[res])} {res} buckets in range "
+                             f"(limit {HISTORY_MAX_BUCKETS}); narrow the range or use a coarser resolution")
+        res = resolutions[coarser]
+    
+    # Buckets divide a day and segments are UTC days, so no bucket spans two segments
+    columns = {name: array('d') for name in ('t', 'min', 'max', 'mean')}
+    for segment_times, segment_columns in history_store.scan_segments(start, end, [metric]):
+        for name, column in downsample(segment_times, segment_columns[metric], RESOLUTIONS[res]).items():
+            columns[name].extend(column)
+    return res, {name: column.tolist() for name, column in columns.items()}
+
+
+async def handle_history(request):
+    """
+    GET /api/history?metric=indoor_humidity&from=...&to=...&res=auto
+
+    from/to are Unix seconds or ISO timestamps (default: the last 24 hours).
+    res is raw, 1m, 15m, 1h or auto (finest resolution whose in-memory
+    retention would cover the range). Returns columns: t/value for raw
+    samples, t/min/max/mean for rollup buckets (t = bucket start).
+
+    Ranges reaching back before the in-memory data, and fields without
+    in-memory history, are read from the on-disk store and downsampled
+    there to the same buckets.
+    """
+    try:
+        metric = request.query.get('metric')
+        if metric not in sensor_history.metrics and metric not in history_store.fields:
+            return web.json_response({
+                'error': f"Unknown metric: {metric}" if metric else "metric is required",
+                'metrics': list(sensor_history.metrics),
+                'stored': list(history_store.fields),
+            }, status=400)
+
+        try:
+            end = parse_time(request.query['to']) if 'to' in request.query else time.time()
+            start = parse_time(request.query['from']) if 'from' in request.query else end - 86400
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        res = request.query.get('res', 'auto')
+        auto = res == 'auto'
+        if auto:
+            res = ('raw' if metric in history_store.categories
+                   else sensor_history.resolution_for_span(end - start, HISTORY_INTERVAL))
+        elif res not in sensor_history.resolutions:
+            return web.json_response({
+                'error': f"Unknown resolution {res!r} (use one of: auto, {', '.join(sensor_history.resolutions)})",
+            }, status=400)
+
+        # Memory serves the range only if it holds data from `start` on
+        history = sensor_history.metrics.get(metric)
+        oldest = history.oldest(res) if history is not None else None
+        in_memory = (oldest is not None and oldest <= start
+                     and history.first_time is not None and history.first_time <= start)
+        
+        if in_memory:
+            res, columns = sensor_history.query(metric, start, end, res)
+            columns = {name: column.tolist() for name, column in columns.items()}
+        else:
+            if res != 'raw' and metric in history_store.categories:
+                return web.json_response({'error': f"{metric} is categorical; use res=raw"}, status=400)
+            loop = asyncio.get_running_loop()
+            try:
+                res, columns = await loop.run_in_executor(None, read_stored_history, metric, start, end, res, auto)
+            except ValueError as e:
+                return web.json_response({'error': str(e)}, status=400)
+
+        return web.json_response({
+            'metric': metric,
+            'res': res,
+            'source': 'memory' if in_memory else 'disk',
+            'from': start,
+            'to': end,
+            'count': len(columns['t']),
+            **columns,
+        })
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+
+# ============================================================================
+# Change Stream (Server-Sent Events)
+# ============================================================================
+
+def format_sse(event, data):
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+
+async def handle_stream(request):
+    """
+    GET /api/stream - Server-sent events of state changes
+    
+    Sends a 'snapshot' event first, then one event per topic ('system_state',
+    'interlock_state', 'relay', 'thermostat/<device_id>') containing only the
+    fields that changed. Slow clients receive the latest values and skip
+    intermediate ones.
+    """
+    try:
+        subscriber = broadcaster.subscribe()
+    except RuntimeError as e:
+        return web.json_response({'error': str(e)}, status=503)
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    
+    try:
+        await response.prepare(request)
+        await response.write(format_sse('snapshot', {
+            'system_state': system_state.as_dict(),
+            'interlock_state': interlock_state.as_dict(),
+            'thermostats': {did: data for did, (data, _) in last_thermostat_data.items()},
+        }))
+        
+        while True:
+            pending = await broadcaster.next(subscriber, STREAM_HEARTBEAT)
+            if pending is None:
+                await response.write(b": keep-alive\n\n")
+                continue
+            # write() waits for the socket to drain; changes published
+            # meanwhile are merged into the subscriber's pending slot
+            for topic, changes in pending.items():
+                await response.write(format_sse(topic, changes))
+    except ConnectionResetError:
+        pass
+    finally:
+        broadcaster.unsubscribe(subscriber)
+    
+    return response
+
+
+async def handle_stream_stats(request):
+    """GET /api/stream/stats - Stream subscriber counters"""
+    return web.json_response(broadcaster.get_stats())
+
+
+# ============================================================================
+# Batch Commands
+# ============================================================================
+
+BATCH_ACTION_TYPES = ('set_temperature', 'set_mode', 'relay', 'blueair_fan', 'blueair_led')
+
+
+def is_number(value):
+    """True for an int or float (JSON number), False for bool, str, None..."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_batch_action(action):
+    """Return an error message for a malformed batch action, or None"""
+    if not isinstance(action, dict) or action.get('type') not in BATCH_ACTION_TYPES:
+        return f"type must be one of {', '.join(BATCH_ACTION_TYPES)}"
+    
+    kind = action['type']
+    if kind == 'set_temperature' and (not action.get('device_id') or action.get('temperature') is None):
+        return 'device_id and temperature required'
+    if kind == 'set_mode' and (not action.get('device_id') or not action.get('mode')):
+        return 'device_id and mode required'
+    if kind == 'relay':
+        if 'on' not in action:
+            return 'on required'
+        try:
+            relay_bank.resolve(action.get('channel', relay_channel))
+        except ValueError as e:
+            return str(e)
+    if kind == 'blueair_fan':
+        speed = action.get('speed', 0)
+        if not is_number(speed) or not 0 <= speed <= 3:
+            return 'Speed must be 0-3'
+    if kind == 'blueair_led':
+        brightness = action.get('brightness', 100)
+        if not is_number(brightness) or not 0 <= brightness <= 100:
+            return 'Brightness must be 0-100'
+    return None
+
+
+async def run_batch_group(indexes, coro, results):
+    """Await one device's share of a batch and record the result for each of its actions"""
+    started = time.monotonic()
+    try:
+        await coro
+        error = None
+    except Exception as e:
+        error = str(e)
+    elapsed_ms = round((time.monotonic() - started) * 1000, 1)
+    
+    for index in indexes:
+        results[index].update({'success': error is None, 'elapsed_ms': elapsed_ms})
+        if error is not None:
+            results[index]['error'] = error
+
+
+async def write_thermostat_batch(device_id, actions):
+    """Queue all writes for one thermostat and flush them as a single put"""
+    acks = []
+    for action in actions:
+        if action['type'] == 'set_temperature':
+            acks.append(await set_temperature(device_id, float(action['temperature']), wait=False))
+        else:
+            acks.append(await set_mode(device_id, action['mode'], wait=False))
+    
+    await get_write_pipeline(device_id).flush()
+    await asyncio.gather(*acks)
+
+
+async def switch_relay_batch(actions):
+    """Send all relay actions in one batch (see RelayTransport.send_many)"""
+    commands = [(action.get('channel', relay_channel), bool(action['on'])) for action in actions]
+    force = any(action.get('force') for action in actions)
+    await control_relays(commands, force)
+
+
+async def execute_batch(actions):
+    """
+    Run a list of actions, grouped per device
+    
+    One HAP put per thermostat, one batched write for the relay board and
+    concurrent Blueair calls; all groups run concurrently.
+    
+    Returns:
+        list of per-action results (same order as `actions`) with timings
+    """
+    results = [{'index': i, 'type': a.get('type') if isinstance(a, dict) else None}
+               for i, a in enumerate(actions)]
+    
+    thermostat_groups = {}  # device_id -> [index, ...]
+    relay_group = []
+    groups = []
+    
+    for index, action in enumerate(actions):
+        error = validate_batch_action(action)
+        if error is not None:
+            results[index].update({'success': False, 'error': error, 'elapsed_ms': 0})
+        elif action['type'] in ('set_temperature', 'set_mode'):
+            thermostat_groups.setdefault(action['device_id'], []).append(index)
+        elif action['type'] == 'relay':
+            relay_group.append(index)
+        elif action['type'] == 'blueair_fan':
+            groups.append(([index], control_blueair_fan(action.get('device_index', 0), action.get('speed', 0))))
+        else:
+            groups.append(([index], control_blueair_led(action.get('device_index', 0), action.get('brightness', 100))))
+    
+    for device_id, indexes in thermostat_groups.items():
+        groups.append((indexes, write_thermostat_batch(device_id, [actions[i] for i in indexes])))
+    if relay_group:
+        groups.append((relay_group, switch_relay_batch([actions[i] for i in relay_group])))
+    
+    await asyncio.gather(*(run_batch_group(indexes, coro, results) for indexes, coro in groups))
+    return results
+
+
+async def handle_batch(request):
+    """POST /api/batch - Run several thermostat, relay and Blueair actions at once"""
+    try:
+        data = await request.json()
+        actions = data.get('actions')
+        
+        if not isinstance(actions, list) or not actions:
+            return web.json_response({'error': 'actions list required'}, status=400)
+        
+        started = time.monotonic()
+        results = await execute_batch(actions)
+        return web.json_response({
+            'success': all(r['success'] for r in results),
+            'results': results,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        })
+    except Exception as e:
+        logger.error(f"Batch error: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+
 async def init_app():
     """Initialize the aiohttp application"""
     app = web.Application()
@@ -915,12 +2247,15 @@ async def init_app():
     app.router.add_post('/api/set-temperature', handle_set_temperature)
     app.router.add_post('/api/set-mode', handle_set_mode)
     app.router.add_get('/api/paired', handle_paired_devices)
+    app.router.add_get('/api/cache/stats', handle_cache_stats)
     
     # Routes - Relay Control
     app.router.add_get('/api/relay/status', handle_relay_status)
+    app.router.add_get('/api/relay/stats', handle_relay_stats)
     app.router.add_post('/api/relay/control', handle_relay_control)
     app.router.add_post('/api/system-state', handle_update_system_state)
     app.router.add_post('/api/interlock/evaluate', handle_evaluate_interlock)
+    app.router.add_get('/api/interlock/rules', handle_interlock_rules)
     
     # Routes - Blueair Control
     app.router.add_get('/api/blueair/status', handle_blueair_status)
@@ -928,8 +2263,22 @@ async def init_app():
     app.router.add_post('/api/blueair/led', handle_blueair_led)
     app.router.add_post('/api/blueair/dust-kicker', handle_dust_kicker)
     
+    # Routes - Timed sequences
+    app.router.add_get('/api/tasks', handle_tasks)
+    app.router.add_post('/api/tasks/cancel', handle_cancel_task)
+    
+    # Routes - History
+    app.router.add_get('/api/history', handle_history)
+    
+    # Routes - Batch
+    app.router.add_post('/api/batch', handle_batch)
+    
+    # Routes - Change stream
+    app.router.add_get('/api/stream', handle_stream)
+    app.router.add_get('/api/stream/stats', handle_stream_stats)
+    
     # Health check
-    app.router.add_get('/health', lambda r: web.json_response({'status': 'ok'}))
+    app.router.add_get('/health', handle_health)
     
     # Enable CORS for all routes
     for route in list(app.router.routes()):
@@ -942,44 +2291,59 @@ async def main():
     """Main entry point"""
     logger.info("Starting ProStat Bridge...")
     
-    # Initialize HomeKit controller
-    await init_controller()
-    
-    # Initialize relay (optional - service works without it)
-    await init_relay()
-    
-    # Initialize Blueair (optional - service works without it)
-    await init_blueair()
-    
-    # Create and run web server
+    # Create and run web server first, so /health answers while devices connect
     app = await init_app()
     
     # Run on all interfaces, port 8080
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, '0.0.0.0', 8080)
+    await site.start()
+    startup.mark('http')
+    
+    # Subsystems start concurrently, each within its own deadline; /health
+    # reports their readiness. Relay and Blueair are optional - the service
+    # works without them.
+    startup.start('homekit', init_homekit, INIT_DEADLINES['homekit'])
+    startup.start('relay', init_relay, INIT_DEADLINES['relay'], retry=False,
+                  probe=lambda: relay.connected)
+    startup.start('blueair', init_blueair, INIT_DEADLINES['blueair'],
+                  probe=lambda: blueair_connected)
+    
+    # Sensor history for /api/history
+    run_in_background(history_loop())
     
     logger.info("ProStat Bridge listening on http://0.0.0.0:8080")
     logger.info("API endpoints:")
     logger.info("  HomeKit:")
-    logger.info("    GET  /api/discover - Discover HomeKit devices")
+    logger.info("    GET  /api/discover - Discovered HomeKit devices (?refresh=1 to rescan)")
     logger.info("    POST /api/pair - Pair with device")
     logger.info("    GET  /api/status?device_id=... - Get thermostat status")
     logger.info("    POST /api/set-temperature - Set temperature")
     logger.info("    POST /api/set-mode - Set HVAC mode")
     logger.info("    GET  /api/paired - List paired devices")
+    logger.info("    GET  /api/cache/stats - Read cache hit/miss/coalesce counters")
     logger.info("  Relay Control:")
     logger.info("    GET  /api/relay/status - Get relay status")
+    logger.info("    GET  /api/relay/stats - Relay write counters and runtimes")
     logger.info("    POST /api/relay/control - Control relay manually")
     logger.info("    POST /api/system-state - Update system state for interlock")
     logger.info("    POST /api/interlock/evaluate - Evaluate interlock logic")
+    logger.info("    GET  /api/interlock/rules - Interlock rules and decisions")
     logger.info("  Blueair Control:")
     logger.info("    GET  /api/blueair/status - Get Blueair status")
     logger.info("    POST /api/blueair/fan - Control fan speed (0-3)")
     logger.info("    POST /api/blueair/led - Control LED brightness (0-100)")
     logger.info("    POST /api/blueair/dust-kicker - Start Dust Kicker cycle")
-    
-    await site.start()
+    logger.info("  Tasks:")
+    logger.info("    GET  /api/tasks - Running and recent timed sequences")
+    logger.info("    POST /api/tasks/cancel - Cancel a running sequence")
+    logger.info("  History:")
+    logger.info("    GET  /api/history?metric=...&from=...&to=...&res=... - Sensor history")
+    logger.info("  Batch:")
+    logger.info("    POST /api/batch - Run several actions in one request")
+    logger.info("  Change stream:")
+    logger.info("    GET  /api/stream - Server-sent events of state changes")
     
     # Keep running
     try:
@@ -987,7 +2351,12 @@ async def main():
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     finally:
+        await startup.shutdown()
+        await hap_browser.stop()
         await runner.cleanup()
+        await jobs.shutdown()
+        await relay.close()
+        history_store.flush()
 
 
 if __name__ == '__main__':
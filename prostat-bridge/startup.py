@@ -0,0 +1,198 @@
+"""
+Concurrent, deadline-bounded subsystem startup
+
+Each subsystem's init coroutine runs as its own task, so a slow or absent
+device (HomeKit accessory still booting, Blueair cloud unreachable) no
+longer holds up the others or the HTTP listener. An init function returns:
+
+- True: ready
+- False: not ready yet - retried in the background with backoff
+- None: nothing to start (not configured) - no retry
+
+An attempt that raises or outlives its deadline counts as False.
+
+    startup = Startup()
+    startup.start('blueair', init_blueair, deadline=20)
+    ...
+    startup.describe()  # For /health: state, attempts and timing per subsystem
+
+The timing breakdown is logged once every subsystem's first attempt is over.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subsystem:
+    """Startup state of one subsystem"""
+
+    __slots__ = ('name', 'deadline', 'retry', 'probe', 'state', 'attempts', 'error',
+                 'began', 'finished', 'next_retry')
+
+    def __init__(self, name, deadline, retry, probe):
+        self.name = name
+        self.deadline = deadline
+        self.retry = retry
+        self.probe = probe  # Live readiness once started (e.g. relay replugged later)
+        self.state = 'starting'  # starting, ready, retrying, unavailable, disabled
+        self.attempts = 0
+        self.error = None
+        self.began = None  # Seconds after Startup began
+        self.finished = None  # Seconds after Startup began (last attempt ended)
+        self.next_retry = None  # Unix time
+
+    @property
+    def ready(self):
+        if self.probe and self.state in ('ready', 'unavailable'):
+            return bool(self.probe())
+        return self.state == 'ready'
+
+
+class Startup:
+    """
+    Starts subsystems concurrently and records the startup timeline
+
+    Args:
+        retry_interval: First retry delay after a failed attempt (s)
+        max_retry_interval: Upper bound of the retry backoff (s)
+        on_ready: Optional callback with the name of each subsystem that becomes ready
+    """
+
+    def __init__(self, retry_interval=30.0, max_retry_interval=600.0, on_ready=None):
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.on_ready = on_ready
+        self.t0 = time.monotonic()
+        self.phases = {}  # name -> seconds after t0
+        self.subsystems = {}
+        self.tasks = set()
+        self.logged = False  # Breakdown logged once every first attempt is over
+
+    def elapsed(self):
+        return round(time.monotonic() - self.t0, 3)
+
+    def mark(self, phase):
+        """Record that a startup phase (e.g. 'http') completed now"""
+        self.phases[phase] = self.elapsed()
+        logger.info(f"Startup: {phase} at {self.phases[phase]:.3f}s")
+
+    def start(self, name, init, deadline, retry=True, probe=None):
+        """
+        Run init() in the background until it succeeds
+
+        Args:
+            name: Subsystem name for status and logs
+            init: Coroutine function; see module docstring for return values
+            deadline: Longest a single attempt may take (s)
+            retry: Retry a failed attempt (False when something else, like the
+                relay hot-plug supervisor, already keeps trying)
+            probe: Optional callable reporting live readiness after startup
+
+        Returns:
+            The task
+        """
+        subsystem = Subsystem(name, deadline, retry, probe)
+        self.subsystems[name] = subsystem
+        task = asyncio.create_task(self._run(subsystem, init), name=f"startup:{name}")
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _run(self, subsystem, init):
+        delay = self.retry_interval
+        subsystem.began = self.elapsed()
+        while True:
+            subsystem.attempts += 1
+            subsystem.next_retry = None
+            try:
+                result = await asyncio.wait_for(init(), subsystem.deadline)
+                subsystem.error = None if result or result is None else 'not available'
+            except asyncio.TimeoutError:
+                result = False
+                subsystem.error = f"timed out after {subsystem.deadline}s"
+            except Exception as e:
+                result = False
+                subsystem.error = str(e)
+            subsystem.finished = self.elapsed()
+
+            if result is None:
+                subsystem.state = 'disabled'
+                logger.info(f"Startup: {subsystem.name} disabled")
+            elif result:
+                subsystem.state = 'ready'
+                logger.info(f"Startup: {subsystem.name} ready at {subsystem.finished:.3f}s "
+                            f"(attempt {subsystem.attempts})")
+                if self.on_ready:
+                    self.on_ready(subsystem.name)
+            elif not subsystem.retry:
+                subsystem.state = 'unavailable'
+                logger.warning(f"Startup: {subsystem.name} unavailable: {subsystem.error}")
+            else:
+                subsystem.state = 'retrying'
+                subsystem.next_retry = time.time() + delay
+                logger.warning(f"Startup: {subsystem.name} not ready ({subsystem.error}), "
+                               f"retrying in {delay:.0f}s")
+
+            if not self.logged and all(s.state != 'starting' for s in self.subsystems.values()):
+                self.logged = True
+                self.log_breakdown()
+            if subsystem.state != 'retrying':
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_interval)
+
+    async def wait(self, timeout):
+        """
+        Wait up to `timeout` for every subsystem's first attempt to finish
+
+        Returns:
+            True if none is still on its first attempt
+        """
+        deadline = time.monotonic() + timeout
+        while any(s.state == 'starting' for s in self.subsystems.values()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(0.05, remaining))
+        return True
+
+    def log_breakdown(self):
+        """Log the startup timeline: phases, then each subsystem's outcome"""
+        logger.info("Startup timing:")
+        for phase, at in self.phases.items():
+            logger.info(f"  {phase:<12} {at:7.3f}s")
+        for subsystem in self.subsystems.values():
+            took = (f"{subsystem.finished - subsystem.began:7.3f}s"
+                    if subsystem.finished is not None else '    ...')
+            detail = f" ({subsystem.error})" if subsystem.error else ''
+            logger.info(f"  {subsystem.name:<12} {took} {subsystem.state}, "
+                        f"{subsystem.attempts} attempt(s){detail}")
+
+    async def shutdown(self):
+        """Cancel pending attempts and retries"""
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def describe(self):
+        return {
+            'uptime': self.elapsed(),
+            'phases': dict(self.phases),
+            'subsystems': {
+                name: {
+                    'state': subsystem.state,
+                    'ready': subsystem.ready,
+                    'attempts': subsystem.attempts,
+                    'init_time': (round(subsystem.finished - subsystem.began, 3)
+                                  if subsystem.finished is not None else None),
+                    'error': subsystem.error,
+                    'next_retry': subsystem.next_retry,
+                }
+                for name, subsystem in self.subsystems.items()
+            },
+        }
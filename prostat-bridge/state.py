@@ -0,0 +1,194 @@
+"""
+Typed system state with per-field change tracking
+
+One schema shared by server.py and asthma_shield.py. Field values live in
+__slots__ (no per-instance dict); alongside each field the state keeps the
+version and wall-clock time of its last change. Every update that changes
+something bumps the state's version once, so consumers remember the version
+they last saw and ask changed_since(version) for exactly the fields that
+changed after it - no copies or diffs of the whole state.
+
+Fields are declared as (name, type, default). Values are coerced to the
+field type on update (None is always allowed); unknown fields are rejected.
+
+    state = SystemState()
+    state.update({'indoor_humidity': 58})      # -> {'indoor_humidity': 58.0}
+    seen = state.version
+    state.occupancy = True                       # Tracked like update()
+    state.changed_since(seen)                    # -> {'occupancy': True}
+"""
+
+import time
+
+# Readings and actuator states shared by both control loops
+SYSTEM_STATE_FIELDS = (
+    ('indoor_temp', float, None),
+    ('indoor_humidity', float, None),
+    ('outdoor_temp', float, None),
+    ('pm25', float, None),  # µg/m³
+    ('tvoc', float, None),
+    ('hvac_mode', str, 'off'),  # 'off', 'heat', 'cool', 'auto'
+    ('hvac_running', bool, False),
+    ('hvac_fan_running', bool, False),  # Fan-only mode
+    ('occupancy', bool, False),  # From Ecobee motion sensor
+    ('dehumidifier_on', bool, False),
+    ('blueair_fan_speed', int, 0),  # 0-3 (0=off, 1=low, 2=med, 3=max)
+    ('blueair_led_brightness', int, 100),  # 0-100
+    ('last_update', str, None),  # ISO time of the last sensor update
+    ('last_circulation_kick', object, None),  # datetime (asthma_shield)
+)
+
+# Labels of string fields that are stored as numbers (index = stored value)
+CATEGORIES = {
+    'hvac_mode': ('off', 'heat', 'cool', 'auto'),
+}
+
+# Interlock sequences in progress (server.py)
+INTERLOCK_STATE_FIELDS = (
+    ('dust_kicker_active', bool, False),
+    ('dust_kicker_start_time', str, None),
+    ('noise_cancellation_active', bool, False),
+)
+
+
+def coerce(kind, value):
+    """Convert a value to a field's type (None passes through)"""
+    if value is None or kind is object or type(value) is kind:
+        return value
+    if kind is bool:
+        if isinstance(value, str):
+            return value.strip().lower() in ('1', 'true', 'yes', 'on')
+        return bool(value)
+    return kind(value)
+
+
+def recorded_fields(fields):
+    """Names of the fields a time-series store can hold (numbers, booleans, categories)"""
+    return tuple(name for name, kind, _ in fields if kind in (float, int, bool) or name in CATEGORIES)
+
+
+class TrackedState:
+    """
+    Base class - use define() to create a state class for a set of fields
+
+    Attributes:
+        version: Bumped once by every update() that changes a field
+    """
+
+    __slots__ = ('version', '_versions', '_stamps')
+
+    FIELDS = ()
+    _index = {}
+    _types = ()
+
+    @classmethod
+    def define(cls, name, fields):
+        """
+        Create a state class with one slot per field
+
+        Args:
+            fields: [(name, type, default), ...]
+        """
+        fields = tuple(fields)
+        names = [field[0] for field in fields]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate state fields in {name}")
+        return type(name, (cls,), {
+            '__slots__': tuple(names),
+            'FIELDS': fields,
+            '_index': {field: i for i, field in enumerate(names)},
+            '_types': tuple(field[1] for field in fields),
+        })
+
+    def __init__(self, **values):
+        set_slot = object.__setattr__
+        set_slot(self, 'version', 0)
+        set_slot(self, '_versions', [0] * len(self.FIELDS))
+        set_slot(self, '_stamps', [None] * len(self.FIELDS))
+        for name, kind, default in self.FIELDS:
+            set_slot(self, name, coerce(kind, values.pop(name, default)))
+        if values:
+            raise KeyError(f"Unknown state fields: {', '.join(sorted(values))}")
+
+    def __setattr__(self, name, value):
+        if name not in self._index:
+            raise AttributeError(f"{type(self).__name__} has no field {name!r}")
+        self.update({name: value})
+
+    def update(self, changes):
+        """
+        Apply changes; unchanged values are ignored
+
+        Returns:
+            {field: new value} for the fields that actually changed
+
+        Raises:
+            KeyError: Unknown field
+            ValueError/TypeError: Value can't be converted to the field type
+        """
+        diff = {}
+        for name, value in changes.items():
+            i = self._index.get(name)
+            if i is None:
+                raise KeyError(f"Unknown state field: {name}")
+            value = coerce(self._types[i], value)
+            if getattr(self, name) != value:
+                diff[name] = value
+
+        if diff:
+            version = self.version + 1
+            now = time.time()
+            set_slot = object.__setattr__
+            set_slot(self, 'version', version)
+            for name, value in diff.items():
+                i = self._index[name]
+                set_slot(self, name, value)
+                self._versions[i] = version
+                self._stamps[i] = now
+        return diff
+
+    def changed_since(self, version):
+        """{field: value} for fields changed after `version`"""
+        if version >= self.version:
+            return {}
+        return {name: getattr(self, name)
+                for (name, _, _), changed in zip(self.FIELDS, self._versions) if changed > version}
+
+    def changed_at(self, name):
+        """Unix time of a field's last change (None if never changed)"""
+        return self._stamps[self._index[name]]
+
+    def field_version(self, name):
+        return self._versions[self._index[name]]
+
+    # Read-only mapping interface, so existing dict-style readers keep working
+
+    def get(self, name, default=None):
+        if name not in self._index:
+            return default
+        return getattr(self, name)
+
+    def __getitem__(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def as_dict(self):
+        """Plain dict of all fields (for JSON responses)"""
+        return {name: getattr(self, name) for name in self._index}
+
+    def __repr__(self):
+        return f"{type(self).__name__}(version={self.version}, {self.as_dict()})"
+
+
+SystemState = TrackedState.define('SystemState', SYSTEM_STATE_FIELDS)
+InterlockState = TrackedState.define('InterlockState', INTERLOCK_STATE_FIELDS)
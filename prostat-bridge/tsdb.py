@@ -0,0 +1,392 @@
+"""
+Append-only columnar time-series store on disk
+
+Rows (a timestamp plus one value per field) are stored column by column in
+daily segments:
+
+    <root>/manifest.json          fields and category labels
+    <root>/2024-06-01/t.f64       timestamps, float64 Unix seconds
+    <root>/2024-06-01/<field>.f32 values, float32 (NaN = no reading)
+
+Every column is a flat array of fixed-width little-endian values, so row i
+of a segment is at offset i * width in each file. A range scan mmaps the
+segment's timestamp column, binary searches it and copies the matching
+slice of each requested column, without parsing anything.
+
+Appended rows are buffered in memory and written with one write + fsync
+per column on flush() (every few minutes), which keeps SD card writes few
+and large. Rows still buffered are lost on a power cut; a segment torn by
+one is repaired on the next flush by trimming or NaN-padding its value
+columns to the length of its timestamp column, which is written last.
+
+Booleans are stored as 0/1; string fields with a category list (e.g.
+hvac_mode) are stored as the label's index.
+
+One year of 10 s samples of 16 fields takes about 230 MB.
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+TIME_COLUMN = 't.f64'
+NAN = float('nan')
+MAX_TIME = 253402300799.0  # 9999-12-31, the last datetime can represent
+
+
+def segment_name(t):
+    """Daily segment (UTC date) holding time t"""
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d')
+
+
+def value_file(field):
+    return f"{field}.f32"
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_column(path, typecode, lo=0, hi=None, key=None):
+    """
+    Rows lo:hi of a column file, read through mmap
+
+    Args:
+        key: Instead of lo/hi, select the rows from bisect(key[0]) to
+            bisect(key[1]) (the column must be sorted)
+
+    Returns:
+        (lo, column array) - rows missing from the file are NaN
+    """
+    column = array(typecode)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        f = None
+    if f is not None:
+        with f:
+            size = os.fstat(f.fileno()).st_size // column.itemsize * column.itemsize
+            if size:
+                with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as raw, raw.cast(typecode) as view:
+                        if key is not None:
+                            lo = bisect_left(view, key[0])
+                            hi = bisect_left(view, key[1], lo)
+                        if hi is None or hi > len(view):
+                            hi_available = len(view)
+                        else:
+                            hi_available = hi
+                        if hi_available > lo:
+                            column.frombytes(raw[lo * column.itemsize:hi_available * column.itemsize])
+    if sys.byteorder != 'little':
+        column.byteswap()
+    if hi is not None and len(column) < hi - lo:
+        column.extend([NAN] * (hi - lo - len(column)))
+    return lo, column
+
+
+class TimeSeriesStore:
+    """
+    Daily-segmented columnar store
+
+    Args:
+        root: Store directory
+        fields: Field names; None reads them from the manifest (read-only use)
+        categories: {field: [label, ...]} for string fields
+        flush_interval: Seconds between automatic flushes (see maybe_flush)
+        retention_days: Segments older than this are deleted (None = keep all)
+    """
+
+    def __init__(self, root, fields=None, categories=None, flush_interval=300.0, retention_days=None):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        if fields is None:
+            with open(os.path.join(root, MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+            fields, categories = manifest['fields'], manifest.get('categories')
+            self.writable = False
+        else:
+            self.writable = True
+        self.fields = tuple(fields)
+        self.categories = {field: list(labels) for field, labels in (categories or {}).items()}
+        self._codes = {field: {label: i for i, label in enumerate(labels)}
+                       for field, labels in self.categories.items()}
+
+        self._lock = threading.Lock()
+        self._pending = {}  # segment -> (t array, [value array per field]) not yet on disk
+        self._writing = {}  # Same, while a flush is writing them
+        self._repaired = set()  # Segments checked since startup
+        self._last_time = None
+        self._last_flush = time.monotonic()
+        self.stats = {'rows': 0, 'flushes': 0, 'bytes_written': 0, 'errors': 0}
+
+        if self.writable:
+            os.makedirs(root, exist_ok=True)
+            manifest = {'fields': list(self.fields), 'categories': self.categories}
+            path = os.path.join(root, MANIFEST)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    current = json.load(f)
+            except (OSError, ValueError):
+                current = None
+            if current != manifest:
+                with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, indent=2)
+                os.replace(f"{path}.tmp", path)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def encode(self, field, value):
+        if value is None:
+            return NAN
+        codes = self._codes.get(field)
+        if codes is not None:
+            return float(codes.get(value, NAN))
+        return float(value)
+
+    def append(self, t, values):
+        """
+        Buffer one row
+
+        Args:
+            t: Unix time; clamped to the previous row's time if older
+            values: Mapping of field -> value (missing fields are NaN)
+        """
+        if self._last_time is not None and t < self._last_time:
+            t = self._last_time
+        self._last_time = t
+        row = [self.encode(field, values.get(field)) for field in self.fields]
+        with self._lock:
+            segment = segment_name(t)
+            pending = self._pending.get(segment)
+            if pending is None:
+                pending = self._pending[segment] = (array('d'), [array('f') for _ in self.fields])
+            pending[0].append(t)
+            for column, value in zip(pending[1], row):
+                column.append(value)
+        self.stats['rows'] += 1
+
+    def flush_due(self):
+        return bool(self._pending) and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def maybe_flush(self):
+        """flush() if flush_interval has passed since the last one"""
+        if self.flush_due():
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows to their segments and fsync (blocking I/O)"""
+        with self._lock:
+            self._writing, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        try:
+            for segment, (times, columns) in sorted(self._writing.items()):
+                self._write_segment(segment, times, columns)
+            self.stats['flushes'] += 1
+        except OSError as e:
+            self.stats['errors'] += 1
+            self._repaired.clear()  # A write may have stopped halfway
+            logger.error(f"Time-series flush failed, {sum(len(t) for t, _ in self._writing.values())} rows lost: {e}")
+        finally:
+            self._writing = {}
+        if self.retention_days is not None:
+            self.prune()
+
+    def _write_segment(self, segment, times, columns):
+        directory = os.path.join(self.root, segment)
+        created = not os.path.isdir(directory)
+        os.makedirs(directory, exist_ok=True)
+        if segment not in self._repaired:
+            self._repair(directory)
+            self._repaired.add(segment)
+
+        # Values first, timestamps last: the timestamp column's length is the
+        # number of complete rows
+        for field, column in zip(self.fields, columns):
+            self._append_file(os.path.join(directory, value_file(field)), column)
+        self._append_file(os.path.join(directory, TIME_COLUMN), times)
+        if created:
+            fsync_dir(directory)
+            fsync_dir(self.root)
+
+    def _append_file(self, path, column):
+        if sys.byteorder != 'little':
+            column = array(column.typecode, column)
+            column.byteswap()
+        data = column.tobytes()
+        with open(path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats['bytes_written'] += len(data)
+
+    def _repair(self, directory):
+        """Bring every value column to the timestamp column's length"""
+        try:
+            rows = os.path.getsize(os.path.join(directory, TIME_COLUMN)) // 8
+        except FileNotFoundError:
+            rows = 0
+        nan = array('f', [NAN]).tobytes()
+        for field in self.fields:
+            path = os.path.join(directory, value_file(field))
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size == rows * 4:
+                continue
+            logger.warning(f"Repairing {path}: {size // 4} values for {rows} rows")
+            with open(path, 'ab') as f:
+                if size > rows * 4:
+                    f.truncate(rows * 4)
+                else:
+                    f.write(nan * (rows - size // 4))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def prune(self):
+        """Delete segments older than retention_days"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).strftime('%Y-%m-%d')
+        for segment in self.segments():
+            if segment < cutoff:
+                shutil.rmtree(os.path.join(self.root, segment), ignore_errors=True)
+                logger.info(f"Deleted time-series segment {segment}")
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def segments(self):
+        """Segment names on disk, oldest first"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if len(name) == 10 and name[4] == '-' and name[7] == '-')
+
+    def _buffered(self):
+        """Buffered rows per segment, oldest first (a flush may be writing some)"""
+        buffered = {}
+        with self._lock:
+            for batch in (self._writing, self._pending):
+                for segment, rows in batch.items():
+                    buffered.setdefault(segment, []).append(rows)
+        return buffered
+
+    def scan(self, start, end, fields=None):
+        """
+        Rows with start <= t < end, including rows not flushed yet
+
+        Args:
+            fields: Fields to read (default: all)
+
+        Returns:
+            (t array('d'), {field: array('f')})
+
+        Raises:
+            KeyError: Unknown field
+        """
+        fields = self.fields if fields is None else tuple(fields)
+        times = array('d')
+        columns = {field: array('f') for field in fields}
+        for segment_times, segment_columns in self.scan_segments(start, end, fields):
+            times.extend(segment_times)
+            for field in fields:
+                columns[field].extend(segment_columns[field])
+        return times, columns
+
+    def scan_segments(self, start, end, fields=None):
+        """
+        Like scan(), one daily segment at a time, so a long range need not
+        be held in memory at once
+
+        Yields:
+            (t array('d'), {field: array('f')}) per segment with rows in range
+
+        Raises:
+            KeyError: Unknown field
+        """
+        fields = self.fields if fields is None else tuple(fields)
+        for field in fields:
+            if field not in self.fields:
+                raise KeyError(f"Unknown field: {field}")
+
+        first = segment_name(min(max(start, 0), MAX_TIME))
+        last = segment_name(min(max(end, 0), MAX_TIME))
+        buffered = self._buffered()
+
+        for segment in sorted(set(self.segments()) | buffered.keys()):
+            if not first <= segment <= last:
+                continue
+            times = array('d')
+            columns = {field: array('f') for field in fields}
+            batches = buffered.get(segment, ())
+            # Rows being flushed may already be on disk; take them from memory
+            disk_end = min(end, batches[0][0][0]) if batches else end
+            directory = os.path.join(self.root, segment)
+            lo, chunk = read_column(os.path.join(directory, TIME_COLUMN), 'd', key=(start, disk_end))
+            if chunk:
+                times.extend(chunk)
+                for field in fields:
+                    path = os.path.join(directory, value_file(field))
+                    columns[field].extend(read_column(path, 'f', lo, lo + len(chunk))[1])
+            for segment_times, segment_columns in batches:
+                lo = bisect_left(segment_times, start)
+                hi = bisect_left(segment_times, end, lo)
+                times.extend(segment_times[lo:hi])
+                for field in fields:
+                    columns[field].extend(segment_columns[self.fields.index(field)][lo:hi])
+            if times:
+                yield times, columns
+
+    def first_time(self):
+        """Time of the oldest row (flushed or not), or None if the store is empty"""
+        buffered = self._buffered()
+        for segment in sorted(set(self.segments()) | buffered.keys()):
+            _, first = read_column(os.path.join(self.root, segment, TIME_COLUMN), 'd', 0, 1)
+            if not math.isnan(first[0]):
+                return first[0]
+            if segment in buffered:
+                return buffered[segment][0][0][0]
+        return None
+
+    def decode(self, field, column):
+        """Stored values of a field as Python values (labels for category fields, None for NaN)"""
+        labels = self.categories.get(field)
+        if labels is None:
+            return [None if math.isnan(value) else value for value in column]
+        return [None if math.isnan(value) else labels[int(value)] for value in column]
+
+    def describe(self):
+        """Segment count, time range, disk usage and write counters"""
+        segments = self.segments()
+        size = 0
+        for segment in segments:
+            directory = os.path.join(self.root, segment)
+            size += sum(entry.stat().st_size for entry in os.scandir(directory))
+        return {
+            'root': self.root,
+            'fields': list(self.fields),
+            'segments': len(segments),
+            'first_segment': segments[0] if segments else None,
+            'last_segment': segments[-1] if segments else None,
+            'disk_bytes': size,
+            'pending_rows': sum(len(times) for times, _ in self._pending.values()),
+            **self.stats,
+        }